@@ -0,0 +1,220 @@
+import asyncio
+import json
+import logging
+import math
+from typing import Union
+
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.security import SecurityScopes
+from pydantic import ValidationError
+
+from app.api import crud
+from app.api.users import get_current_user, get_current_active_user
+from app.config import get_settings, Settings
+from app.policy import Resource, get_enforcer
+from app.ratelimit import RateLimits
+from app.models.pydantic import (
+    HighlightEditSchema,
+    HighlightEditAckSchema,
+    HighlightPayloadSchema,
+    CurrentUserSchema,
+)
+
+log = logging.getLogger("uvicorn")
+
+router = APIRouter()
+
+
+class HighlightEditCoalescer:
+    """
+    Collects highlight edits received on one connection, keeping only the
+    latest payload per highlight along with every sequence number it replaced.
+    """
+
+    def __init__(self) -> None:
+        self._pending: dict[int, tuple[list[int], HighlightPayloadSchema]] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, edit: HighlightEditSchema) -> None:
+        seqs, _ = self._pending.get(edit.id, ([], None))
+        seqs.append(edit.seq)
+        payload = HighlightPayloadSchema(
+            doi=edit.doi, highlight=edit.highlight, comment=edit.comment
+        )
+        self._pending[edit.id] = (seqs, payload)
+
+    def drain(self) -> dict[int, tuple[list[int], HighlightPayloadSchema]]:
+        pending, self._pending = self._pending, {}
+        return pending
+
+
+def edit_ack(result: Union[dict, ValueError, None]) -> dict:
+    """
+    Translate a crud.put_highlights result into the status the REST
+    endpoint would have returned for the same edit.
+    """
+    if result is None:
+        return {"status": 404, "detail": "highlight not found"}
+    if isinstance(result, ValueError):
+        if isinstance(result, crud.NotOwnerError):
+            return {"status": 403, "detail": "Not authorized to update this highlight"}
+        return {"status": 422, "detail": f"Value error, {str(result)}"}
+    return {"status": 200}
+
+
+async def put_as_permitted(
+    current_user: CurrentUserSchema, edits: list[tuple[int, HighlightPayloadSchema]]
+) -> list[Union[dict, ValueError, None]]:
+    """
+    crud.put_highlights for the edits the policy lets the current user
+    make, each made as its highlight's owner, as write_as_permitted does
+    for one REST write.
+
+    The batch is first written as the user's own highlights. Edits refused
+    as someone else's are decided again for the real owner and, if allowed,
+    written as them; the others keep their NotOwnerError.
+    """
+    policy = get_enforcer()
+    if policy.enforce(current_user, "/highlights/id/", "PUT", Resource(current_user.id)):
+        results = await crud.put_highlights(edits, current_user.id)
+    else:
+        # Not even the user's own highlights: only ones the policy lets
+        # them edit for their owner can be written.
+        results = []
+        for id, _ in edits:
+            owner_id = await crud.get_highlight_owner(id)
+            results.append(None if owner_id is None else crud.NotOwnerError(owner_id))
+    retries: dict[int, list[int]] = {}
+    for i, result in enumerate(results):
+        if isinstance(result, crud.NotOwnerError) and policy.enforce(
+            current_user, "/highlights/id/", "PUT", Resource(result.owner_id)
+        ):
+            retries.setdefault(result.owner_id, []).append(i)
+    for owner_id, indexes in retries.items():
+        retried = await crud.put_highlights([edits[i] for i in indexes], owner_id)
+        for i, result in zip(indexes, retried):
+            results[i] = result
+    return results
+
+
+def parse_edit(text: str) -> tuple[Union[HighlightEditSchema, None], dict]:
+    """
+    Validate one client message, returning the edit or a 422 acknowledgement.
+    """
+    try:
+        return HighlightEditSchema.model_validate_json(text), {}
+    except ValidationError as e:
+        seq = None
+        try:
+            message = json.loads(text)
+            if isinstance(message, dict) and isinstance(message.get("seq"), int):
+                seq = message["seq"]
+        except ValueError:
+            pass
+        return None, {"seq": seq, "status": 422, "detail": jsonable_encoder(e.errors())}
+
+
+async def authenticate_websocket(websocket: WebSocket, token: Union[str, None]) -> Union[CurrentUserSchema, None]:
+    if token is None:
+        scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and credentials:
+            token = credentials
+    if not token:
+        return None
+    try:
+        # The channel edits highlights, so an API key needs to be allowed to.
+        return await get_current_active_user(await get_current_user(token, SecurityScopes(["highlights:write"])))
+    except HTTPException:
+        return None
+
+
+@router.websocket("/ws")
+async def highlight_edit_channel(
+    websocket: WebSocket,
+    settings: Settings = Depends(get_settings),
+    token: Union[str, None] = None,
+):
+    """
+    Stream highlight edits over a single authenticated connection.
+
+    Edits to the same highlight that arrive within the coalescing window are
+    merged so only the latest one is written; every edit is still acknowledged
+    with its own `seq`. Each write counts against the user's highlight write
+    limit, as on the REST endpoints; edits over it are acknowledged with 429
+    and `retry_after` seconds, and not written.
+    """
+    current_user = await authenticate_websocket(websocket, token)
+    if current_user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+
+    rate_limits: RateLimits = websocket.app.state.resources.rate_limits
+    coalescer = HighlightEditCoalescer()
+    window = settings.highlight_edit_window_ms / 1000
+    flush_lock = asyncio.Lock()
+    send_lock = asyncio.Lock()
+    connected = True
+    flush_task = None
+
+    async def send_acks(acks: list[dict]) -> None:
+        nonlocal connected
+        async with send_lock:
+            for ack in acks:
+                if not connected:
+                    return
+                try:
+                    await websocket.send_json(
+                        HighlightEditAckSchema(**ack).model_dump(exclude_none=True)
+                    )
+                except (WebSocketDisconnect, RuntimeError):
+                    connected = False
+
+    async def flush() -> None:
+        async with flush_lock:
+            batch = coalescer.drain()
+            if not batch:
+                return
+            edits = [(id, payload) for id, (_, payload) in batch.items()]
+            wait = None
+            if rate_limits.enabled:
+                wait = await rate_limits.highlight_writes.count(str(current_user.id), len(edits))
+            if wait is not None:
+                results = [{"status": 429, "detail": "Too many requests", "retry_after": max(1, math.ceil(wait))}] * len(edits)
+            else:
+                try:
+                    results = [edit_ack(result) for result in await put_as_permitted(current_user, edits)]
+                except Exception:
+                    log.exception("Failed to flush %d highlight edits", len(edits))
+                    results = [{"status": 500, "detail": "edit not saved"}] * len(edits)
+        await send_acks([
+            {"seq": seq, "id": id, **result}
+            for (id, (seqs, _)), result in zip(batch.items(), results)
+            for seq in seqs
+        ])
+
+    async def flush_later() -> None:
+        await asyncio.sleep(window)
+        await flush()
+
+    try:
+        while True:
+            edit, ack = parse_edit(await websocket.receive_text())
+            if edit is None:
+                await send_acks([ack])
+                continue
+            coalescer.add(edit)
+            if len(coalescer) >= settings.highlight_edit_max_batch:
+                await flush()
+            elif flush_task is None or flush_task.done():
+                flush_task = asyncio.create_task(flush_later())
+    except WebSocketDisconnect:
+        connected = False
+    finally:
+        # Edits already received are written even if the client went away.
+        if flush_task is not None:
+            await flush_task
+        await flush()
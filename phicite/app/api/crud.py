@@ -1,5 +1,14 @@
+import json
+from collections.abc import AsyncIterator
+from datetime import datetime
 from typing import Union, List
 
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import F, Q
+from tortoise.functions import Count, Max
+from tortoise import connections
+from tortoise.transactions import in_transaction
+
 from app.models.pydantic import (
     SummaryPayloadSchema,
     SummaryUpdatePayloadSchema,
@@ -9,8 +18,10 @@ from app.models.pydantic import (
     UserInDBSchema,
     TokenDataSchema
 )
-from app.models.tortoise import TextSummary, PDFHighlight, User as UserDB
+from app.models.tortoise import TextSummary, PDFHighlight, HighlightPart, DOIStats, RevokedToken, UserSession, ApiKey, PolicySet, PolicyRule, User as UserDB
 from app.auth import get_password_hash
+from app.db import execute_sql, iterate_sql, sql_in
+from app.doi import doi_key
 
 async def post_user(user: UserCreate) -> Union[dict, None]:
     """
@@ -51,6 +62,9 @@ async def post_user(user: UserCreate) -> Union[dict, None]:
 async def delete_user_in_db_by_username(username: str) -> Union[dict, None]:
     """
     Delete a user by username.
+
+    The user's highlights are removed by the database's ON DELETE CASCADE,
+    so their contribution to doi_stats is subtracted first.
     
     Args:
         username: The username of the user to delete
@@ -60,11 +74,136 @@ async def delete_user_in_db_by_username(username: str) -> Union[dict, None]:
     """
     user = await UserDB.filter(username=username).first()
     if user:
-        await user.delete()
+        async with in_transaction():
+            await execute_sql(
+                """
+                UPDATE "doi_stats"
+                SET "highlight_count" = "doi_stats"."highlight_count" - "doi_reader"."highlight_count",
+                    "reader_count" = "doi_stats"."reader_count" - 1
+                FROM "doi_reader"
+                WHERE "doi_reader"."doi" = "doi_stats"."doi" AND "doi_reader"."user_id" = $1
+                """,
+                [user.id],
+            )
+            await user.delete()
         return {"message": "User deleted successfully"}
     else:
         return {"message": "User not found"}
 
+async def post_token_revocation(
+    jti: Union[str, None], user_id: Union[int, None], revoked_at: datetime, expires_at: datetime
+) -> None:
+    """
+    Record the revocation of one access token (jti) or of every token
+    issued to a user before revoked_at (user_id).
+    """
+    await RevokedToken.create(jti=jti, user_id=user_id, revoked_at=revoked_at, expires_at=expires_at)
+
+async def get_token_revocations(now: datetime) -> List:
+    """
+    The revocations whose tokens have not expired yet, after deleting the
+    rest.
+    """
+    await RevokedToken.filter(expires_at__lte=now).delete()
+    return await RevokedToken.filter(expires_at__gt=now).values("jti", "user_id", "revoked_at")
+
+async def post_session(user_id: int, token_hash: str, expires_at: datetime) -> int:
+    """
+    Start a session for a user and return its id.
+    """
+    session = await UserSession.create(user_id=user_id, token_hash=token_hash, expires_at=expires_at)
+    return session.id
+
+async def get_session(id: int) -> Union[UserSession, None]:
+    return await UserSession.filter(id=id).first()
+
+async def rotate_session(id: int, generation: int, new_hash: str, now: datetime, expires_at: datetime) -> bool:
+    """
+    Move a live session on to its next token, provided it is still at
+    `generation`: of two renewals racing with the same refresh token, only
+    one succeeds.
+    """
+    updated = await UserSession.filter(
+        id=id, generation=generation, revoked_at=None, expires_at__gt=now
+    ).update(token_hash=new_hash, generation=generation + 1, expires_at=expires_at)
+    return updated == 1
+
+async def revoke_session(id: int, now: datetime) -> None:
+    await UserSession.filter(id=id, revoked_at=None).update(revoked_at=now)
+
+async def revoke_user_sessions(user_id: int, now: datetime) -> int:
+    """
+    End every live session of a user; returns how many there were.
+    """
+    return await UserSession.filter(user_id=user_id, revoked_at=None).update(revoked_at=now)
+
+async def prune_sessions(now: datetime) -> int:
+    """
+    Delete sessions that have expired or been ended; returns how many.
+    """
+    return await UserSession.filter(Q(expires_at__lte=now) | Q(revoked_at__isnull=False)).delete()
+
+async def post_api_key(user_id: int, name: str, prefix: str, key_hash: str, scopes: list[str]) -> ApiKey:
+    return await ApiKey.create(user_id=user_id, name=name, prefix=prefix, key_hash=key_hash, scopes=scopes)
+
+async def get_api_key_by_prefix(prefix: str) -> Union[ApiKey, None]:
+    """
+    The live API key with this prefix, with its user, if there is one.
+    """
+    return await ApiKey.filter(prefix=prefix, revoked_at=None).select_related("user").first()
+
+async def get_api_keys(user_id: int) -> List:
+    return await ApiKey.filter(user_id=user_id, revoked_at=None).order_by("id").values(
+        "id", "name", "prefix", "scopes", "created_at"
+    )
+
+async def revoke_api_key(id: int, user_id: int, now: datetime) -> Union[str, None]:
+    """
+    Revoke one of a user's API keys; returns its prefix, or None if the
+    user has no such live key.
+    """
+    api_key = await ApiKey.filter(id=id, user_id=user_id, revoked_at=None).first()
+    if api_key is None:
+        return None
+    api_key.revoked_at = now
+    await api_key.save(update_fields=["revoked_at"])
+    return api_key.prefix
+
+async def post_policy_set(rules: List[tuple[str, str, str]], comment: Union[str, None], now: datetime) -> PolicySet:
+    """
+    Store a policy set of (sub_rule, obj, act) rules, activated at `now`.
+    """
+    async with in_transaction():
+        policy_set = await PolicySet.create(comment=comment, activated_at=now)
+        await PolicyRule.bulk_create([
+            PolicyRule(policy_set_id=policy_set.id, sub_rule=sub_rule, obj=obj, act=act)
+            for sub_rule, obj, act in rules
+        ])
+    return policy_set
+
+async def activate_policy_set(id: int, now: datetime) -> bool:
+    return await PolicySet.filter(id=id).update(activated_at=now) == 1
+
+async def get_active_policy_set() -> Union[dict, None]:
+    """
+    The id of the policy set activated last and when it was, which together
+    identify the policy in force; None while no set has been published.
+    """
+    rows = await PolicySet.filter(activated_at__isnull=False).order_by("-activated_at", "-id").limit(1).values(
+        "id", "activated_at"
+    )
+    return rows[0] if rows else None
+
+async def get_policy_sets() -> List:
+    return await PolicySet.all().order_by("-id").values("id", "comment", "created_at", "activated_at")
+
+async def get_policy_set(id: int) -> Union[dict, None]:
+    rows = await PolicySet.filter(id=id).values("id", "comment", "created_at", "activated_at")
+    return rows[0] if rows else None
+
+async def get_policy_rules(policy_set_id: int) -> List[tuple[str, str, str]]:
+    return await PolicyRule.filter(policy_set_id=policy_set_id).order_by("id").values_list("sub_rule", "obj", "act")
+
 async def get_user_in_db_by_username(username: str) -> Union[dict, None]:
     """
     Retrieve a user by username.
@@ -149,14 +288,25 @@ async def post_summary(payload: SummaryPayloadSchema) -> int:
     return summary.id
 
 
+async def get_pending_summaries(max_attempts: int) -> List:
+    """
+    The id and url of every summary still empty (being generated, failed,
+    or interrupted by a shutdown before it was written) after fewer than
+    max_attempts attempts.
+    """
+    return await TextSummary.filter(summary="", attempts__lt=max_attempts).order_by("id").values("id", "url")
+
+async def count_summary_attempt(id: int) -> None:
+    await TextSummary.filter(id=id).update(attempts=F("attempts") + 1)
+
 async def get_summary(id: int) -> Union[dict, None]:
-    summary = await TextSummary.filter(id=id).first().values()
+    summary = await TextSummary.filter(id=id).first().values("id", "url", "summary", "created_at")
     if summary:
         return summary
     return None
 
 async def get_all_summaries() -> List:
-    summaries = await TextSummary.all().values()
+    summaries = await TextSummary.all().values("id", "url", "summary", "created_at")
     return summaries
 
 async def delete_summary(id: int) -> int:
@@ -164,21 +314,129 @@ async def delete_summary(id: int) -> int:
     return summary
 
 async def put_summary(id: int, payload: SummaryUpdatePayloadSchema) -> Union[dict, None]:
-    summary = await TextSummary.filter(id=id).update(url=payload.url, summary=payload.summary)
-    if summary:
-        updated_summary = await TextSummary.filter(id=id).first().values()
-        return updated_summary
-    return None
+    rows = await execute_sql(
+        """
+        UPDATE "textsummary" SET "url" = $2, "summary" = $3 WHERE "id" = $1
+        RETURNING "id", "url", "summary", "created_at"
+        """,
+        [id, str(payload.url), payload.summary],
+    )
+    return rows[0] if rows else None
 
-async def post_highlight(payload: HighlightPayloadSchema, user_id: int) -> Union[dict, None]:
-    user = await UserDB.get(id=user_id)
-    highlight = PDFHighlight(
-        doi=payload.doi,
-        highlight=payload.highlight,
-        comment=payload.comment,
-        user=user
+async def increment_doi_stats(doi: str, user_id: int) -> None:
+    """
+    Count a new highlight by user_id on doi in doi_stats.
+
+    Must run in the same transaction as the insert it accounts for.
+    """
+    readers = await execute_sql(
+        """
+        INSERT INTO "doi_reader" ("doi", "user_id", "highlight_count") VALUES ($1, $2, 1)
+        ON CONFLICT ("doi", "user_id")
+        DO UPDATE SET "highlight_count" = "doi_reader"."highlight_count" + 1
+        RETURNING "highlight_count"
+        """,
+        [doi, user_id],
+    )
+    new_reader = 1 if readers[0]["highlight_count"] == 1 else 0
+    await execute_sql(
+        """
+        INSERT INTO "doi_stats" ("doi", "highlight_count", "reader_count") VALUES ($1, 1, $2)
+        ON CONFLICT ("doi")
+        DO UPDATE SET "highlight_count" = "doi_stats"."highlight_count" + 1,
+                      "reader_count" = "doi_stats"."reader_count" + $2
+        """,
+        [doi, new_reader],
     )
-    await highlight.save()
+
+async def decrement_doi_stats(doi: str, user_id: int) -> None:
+    """
+    Remove a deleted highlight by user_id on doi from doi_stats.
+
+    Must run in the same transaction as the delete it accounts for.
+    """
+    readers = await execute_sql(
+        """
+        UPDATE "doi_reader" SET "highlight_count" = "highlight_count" - 1
+        WHERE "doi" = $1 AND "user_id" = $2
+        RETURNING "highlight_count"
+        """,
+        [doi, user_id],
+    )
+    left_reader = 0
+    if readers and readers[0]["highlight_count"] <= 0:
+        await execute_sql(
+            'DELETE FROM "doi_reader" WHERE "doi" = $1 AND "user_id" = $2', [doi, user_id]
+        )
+        left_reader = 1
+    await execute_sql(
+        """
+        UPDATE "doi_stats" SET "highlight_count" = "highlight_count" - 1,
+                               "reader_count" = "reader_count" - $2
+        WHERE "doi" = $1
+        """,
+        [doi, left_reader],
+    )
+
+async def get_doi_stats(dois: List[str]) -> List:
+    """
+    Retrieve highlight and reader counts for each DOI.
+
+    Args:
+        dois: The DOIs to look up
+
+    Returns:
+        One entry per requested DOI, in order; DOIs nobody has highlighted
+        have zero counts
+    """
+    stats = {
+        entry["doi"]: entry
+        for entry in await DOIStats.filter(doi__in=dois).values("doi", "highlight_count", "reader_count")
+    }
+    return [
+        stats.get(doi, {"doi": doi, "highlight_count": 0, "reader_count": 0})
+        for doi in dois
+    ]
+
+def is_foreign_key_violation(e: IntegrityError) -> bool:
+    """
+    Whether Tortoise's IntegrityError wraps a foreign key violation: SQLSTATE
+    23503 from asyncpg, or sqlite's "FOREIGN KEY constraint failed".
+    """
+    cause = e.args[0] if e.args else e
+    sqlstate = getattr(cause, "sqlstate", None)
+    if sqlstate is not None:
+        return sqlstate == "23503"
+    return "FOREIGN KEY" in str(cause)
+
+async def post_highlight(payload: HighlightPayloadSchema, user_id: int) -> Union[dict, None]:
+    """
+    Insert a highlight for an already authenticated user.
+
+    The foreign key is set from user_id directly rather than by fetching
+    the user; created_at is filled in before the insert is sent. The
+    highlight's parts and the DOI's statistics are written in the same
+    transaction.
+
+    Raises:
+        ValueError: If no user with user_id exists
+    """
+    try:
+        async with in_transaction():
+            highlight = await PDFHighlight.create(
+                doi=payload.doi,
+                highlight=payload.stored_highlight(),
+                comment=payload.comment,
+                user_id=user_id,
+            )
+            await HighlightPart.bulk_create(
+                HighlightPart.from_stored(highlight.id, highlight.doi_key, highlight.highlight)
+            )
+            await increment_doi_stats(payload.doi, user_id)
+    except IntegrityError as e:
+        if not is_foreign_key_violation(e):
+            raise
+        raise ValueError(f"User {user_id} does not exist") from e
     return highlight.id, highlight.created_at
 
 async def get_highlight_public(id: int) -> Union[dict, None]:
@@ -190,7 +448,7 @@ async def get_highlight_public(id: int) -> Union[dict, None]:
     return None
 
 async def get_highlight(id: int) -> Union[dict, None]:
-    highlight = await PDFHighlight.filter(id=id).prefetch_related('user').first()
+    highlight = await PDFHighlight.filter(id=id).select_related('user').first()
     if highlight:
         highlight_dict = dict(highlight)
         highlight_dict['username'] = highlight.user.username
@@ -199,7 +457,7 @@ async def get_highlight(id: int) -> Union[dict, None]:
     return None
 
 async def get_all_highlights() -> List:
-    highlights = await PDFHighlight.all().prefetch_related('user')
+    highlights = await PDFHighlight.all().select_related('user')
     if highlights:
         highlight_list = []
         for highlight in highlights:
@@ -221,8 +479,16 @@ async def get_all_highlights_public() -> List:
         return highlight_list
     return None
 
+def doi_key_matches(doi: str) -> Q:
+    """
+    The doi_key condition for highlights of `doi`. Rows created before the
+    column existed keep a NULL key until app.backfill reaches them, and
+    still match on the DOI itself.
+    """
+    return Q(doi_key=doi_key(doi)) | Q(doi_key__isnull=True)
+
 async def get_highlights_for_doi(doi: str) -> Union[List, None]:
-    highlights = await PDFHighlight.filter(doi=doi).prefetch_related('user').all()
+    highlights = await PDFHighlight.filter(doi_key_matches(doi), doi=doi).select_related('user').all()
     if highlights:
         highlight_list = []
         for highlight in highlights:
@@ -234,7 +500,7 @@ async def get_highlights_for_doi(doi: str) -> Union[List, None]:
     return None
 
 async def get_highlights_for_doi_public(doi: str) -> Union[List, None]:
-    highlights = await PDFHighlight.filter(doi=doi).all()
+    highlights = await PDFHighlight.filter(doi_key_matches(doi), doi=doi).all()
     if highlights:
         highlight_list = []
         for highlight in highlights:
@@ -244,55 +510,259 @@ async def get_highlights_for_doi_public(doi: str) -> Union[List, None]:
         return highlight_list
     return None
 
+def iterate_highlights_for_dois_public(dois: List[str], limit_per_doi: int) -> AsyncIterator[dict]:
+    """
+    Read the first highlights of several DOIs with one query, row by row.
+
+    Args:
+        dois: The DOIs to look up
+        limit_per_doi: The maximum number of highlights returned per DOI
+
+    Returns:
+        The rows ordered by DOI, then id, read through a cursor (see
+        iterate_sql). `highlight` is left as the JSON text the database
+        returned so it can be written out without re-encoding. On Postgres
+        each DOI is a LATERAL subquery that stops after limit_per_doi rows
+        of the (doi_key, id) index, however many highlights the DOI has.
+    """
+    keys = [doi_key(doi) for doi in dois]
+    if connections.get("default").capabilities.dialect == "postgres":
+        return iterate_sql(
+            """
+            SELECT h."id", h."doi", h."highlight", h."comment", h."created_at"
+            FROM unnest($1::bigint[], $2::text[]) AS d("doi_key", "doi")
+            CROSS JOIN LATERAL (
+                SELECT "id", "doi", "highlight", "comment", "created_at"
+                FROM "pdfhighlight"
+                WHERE ("doi_key" = d."doi_key" OR "doi_key" IS NULL) AND "doi" = d."doi"
+                ORDER BY "id"
+                LIMIT $3
+            ) AS h
+            ORDER BY h."doi", h."id"
+            """,
+            [keys, list(dois), limit_per_doi],
+        )
+    key_condition, keys = sql_in('"doi_key"', keys)
+    doi_condition, values = sql_in('"doi"', dois, position=len(keys) + 1)
+    return iterate_sql(
+        f"""
+        SELECT "id", "doi", "highlight", "comment", "created_at" FROM (
+            SELECT "id", "doi", "highlight", "comment", "created_at",
+                   ROW_NUMBER() OVER (PARTITION BY "doi" ORDER BY "id") AS "position"
+            FROM "pdfhighlight"
+            WHERE ({key_condition} OR "doi_key" IS NULL) AND {doi_condition}
+        ) AS "ranked"
+        WHERE "position" <= ${len(keys) + len(values) + 1}
+        ORDER BY "doi", "id"
+        """,
+        [*keys, *values, limit_per_doi],
+    )
+
+class NotOwnerError(ValueError):
+    """
+    The highlight belongs to another user, `owner_id`.
+    """
+    def __init__(self, owner_id: int) -> None:
+        super().__init__("User does not own this highlight")
+        self.owner_id = owner_id
+
+async def get_highlight_owner(id: int) -> Union[int, None]:
+    rows = await execute_sql('SELECT "user_id" FROM "pdfhighlight" WHERE "id" = $1', [id])
+    return rows[0]["user_id"] if rows else None
 
 async def delete_highlight(id: int, user_id: int) -> Union[dict, None]:
-    highlight = await PDFHighlight.filter(id=id).prefetch_related('user').first()
+    """
+    Delete a highlight owned by the given user.
+
+    The ownership check is part of the DELETE itself; the owner is only
+    looked up when nothing was deleted, to tell a missing highlight from
+    someone else's.
 
-    if not highlight:
+    Raises:
+        NotOwnerError: If the highlight belongs to another user
+    """
+    async with in_transaction():
+        deleted = await execute_sql(
+            'DELETE FROM "pdfhighlight" WHERE "id" = $1 AND "user_id" = $2 RETURNING "id", "doi"',
+            [id, user_id],
+        )
+        if deleted:
+            await decrement_doi_stats(deleted[0]["doi"], user_id)
+            return {"id": deleted[0]["id"]}
+
+    owner_id = await get_highlight_owner(id)
+    if owner_id is None:
         return None
+    raise NotOwnerError(owner_id)
 
-    if highlight.user.id != user_id:
-        raise ValueError("User does not own this highlight")
-    print("in delete highlight")
-    print(f"highlight.user.id: {highlight.user.id}")
-    print(f"user_id: {user_id}")
+async def replace_highlight_parts(highlight_id: int, doi: str, highlight: dict) -> None:
+    """
+    Rewrite the highlight_part rows of a highlight from its stored JSON.
+    """
+    await HighlightPart.filter(highlight_id=highlight_id).delete()
+    await HighlightPart.bulk_create(HighlightPart.from_stored(highlight_id, doi_key(doi), highlight))
 
-    highlight_data = {"id": highlight.id}
+async def get_highlight_parts_for_page(
+    doi: str, page: int, bbox: Union[tuple[float, float, float, float], None] = None
+) -> List:
+    """
+    Retrieve the highlight parts on one page of a DOI.
 
-    await highlight.delete()
+    Args:
+        doi: The DOI to look up
+        page: The page number
+        bbox: Optional (x1, y1, x2, y2) region; only parts whose rect
+            intersects it are returned
 
-    return highlight_data
+    Returns:
+        Parts ordered by highlight id, then part number. On Postgres the
+        region test is written as a box overlap so it can use the GiST
+        index on the parts' boxes.
+    """
+    values = [doi_key(doi), doi, page]
+    region = ""
+    if bbox is not None:
+        x1, y1, x2, y2 = bbox
+        values += [min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)]
+        if connections.get("default").capabilities.dialect == "postgres":
+            region = 'AND box(point(p."x1", p."y1"), point(p."x2", p."y2")) && box(point($4, $5), point($6, $7))'
+        else:
+            region = 'AND p."x1" <= $6 AND p."x2" >= $4 AND p."y1" <= $7 AND p."y2" >= $5'
+    return await execute_sql(
+        f"""
+        SELECT p."highlight_id", p."number", p."page", p."x1", p."y1", p."x2", p."y2", p."text"
+        FROM "highlight_part" AS p
+        JOIN "pdfhighlight" AS h ON h."id" = p."highlight_id"
+        WHERE p."doi_key" = $1 AND h."doi" = $2 AND p."page" = $3 {region}
+        ORDER BY p."highlight_id", p."id"
+        """,
+        values,
+    )
 
 async def put_highlight(id: int, payload: HighlightPayloadSchema, user_id: int) -> Union[dict, None]:
-    highlight = await PDFHighlight.filter(id=id).prefetch_related('user').first()
-    
-    if not highlight:
-        return None
-        
-    if highlight.user.id != user_id:
-        raise ValueError("User does not own this highlight")
-        
-    if highlight.doi != payload.doi:
-        raise ValueError("DOI does not match existing highlight")
+    """
+    Update a highlight owned by the given user in a single statement.
 
-    highlight.highlight = payload.highlight
-    highlight.comment = payload.comment
-    await highlight.save() 
-    
-    highlight_dict = dict(highlight)
-    highlight_dict["created_at"] = str(highlight.created_at)
-    
-    return highlight_dict
+    The ownership and DOI checks are part of the UPDATE itself; the stored
+    owner and DOI are only looked up when nothing was updated, to explain
+    why.
+
+    Raises:
+        NotOwnerError: If the highlight belongs to another user
+        ValueError: If the DOI differs
+    """
+    stored_highlight = payload.stored_highlight()
+    async with in_transaction():
+        rows = await execute_sql(
+            """
+            UPDATE "pdfhighlight" SET "highlight" = $4, "comment" = $5
+            WHERE "id" = $1 AND "user_id" = $2 AND "doi" = $3
+            RETURNING "id", "doi", "user_id", "created_at"
+            """,
+            [id, user_id, payload.doi, json.dumps(stored_highlight), payload.comment],
+        )
+
+        if not rows:
+            stored = await execute_sql('SELECT "user_id", "doi" FROM "pdfhighlight" WHERE "id" = $1', [id])
+            if not stored:
+                return None
+            if stored[0]["user_id"] != user_id:
+                raise NotOwnerError(stored[0]["user_id"])
+            raise ValueError("DOI does not match existing highlight")
+
+        highlight = rows[0]
+        await replace_highlight_parts(id, payload.doi, stored_highlight)
+
+    highlight["highlight"] = stored_highlight
+    highlight["comment"] = payload.comment
+    highlight["created_at"] = str(highlight["created_at"])
+
+    return highlight
 
-async def get_user_highlights(user_id: int) -> Union[List, None]:
-    highlights = await PDFHighlight.filter(user_id=user_id).prefetch_related('user').all()
+async def put_highlights(
+    edits: List[tuple[int, HighlightPayloadSchema]], user_id: int
+) -> List[Union[dict, ValueError, None]]:
+    """
+    Apply a batch of highlight edits in a single transaction.
+
+    Args:
+        edits: (highlight id, payload) pairs, at most one per highlight
+        user_id: The id of the user making the edits
+
+    Returns:
+        One result per edit, in order: the updated highlight, None if the
+        highlight was not found, or the ValueError raised by put_highlight
+    """
+    results = []
+    async with in_transaction():
+        for id, payload in edits:
+            try:
+                results.append(await put_highlight(id, payload, user_id))
+            except ValueError as e:
+                results.append(e)
+    return results
+
+async def get_user_highlights(user_id: int, username: str) -> Union[List, None]:
+    highlights = await PDFHighlight.filter(user_id=user_id).all()
     if highlights:
         highlight_list = []
         for highlight in highlights:
             highlight_dict = dict(highlight)
             del highlight_dict['user_id']
-            highlight_dict['username'] = highlight.user.username
+            del highlight_dict['doi_key']
+            highlight_dict['username'] = username
             highlight_dict['created_at'] = str(highlight.created_at)
             highlight_list.append(highlight_dict)
         return highlight_list
-    return None
\ No newline at end of file
+    return None
+
+async def get_user_highlight_page(
+    user_id: int, limit: int, after: Union[tuple[str, int], None] = None
+) -> List:
+    """
+    Retrieve one page of a user's highlights ordered by DOI, then id.
+
+    Args:
+        user_id: The id of the user whose highlights to retrieve
+        limit: The maximum number of highlights to return
+        after: The (doi, id) of the last highlight on the previous page
+
+    Returns:
+        Up to limit highlights, read with a keyset scan of the
+        (user_id, doi, id) index so deep pages cost the same as the first
+    """
+    query = PDFHighlight.filter(user_id=user_id)
+    if after is not None:
+        doi, id = after
+        query = query.filter(Q(doi__gt=doi) | Q(doi=doi, id__gt=id))
+    highlights = await query.order_by("doi", "id").limit(limit)
+    highlight_list = []
+    for highlight in highlights:
+        highlight_dict = dict(highlight)
+        del highlight_dict['user_id']
+        del highlight_dict['doi_key']
+        highlight_dict['created_at'] = str(highlight.created_at)
+        highlight_list.append(highlight_dict)
+    return highlight_list
+
+async def get_user_highlight_summary(user_id: int) -> List:
+    """
+    Count a user's highlights per DOI with a single GROUP BY query.
+
+    Args:
+        user_id: The id of the user whose highlights to summarize
+
+    Returns:
+        One entry per DOI with its highlight count and latest created_at,
+        most recently active DOI first
+    """
+    summary = await (
+        PDFHighlight.filter(user_id=user_id)
+        .annotate(count=Count("id"), last_activity=Max("created_at"))
+        .group_by("doi")
+        .order_by("-last_activity")
+        .values("doi", "count", "last_activity")
+    )
+    for entry in summary:
+        entry['last_activity'] = str(entry['last_activity'])
+    return summary
@@ -1,6 +1,9 @@
+import json
+from collections.abc import AsyncIterator, Awaitable, Callable
 
-from fastapi import APIRouter, HTTPException, Path, Depends
-from typing import Annotated
+from fastapi import APIRouter, HTTPException, Path, Depends, Query, Security
+from fastapi.responses import StreamingResponse
+from typing import Annotated, Union
 from app.api.users import get_current_active_user
 from app.api import crud
 from app.models.pydantic import (
@@ -9,23 +12,58 @@ from app.models.pydantic import (
     HighlightResponseSchemaPublic,
     HighlightResponseSchema,
     HighlightDeleteResponseSchema,
-    UserSchema
+    HighlightBatchRequestSchema,
+    HighlightPagePartSchema,
+    DOIStatsRequestSchema,
+    CurrentUserSchema
 )
+from app.doi import normalize_doi
+from app.policy import Resource, get_enforcer
+from app.ratelimit import RateLimits, get_rate_limits
+from app.models.tortoise import DOIStatsSchema
 
 router = APIRouter()
 
 
-@router.post("/", response_model=HighlightCreateResponseSchema, status_code=201)
+async def normalized_doi(doi: str) -> str:
+    """
+    Canonicalize the DOI path parameter. Nothing is ever stored under a
+    string that is not a DOI, so an invalid one is simply not found.
+    """
+    try:
+        return normalize_doi(doi)
+    except ValueError:
+        raise HTTPException(status_code=404, detail=f"No highlights found for doi {doi}")
+
+
+async def limit_highlight_writes(
+    current_user: Annotated[CurrentUserSchema, Security(get_current_active_user, scopes=["highlights:write"])],
+    rate_limits: Annotated[RateLimits, Depends(get_rate_limits)],
+) -> None:
+    # Per user rather than per address: ingestion runs from a few hosts.
+    if rate_limits.enabled:
+        await rate_limits.highlight_writes.enforce(str(current_user.id))
+
+
+@router.post(
+    "/",
+    response_model=HighlightCreateResponseSchema,
+    status_code=201,
+    dependencies=[Depends(limit_highlight_writes)],
+)
 async def create_highlight(
     payload: HighlightPayloadSchema,
-    current_user: Annotated[UserSchema, Depends(get_current_active_user)]
+    current_user: Annotated[CurrentUserSchema, Security(get_current_active_user, scopes=["highlights:write"])]
 ) -> HighlightCreateResponseSchema:
-    id, created_at  = await crud.post_highlight(payload, current_user.id)
+    try:
+        id, created_at = await crud.post_highlight(payload, current_user.id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="User not found")
     response_object = {"id": id, "doi": payload.doi, "created_at": str(created_at)}
     return response_object
 
 @router.get("/", response_model=list[HighlightResponseSchema])
-async def read_all_highlights(current_user: Annotated[UserSchema, Depends(get_current_active_user)]) -> list[HighlightResponseSchema]:
+async def read_all_highlights(current_user: Annotated[CurrentUserSchema, Security(get_current_active_user, scopes=["highlights:read"])]) -> list[HighlightResponseSchema]:
     return await crud.get_all_highlights()
 
 @router.get("/public", response_model=list[HighlightResponseSchemaPublic])
@@ -34,7 +72,8 @@ async def read_all_highlights_public() -> list[HighlightResponseSchemaPublic]:
 
 @router.get("/doi/{doi:path}/", response_model=list[HighlightResponseSchema])
 async def read_all_highlights_for_a_doi(
-    current_user: Annotated[UserSchema, Depends(get_current_active_user)], doi: str
+    current_user: Annotated[CurrentUserSchema, Security(get_current_active_user, scopes=["highlights:read"])],
+    doi: Annotated[str, Depends(normalized_doi)],
 ) -> list[HighlightResponseSchema]:
     response = await crud.get_highlights_for_doi(doi)
     if not response:
@@ -44,7 +83,7 @@ async def read_all_highlights_for_a_doi(
     return response
 
 @router.get("/doi/{doi:path}/public", response_model=list[HighlightResponseSchemaPublic])
-async def read_all_highlights_for_a_doi_public(doi: str) -> list[HighlightResponseSchemaPublic]:
+async def read_all_highlights_for_a_doi_public(doi: Annotated[str, Depends(normalized_doi)]) -> list[HighlightResponseSchemaPublic]:
     response = await crud.get_highlights_for_doi_public(doi)
     if not response:
         raise HTTPException(
@@ -52,9 +91,103 @@ async def read_all_highlights_for_a_doi_public(doi: str) -> list[HighlightRespon
         )
     return response
 
+async def encode_highlight_groups(dois: list[str], rows: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    """
+    Stream a {doi: [highlight, ...]} JSON object one highlight at a time,
+    as the rows are read.
+
+    Rows arrive ordered by DOI; requested DOIs without highlights are
+    written last with empty lists. Each highlight's stored JSON is copied
+    through as-is rather than decoded and re-encoded.
+    """
+    yield b"{"
+    current_doi = None
+    found = set()
+    async for row in rows:
+        if row["doi"] != current_doi:
+            separator = "" if current_doi is None else "],"
+            current_doi = row["doi"]
+            found.add(current_doi)
+            yield f"{separator}{json.dumps(current_doi)}:[".encode()
+        else:
+            yield b","
+        highlight = row["highlight"]
+        if not isinstance(highlight, str):
+            highlight = json.dumps(highlight)
+        yield (
+            f'{{"id":{row["id"]},"doi":{json.dumps(row["doi"])},'
+            f'"created_at":{json.dumps(str(row["created_at"]))},'
+            f'"comment":{json.dumps(row["comment"])},"highlight":{highlight}}}'
+        ).encode()
+    if current_doi is not None:
+        yield b"]"
+
+    for doi in dois:
+        if doi not in found:
+            yield f"{',' if current_doi is not None else ''}{json.dumps(doi)}:[]".encode()
+            current_doi = doi
+    yield b"}"
+
+def parse_bbox(
+    bbox: Annotated[str | None, Query(description="x1,y1,x2,y2 in page coordinates")] = None,
+) -> tuple[float, float, float, float] | None:
+    if bbox is None:
+        return None
+    try:
+        x1, y1, x2, y2 = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=422, detail="bbox must be four comma-separated numbers")
+    return x1, y1, x2, y2
+
+@router.get("/doi/{doi:path}/page/{page}", response_model=list[HighlightPagePartSchema])
+async def read_highlight_parts_for_a_page(
+    doi: Annotated[str, Depends(normalized_doi)],
+    page: Annotated[int, Path(ge=1)],
+    bbox: Annotated[tuple[float, float, float, float] | None, Depends(parse_bbox)],
+) -> list[HighlightPagePartSchema]:
+    """
+    Return the highlight parts on one page of a DOI, optionally only those
+    intersecting the `bbox` region, so a viewer can load a large annotated
+    PDF a page (or a screenful) at a time. Parts saved without a page,
+    as all were before pages were recorded, are on no page and only come
+    back with their whole highlight.
+    """
+    rows = await crud.get_highlight_parts_for_page(doi, page, bbox)
+    return [
+        {
+            "highlight_id": row["highlight_id"],
+            "part": row["number"],
+            "page": row["page"],
+            "rect": (row["x1"], row["y1"], row["x2"], row["y2"]),
+            "text": row["text"],
+        }
+        for row in rows
+    ]
+
+@router.post("/doi/batch", response_class=StreamingResponse)
+async def read_highlights_for_dois_public(payload: HighlightBatchRequestSchema) -> StreamingResponse:
+    """
+    Public highlights for up to 100 DOIs, grouped by DOI, from a single
+    query. At most `limit_per_doi` highlights (lowest ids first) are
+    returned for each DOI. The rows are written out as they are read from
+    the query's cursor, not gathered first.
+    """
+    dois = list(dict.fromkeys(payload.dois))
+    rows = crud.iterate_highlights_for_dois_public(dois, payload.limit_per_doi)
+    return StreamingResponse(encode_highlight_groups(dois, rows), media_type="application/json")
+
+@router.get("/doi/{doi:path}/stats", response_model=DOIStatsSchema)
+async def read_doi_stats(doi: Annotated[str, Depends(normalized_doi)]) -> DOIStatsSchema:
+    stats = await crud.get_doi_stats([doi])
+    return stats[0]
+
+@router.post("/stats", response_model=list[DOIStatsSchema])
+async def read_doi_stats_batch(payload: DOIStatsRequestSchema) -> list[DOIStatsSchema]:
+    return await crud.get_doi_stats(payload.dois)
+
 @router.get("/id/{id}/", response_model=HighlightResponseSchema)
 async def read_highlight(
-    current_user: Annotated[UserSchema, Depends(get_current_active_user)],
+    current_user: Annotated[CurrentUserSchema, Security(get_current_active_user, scopes=["highlights:read"])],
     id: int = Path(..., gt=0)
 ) -> HighlightResponseSchema:
     highlight = await crud.get_highlight(id)
@@ -76,19 +209,57 @@ async def read_highlight_public(
     return response 
 
 
-@router.delete("/id/{id}/", response_model=HighlightDeleteResponseSchema)
+async def write_as_permitted(
+    current_user: CurrentUserSchema,
+    action: str,
+    id: int,
+    write: Callable[[int], Awaitable[Union[dict, None]]],
+) -> Union[dict, None]:
+    """
+    Run `write(owner_id)` on highlight `id` if the policy lets the current
+    user `action` it.
+
+    The user is first taken to own the highlight, which `write` checks in
+    the statement that writes it, so an owner's write costs a cached
+    decision and no extra query. Only a write refused as someone else's is
+    decided again for the real owner, and if allowed made as them.
+    """
+    policy = get_enforcer()
+    refused = HTTPException(
+        status_code=403,
+        detail=f"Not authorized to {'update' if action == 'PUT' else 'delete'} this highlight",
+    )
+    owner_id = current_user.id
+    if not policy.enforce(current_user, "/highlights/id/", action, Resource(owner_id)):
+        owner_id = await crud.get_highlight_owner(id)
+        if owner_id is None:
+            return None
+        if not policy.enforce(current_user, "/highlights/id/", action, Resource(owner_id)):
+            raise refused
+    try:
+        return await write(owner_id)
+    except crud.NotOwnerError as e:
+        if not policy.enforce(current_user, "/highlights/id/", action, Resource(e.owner_id)):
+            raise refused
+        return await write(e.owner_id)
+
+@router.delete(
+    "/id/{id}/",
+    response_model=HighlightDeleteResponseSchema,
+    dependencies=[Depends(limit_highlight_writes)],
+)
 async def delete_highlight(
-    current_user: Annotated[UserSchema, Depends(get_current_active_user)],
+    current_user: Annotated[CurrentUserSchema, Security(get_current_active_user, scopes=["highlights:write"])],
     id: int = Path(..., gt=0),
 ) -> HighlightDeleteResponseSchema:
     try:
-        response = await crud.delete_highlight(id, current_user.id)
+        response = await write_as_permitted(
+            current_user, "DELETE", id, lambda owner_id: crud.delete_highlight(id, owner_id)
+        )
         if not response:
             raise HTTPException(status_code=404, detail="highlight not found")
         return response
     except ValueError as e:
-        if "User does not own this highlight" in str(e):
-            raise HTTPException(status_code=403, detail="Not authorized to delete this highlight")
         raise HTTPException(
             status_code=422,
             detail=[{
@@ -99,21 +270,25 @@ async def delete_highlight(
             }]
         )
 
-@router.put("/id/{id}/", response_model=HighlightCreateResponseSchema)
+@router.put(
+    "/id/{id}/",
+    response_model=HighlightCreateResponseSchema,
+    dependencies=[Depends(limit_highlight_writes)],
+)
 async def update_highlight(
     payload: HighlightPayloadSchema,
-    current_user: Annotated[UserSchema, Depends(get_current_active_user)],
+    current_user: Annotated[CurrentUserSchema, Security(get_current_active_user, scopes=["highlights:write"])],
     id: int = Path(..., gt=0),
 ) -> HighlightCreateResponseSchema:
     try:
-        updated_highlight = await crud.put_highlight(id, payload, current_user.id)
+        updated_highlight = await write_as_permitted(
+            current_user, "PUT", id, lambda owner_id: crud.put_highlight(id, payload, owner_id)
+        )
         if not updated_highlight:
             raise HTTPException(status_code=404, detail="highlight not found")
         updated_highlight["created_at"] = str(updated_highlight["created_at"])
         return updated_highlight
     except ValueError as e:
-        if "User does not own this highlight" in str(e):
-            raise HTTPException(status_code=403, detail="Not authorized to update this highlight")
         raise HTTPException(
             status_code=422,
             detail=[{
@@ -0,0 +1,24 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from app.api.users import get_authorized_active_user
+from app.instrumentation import metrics
+from app.models.pydantic import AuthSchema
+
+
+router = APIRouter()
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def read_metrics(
+    current_authorization: Annotated[
+        AuthSchema, Depends(get_authorized_active_user("/metrics", "GET", scopes=["metrics:read"]))
+    ],
+) -> PlainTextResponse:
+    """
+    Request metrics in the Prometheus text format, for admins or an API key
+    with the metrics:read scope. Each gunicorn worker keeps its own, so a
+    scrape reports only the worker that served it.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,9 +1,10 @@
 from typing import List
 
-from fastapi import APIRouter, HTTPException, Path, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Path, Request
 
 from app.summarizer import generate_summary
 from app.api import crud
+from app.ratelimit import rate_limited
 from app.models.pydantic import SummaryPayloadSchema, SummaryResponseSchema, SummaryUpdatePayloadSchema
 from app.models.tortoise import SummarySchema, TextSummary
 
@@ -11,11 +12,18 @@ from app.models.tortoise import SummarySchema, TextSummary
 router = APIRouter()
 
 
-@router.post("/", response_model=SummaryResponseSchema, status_code=201)
-async def create_summary(payload: SummaryPayloadSchema, background_tasks: BackgroundTasks) -> SummaryResponseSchema:
+@router.post(
+    "/",
+    response_model=SummaryResponseSchema,
+    status_code=201,
+    dependencies=[Depends(rate_limited("summaries"))],
+)
+async def create_summary(payload: SummaryPayloadSchema, request: Request) -> SummaryResponseSchema:
     summary_id = await crud.post_summary(payload)
 
-    background_tasks.add_task(generate_summary, summary_id, str(payload.url))
+    # Not a response background task: those hold the connection open, and
+    # shutdown should wait for the summary, not for the client.
+    request.app.state.resources.spawn(generate_summary(summary_id, str(payload.url)))
 
     response_object = {"id": summary_id, "url": payload.url}
     return response_object
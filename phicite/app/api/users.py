@@ -1,62 +1,115 @@
-import os
-from datetime import datetime, timedelta, timezone
+import base64
+import binascii
+import json
+import logging
 from typing import Union, Annotated
-import jwt
 from jwt.exceptions import InvalidTokenError
-from fastapi import APIRouter, HTTPException, Path, Depends, status
-from fastapi.security import OAuth2PasswordRequestForm
+from fastapi import APIRouter, HTTPException, Path, Query, Depends, Request, Security, status
+from fastapi.security import OAuth2PasswordRequestForm, SecurityScopes
 from app import auth
 from app.api import crud
 from app.models.pydantic import (
     UserCreate,
     UserSchema,
     UserInDBSchema,
+    CurrentUserSchema,
     TokenSchema,
+    RefreshTokenPayloadSchema,
     TokenDataSchema,
-    AuthSchema
+    AuthSchema,
+    ApiKeyCreateSchema,
+    ApiKeySchema,
+    ApiKeyCreatedSchema,
+    PolicySetCreateSchema,
+    PolicySetSchema,
+    PolicySetDetailSchema,
+    HighlightLibraryPageSchema,
+    HighlightDOISummarySchema,
 )
+from app.apikeys import PREFIX as API_KEY_PREFIX, get_api_key_store
 from app.auth import oauth2_scheme
-import casbin
+from app.instrumentation import timed
+from app.policy import get_enforcer
+from app.ratelimit import RateLimits, client_address, get_rate_limits, rate_limited, too_many_requests
+from app.sessions import get_session_store
+from app.tokens import get_token_service
 
-router = APIRouter()
+log = logging.getLogger("uvicorn")
 
-enforcer = casbin.Enforcer("abac_model.conf", "abac_policy.csv")
+router = APIRouter()
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)])-> UserSchema:
+async def get_current_user(
+    token: Annotated[str, Depends(oauth2_scheme)],
+    security_scopes: SecurityScopes = None,
+)-> CurrentUserSchema:
+    """
+    The user an access token or API key was issued to. An API key must
+    carry every scope the route asks for through Security(); a route that
+    asks for none cannot be used with one.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, 
-                             os.environ.get("JWT_SECRET_KEY"), 
-                             algorithms=[os.environ.get("JWT_ALGORITHM")])
-        username = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenDataSchema(username=username)
-    except InvalidTokenError:
-        raise credentials_exception
-    user = await crud.get_user_by_token_data(token_data)
+    with timed("auth"):
+        if token.startswith(API_KEY_PREFIX):
+            user = await get_api_key_store().resolve(token)
+        else:
+            user = await get_user_from_access_token(token)
     if user is None:
         raise credentials_exception
+    if user.scopes is not None:
+        required = security_scopes.scopes if security_scopes else []
+        if not required or not set(required) <= set(user.scopes):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Not enough permissions",
+                headers={"WWW-Authenticate": f'Bearer scope="{" ".join(required)}"'},
+            )
     return user
 
 
+async def get_user_from_access_token(token: str) -> Union[CurrentUserSchema, None]:
+    tokens = get_token_service()
+    try:
+        claims = tokens.verify(token)
+    except InvalidTokenError:
+        return None
+    user = tokens.user(claims)
+    if user is not None:
+        return user
+    # Tokens issued before they carried the user's claims need a lookup.
+    username = claims.get("sub")
+    if username is None:
+        return None
+    user = await crud.get_user_by_token_data(TokenDataSchema(username=username))
+    if user is None:
+        return None
+    return CurrentUserSchema(**user.model_dump())
+
+
 async def get_current_active_user(
-    current_user: Annotated[UserSchema, Depends(get_current_user)],
-)-> UserSchema:
+    current_user: Annotated[CurrentUserSchema, Depends(get_current_user)],
+)-> CurrentUserSchema:
     if current_user.disabled:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
-def get_authorized_active_user(resource: str, action: str)->AuthSchema:
-    async def get_user_and_authorize(current_active_user: Annotated[UserSchema, Depends(get_current_active_user)]):
-        print(f"User: {current_active_user}, is_admin: {current_active_user.is_admin}")
-        print(f"Resource: {resource}, Action: {action}")
-        result = enforcer.enforce(current_active_user, resource, action)
-        print(f"Authorization result: {result}")
+def get_authorized_active_user(resource: str, action: str, scopes: list[str] | None = None)->AuthSchema:
+    """
+    A dependency checking the current user against the ABAC policy for
+    `action` on `resource`. API keys need `scopes` as well.
+    """
+    async def get_user_and_authorize(
+        current_active_user: Annotated[CurrentUserSchema, Security(get_current_active_user, scopes=scopes or [])],
+    ):
+        with timed("authz"):
+            result = get_enforcer().enforce(current_active_user, resource, action)
+        log.debug(
+            "Authorization of %s (admin=%s) for %s %s: %s",
+            current_active_user.username, current_active_user.is_admin, action, resource, result,
+        )
         if not result:
             raise HTTPException(status_code=403, detail="Forbidden")
         return AuthSchema(**current_active_user.model_dump(), authorized=True)
@@ -89,7 +142,12 @@ async def delete_user_by_username(
     ],
     username: str = Path(..., min_length=1),
 ) -> UserSchema:
-    return await crud.delete_user_in_db_by_username(username)
+    user = await crud.get_user_by_username(username)
+    result = await crud.delete_user_in_db_by_username(username)
+    if user:
+        # Its tokens would otherwise stay valid until they expire.
+        await get_token_service().revoke_user(user.id)
+    return result
 
 
 @router.get("/admin/email/{email}/", response_model=UserSchema)
@@ -118,64 +176,308 @@ async def get_user_info_by_id(
     return user
 
 
+@router.get("/admin/policy/", response_model=list[PolicySetSchema])
+async def read_policy_sets(
+    current_authorization: Annotated[
+        AuthSchema, Depends(get_authorized_active_user("/users/admin/policy/", "GET"))
+    ],
+) -> list[PolicySetSchema]:
+    """
+    The policy sets published, newest first. The one activated last is in
+    force; with none, abac_policy.csv is.
+    """
+    return await crud.get_policy_sets()
+
+
+@router.get("/admin/policy/{id}/", response_model=PolicySetDetailSchema)
+async def read_policy_set(
+    current_authorization: Annotated[
+        AuthSchema, Depends(get_authorized_active_user("/users/admin/policy/", "GET"))
+    ],
+    id: int = Path(..., gt=0),
+) -> PolicySetDetailSchema:
+    policy_set = await crud.get_policy_set(id)
+    if not policy_set:
+        raise HTTPException(status_code=404, detail="Policy set not found")
+    rules = await crud.get_policy_rules(id)
+    return PolicySetDetailSchema(
+        **policy_set,
+        rules=[{"sub_rule": sub_rule, "obj": obj, "act": act} for sub_rule, obj, act in rules],
+    )
+
+
+def check_policy_keeps_admin(rules: list[tuple[str, str, str]], user: AuthSchema) -> None:
+    """
+    Refuse rules that do not parse, or that would stop `user` from managing
+    the policy, so no one locks the admins out.
+    """
+    try:
+        policy = get_enforcer().compile(rules)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if not policy.allows(user, "/users/admin/policy/", "POST"):
+        raise HTTPException(status_code=422, detail="The policy would not let you manage it")
+
+
+@router.post("/admin/policy/", response_model=PolicySetSchema, status_code=201)
+async def publish_policy_set(
+    payload: PolicySetCreateSchema,
+    current_authorization: Annotated[
+        AuthSchema, Depends(get_authorized_active_user("/users/admin/policy/", "POST"))
+    ],
+) -> PolicySetSchema:
+    """
+    Store a new policy set and put it in force in every worker.
+    """
+    rules = [(rule.sub_rule, rule.obj, rule.act) for rule in payload.rules]
+    check_policy_keeps_admin(rules, current_authorization)
+    policy_set = await get_enforcer().publish(rules, payload.comment)
+    return PolicySetSchema(
+        id=policy_set.id,
+        comment=policy_set.comment,
+        created_at=policy_set.created_at,
+        activated_at=policy_set.activated_at,
+    )
+
+
+@router.post("/admin/policy/{id}/activate", status_code=204)
+async def activate_policy_set(
+    current_authorization: Annotated[
+        AuthSchema, Depends(get_authorized_active_user("/users/admin/policy/", "POST"))
+    ],
+    id: int = Path(..., gt=0),
+) -> None:
+    """
+    Put an earlier policy set back in force, to roll back a change.
+    """
+    rules = await crud.get_policy_rules(id)
+    if not rules:
+        raise HTTPException(status_code=404, detail="Policy set not found")
+    check_policy_keeps_admin(rules, current_authorization)
+    if not await get_enforcer().activate(id):
+        raise HTTPException(status_code=404, detail="Policy set not found")
+
+
 async def authenticate_user(
     username: str, password: str
 ) -> Union[UserInDBSchema, bool]:
     user = await crud.get_user_in_db_by_username(username)
     if not user:
-        print(f"User {username} not found")
+        log.info("Login failed: unknown user", extra={"username": username})
         return False
-    if not auth.verify_password(password, user.hashed_password):
-        print(f"Incorrect password for user {username}")
+    with timed("auth"):
+        verified = auth.verify_password(password, user.hashed_password)
+    if not verified:
+        log.info("Login failed: incorrect password", extra={"username": username})
         return False
     return user
 
 
-def create_access_token(data: dict, expires_delta: timedelta | None = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.now(timezone.utc) + expires_delta
-    else:
-        expire = datetime.now(timezone.utc) + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(
-        to_encode,
-        os.environ.get("JWT_SECRET_KEY"),
-        algorithm=os.environ.get("JWT_ALGORITHM")
-    )
-    return encoded_jwt
-
-
 @router.post("/token", response_model=TokenSchema)
 async def login_for_access_token(
+    request: Request,
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
+    rate_limits: Annotated[RateLimits, Depends(get_rate_limits)],
 ) -> TokenSchema:
+    # Refused before the password is hashed: bcrypt is what an attacker
+    # guessing passwords would make us spend.
+    # Failures count against the username from one address, so guessing
+    # from elsewhere does not lock its owner out, and, with a higher limit,
+    # from every address.
+    address = client_address(request)
+    username_key = f"{address}:{form_data.username}"
+    if rate_limits.enabled:
+        wait = await rate_limits.login_ip.count(address)
+        wait = wait or await rate_limits.login_username.check(username_key)
+        wait = wait or await rate_limits.login_account.check(form_data.username)
+        if wait is not None:
+            log.info("Login refused: rate limited", extra={"username": form_data.username})
+            raise too_many_requests(wait)
     user = await authenticate_user(form_data.username, form_data.password)
     if not user:
+        if rate_limits.enabled:
+            await rate_limits.login_username.count(username_key)
+            await rate_limits.login_account.count(form_data.username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES")))
-    access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+    access_token = get_token_service().issue(user)
+    refresh_token = await get_session_store().start(user.id)
+    return TokenSchema(access_token=access_token, token_type="bearer", refresh_token=refresh_token)
+
+
+@router.post(
+    "/token/refresh",
+    response_model=TokenSchema,
+    dependencies=[Depends(rate_limited("token_refreshes"))],
+)
+async def refresh_access_token(payload: RefreshTokenPayloadSchema) -> TokenSchema:
+    """
+    Exchange a refresh token for a new access token and the session's next
+    refresh token; the one sent stops working.
+    """
+    renewed = await get_session_store().renew(payload.refresh_token)
+    if renewed is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    user, refresh_token = renewed
+    access_token = get_token_service().issue(user)
+    return TokenSchema(access_token=access_token, token_type="bearer", refresh_token=refresh_token)
+
+
+@router.post("/token/revoke", status_code=204)
+async def revoke_access_token(
+    token: Annotated[str, Depends(oauth2_scheme)],
+    payload: RefreshTokenPayloadSchema | None = None,
+) -> None:
+    """
+    Revoke the access token sent, and end the session of the refresh token
+    in the body if there is one.
+    """
+    if payload is not None:
+        await get_session_store().end(payload.refresh_token)
+    tokens = get_token_service()
+    try:
+        claims = tokens.verify(token)
+    except InvalidTokenError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if "jti" not in claims:
+        raise HTTPException(status_code=400, detail="Token cannot be revoked")
+    await tokens.revoke(claims)
+
+
+@router.post("/me/sessions/revoke", status_code=204)
+async def revoke_own_sessions(
+    current_user: Annotated[CurrentUserSchema, Depends(get_current_user)],
+) -> None:
+    """
+    Log out everywhere: end all of the current user's sessions and revoke
+    their access tokens, this one included.
+    """
+    await get_session_store().end_all(current_user.id)
+    await get_token_service().revoke_user(current_user.id)
+
+
+@router.post("/me/api-keys/", response_model=ApiKeyCreatedSchema, status_code=201)
+async def create_api_key(
+    payload: ApiKeyCreateSchema,
+    current_authorized_user: Annotated[AuthSchema, Depends(get_authorized_active_user("/users/me/api-keys/", "POST"))],
+) -> ApiKeyCreatedSchema:
+    """
+    Create an API key for the current user. The key is only ever returned
+    here.
+    """
+    api_key, key = await get_api_key_store().create(current_authorized_user.id, payload.name, payload.scopes)
+    return ApiKeyCreatedSchema(
+        id=api_key.id,
+        name=api_key.name,
+        prefix=api_key.prefix,
+        scopes=api_key.scopes,
+        created_at=api_key.created_at,
+        key=key,
     )
-    return TokenSchema(access_token=access_token, token_type="bearer")
+
+
+@router.get("/me/api-keys/", response_model=list[ApiKeySchema])
+async def read_own_api_keys(
+    current_authorized_user: Annotated[AuthSchema, Depends(get_authorized_active_user("/users/me/api-keys/", "GET"))],
+) -> list[ApiKeySchema]:
+    return await crud.get_api_keys(current_authorized_user.id)
+
+
+@router.delete("/me/api-keys/{id}/", status_code=204)
+async def revoke_api_key(
+    current_authorized_user: Annotated[
+        AuthSchema, Depends(get_authorized_active_user("/users/me/api-keys/", "DELETE"))
+    ],
+    id: int = Path(..., gt=0),
+) -> None:
+    if not await get_api_key_store().revoke(id, current_authorized_user.id):
+        raise HTTPException(status_code=404, detail="API key not found")
 
 
 @router.get("/me/", response_model=UserSchema)
 async def read_users_me(
     current_authorized_user: Annotated[AuthSchema, Depends(get_authorized_active_user("/users/me/", "GET"))]
 ):
-    return UserSchema(**current_authorized_user.model_dump(exclude=("authorized",)))
+    # The token only identifies the user; the profile is in the database.
+    user = await crud.get_user_by_id(current_authorized_user.id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
 
 
 @router.get("/me/highlights/")
 async def read_own_highlights(
     current_authorized_user: Annotated[
-        AuthSchema, Depends(get_authorized_active_user("/users/me/highlights/", "GET"))
+        AuthSchema, Depends(get_authorized_active_user("/users/me/highlights/", "GET", ["highlights:read"]))
     ],
 ):
-    highlights = await crud.get_user_highlights(current_authorized_user.id)
-    return highlights
\ No newline at end of file
+    highlights = await crud.get_user_highlights(
+        current_authorized_user.id, current_authorized_user.username
+    )
+    return highlights
+
+
+def encode_library_cursor(doi: str, id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([doi, id]).encode()).decode()
+
+
+def decode_library_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        doi, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(doi, str) or not isinstance(id, int):
+            raise ValueError
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+    return doi, id
+
+
+@router.get("/me/highlights/library/", response_model=HighlightLibraryPageSchema)
+async def read_own_highlight_library(
+    current_authorized_user: Annotated[
+        AuthSchema, Depends(get_authorized_active_user("/users/me/highlights/", "GET", ["highlights:read"]))
+    ],
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+) -> HighlightLibraryPageSchema:
+    """
+    Page through the current user's highlights grouped by DOI.
+
+    Pass the returned `next_cursor` back as `cursor` to get the next page; a
+    DOI whose highlights span two pages appears at the end of one and the
+    start of the next.
+    """
+    after = decode_library_cursor(cursor) if cursor else None
+    highlights = await crud.get_user_highlight_page(
+        current_authorized_user.id, limit + 1, after
+    )
+    next_cursor = None
+    if len(highlights) > limit:
+        highlights = highlights[:limit]
+        next_cursor = encode_library_cursor(highlights[-1]["doi"], highlights[-1]["id"])
+
+    items = []
+    for highlight in highlights:
+        if not items or items[-1]["doi"] != highlight["doi"]:
+            items.append({"doi": highlight["doi"], "highlights": []})
+        items[-1]["highlights"].append(highlight)
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@router.get("/me/highlights/summary/", response_model=list[HighlightDOISummarySchema])
+async def read_own_highlight_summary(
+    current_authorized_user: Annotated[
+        AuthSchema, Depends(get_authorized_active_user("/users/me/highlights/", "GET", ["highlights:read"]))
+    ],
+) -> list[HighlightDOISummarySchema]:
+    return await crud.get_user_highlight_summary(current_authorized_user.id)
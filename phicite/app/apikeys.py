@@ -0,0 +1,104 @@
+"""
+API keys: how a service such as the ingestion pipeline authenticates as a
+user without logging in.
+
+A key is "phc_<prefix>_<secret>", sent in place of an access token
+(Authorization: Bearer phc_...). The prefix finds the key's row through a
+unique index and the secret is checked against an HMAC, so a request costs
+no bcrypt and no token exchange. The resolved principal is cached for
+CACHE_SECONDS, so most requests do not touch the database either; a revoked
+key still works for up to that long on other workers, though the user's
+token revocations (a deleted user) reach the cache as soon as the worker
+has them.
+
+A key can only do what its scopes allow. Routes name the scopes they need
+with Security(..., scopes=[...]), and a key is refused by any route that
+names none, which includes managing keys.
+"""
+import hashlib
+import hmac
+import secrets
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Union
+
+from app.api import crud
+from app.config import Settings, get_settings
+from app.models.pydantic import CurrentUserSchema
+from app.models.tortoise import ApiKey
+from app.tokens import get_token_service
+
+PREFIX = "phc_"
+CACHE_SECONDS = 60.0
+
+
+class ApiKeyStore:
+    def __init__(self, key: bytes) -> None:
+        self.key = key
+        # prefix -> (monotonic expiry, wall-clock time cached, key hash, principal)
+        self.principals: dict[str, tuple[float, float, str, CurrentUserSchema]] = {}
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "ApiKeyStore":
+        secret = settings.api_key_secret or settings.jwt_secret_key
+        if not secret:
+            raise ValueError("API_KEY_SECRET or JWT_SECRET_KEY is required for API keys")
+        return cls(secret.encode())
+
+    def hash(self, secret: str) -> str:
+        return hmac.new(self.key, secret.encode(), hashlib.sha256).hexdigest()
+
+    async def create(self, user_id: int, name: str, scopes: list[str]) -> tuple[ApiKey, str]:
+        """
+        Store a new key for the user; returns its row and the key, which is
+        not kept.
+        """
+        prefix = secrets.token_hex(6)
+        secret = secrets.token_urlsafe(32)
+        api_key = await crud.post_api_key(user_id, name, prefix, self.hash(secret), scopes)
+        return api_key, f"{PREFIX}{prefix}_{secret}"
+
+    async def resolve(self, key: str) -> Union[CurrentUserSchema, None]:
+        """
+        The user a live key belongs to, with the key's scopes; None for
+        anything else.
+        """
+        prefix, _, secret = key.removeprefix(PREFIX).partition("_")
+        if not prefix or not secret:
+            return None
+        key_hash = self.hash(secret)
+        cached = self.principals.get(prefix)
+        if cached is not None:
+            expires, cached_at, cached_hash, principal = cached
+            if expires > time.monotonic() and not self.user_revoked_since(principal.id, cached_at):
+                return principal if hmac.compare_digest(key_hash, cached_hash) else None
+
+        api_key = await crud.get_api_key_by_prefix(prefix)
+        if api_key is None or not hmac.compare_digest(key_hash, api_key.key_hash):
+            self.principals.pop(prefix, None)
+            return None
+        principal = CurrentUserSchema(
+            id=api_key.user.id,
+            username=api_key.user.username,
+            is_admin=api_key.user.is_admin,
+            disabled=api_key.user.disabled,
+            scopes=api_key.scopes,
+        )
+        self.principals[prefix] = (time.monotonic() + CACHE_SECONDS, time.time(), api_key.key_hash, principal)
+        return principal
+
+    def user_revoked_since(self, user_id: int, since: float) -> bool:
+        return get_token_service().revoked_users.get(user_id, 0) >= since
+
+    async def revoke(self, id: int, user_id: int) -> bool:
+        prefix = await crud.revoke_api_key(id, user_id, datetime.now(timezone.utc))
+        if prefix is None:
+            return False
+        self.principals.pop(prefix, None)
+        return True
+
+
+@lru_cache
+def get_api_key_store() -> ApiKeyStore:
+    return ApiKeyStore.from_settings(get_settings())
@@ -0,0 +1,71 @@
+"""
+Fill in pdfhighlight.doi_key for rows created before the column existed.
+
+    python -m app.backfill --batch-size 1000
+
+Each batch is its own short transaction, so only the rows being updated are
+locked and the API keeps serving reads and writes while this runs. Safe to
+re-run; it picks up wherever the previous run stopped.
+"""
+import argparse
+import asyncio
+import logging
+import os
+
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+
+from app.doi import doi_key, normalize_doi
+from app.models.tortoise import PDFHighlight
+
+log = logging.getLogger("uvicorn")
+
+
+def stored_doi_key_source(doi: str) -> str:
+    """
+    The DOI to hash for a stored row: its normalized form, as new rows are
+    written with, or the stored text if it does not parse.
+    """
+    try:
+        return normalize_doi(doi)
+    except ValueError:
+        return doi
+
+
+async def backfill_doi_keys(batch_size: int = 1000) -> int:
+    """
+    Set doi_key on every highlight that lacks one. Returns the number of
+    rows updated.
+    """
+    updated = 0
+    while True:
+        async with in_transaction():
+            highlights = await (
+                PDFHighlight.filter(doi_key__isnull=True)
+                .order_by("id")
+                .limit(batch_size)
+                .select_for_update()
+            )
+            if not highlights:
+                return updated
+            for highlight in highlights:
+                highlight.doi_key = doi_key(stored_doi_key_source(highlight.doi))
+            await PDFHighlight.bulk_update(highlights, fields=["doi_key"])
+        updated += len(highlights)
+        log.info("Backfilled doi_key on %d highlights", updated)
+
+
+async def main(args: argparse.Namespace) -> None:
+    await Tortoise.init(db_url=args.db_url, modules={"models": ["app.models.tortoise"]})
+    try:
+        updated = await backfill_doi_keys(args.batch_size)
+        print(f"Backfilled doi_key on {updated} highlights")
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--batch-size", type=int, default=1000)
+    asyncio.run(main(parser.parse_args()))
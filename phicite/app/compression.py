@@ -0,0 +1,236 @@
+import gzip
+import zlib
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+    "text/",
+)
+
+
+class GzipEncoder:
+    name = "gzip"
+
+    def __init__(self, level: int = 6) -> None:
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def stream(self):
+        return CompressObjStream(zlib.compressobj(self.level, zlib.DEFLATED, 31))
+
+
+class CompressObjStream:
+    # zlib and zstandard compression objects share the compress()/flush() API.
+    def __init__(self, compressor) -> None:
+        self.compressor = compressor
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush()
+
+
+class BrotliEncoder:
+    name = "br"
+
+    def __init__(self, quality: int = 4) -> None:
+        self.quality = quality
+
+    def compress(self, data: bytes) -> bytes:
+        return brotli.compress(data, quality=self.quality)
+
+    def stream(self):
+        return BrotliStream(brotli.Compressor(quality=self.quality))
+
+
+class BrotliStream:
+    def __init__(self, compressor) -> None:
+        self.compressor = compressor
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data)
+
+    def finish(self) -> bytes:
+        return self.compressor.finish()
+
+
+class ZstdEncoder:
+    name = "zstd"
+
+    def __init__(self, level: int = 3) -> None:
+        self.level = level
+
+    # A ZstdCompressor must not be shared between threads, so each body
+    # gets its own.
+    def compress(self, data: bytes) -> bytes:
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def stream(self):
+        return CompressObjStream(zstandard.ZstdCompressor(level=self.level).compressobj())
+
+
+def available_encoders() -> list:
+    """
+    The encoders this process can offer, most preferred first.
+    """
+    encoders = []
+    if zstandard is not None:
+        encoders.append(ZstdEncoder())
+    if brotli is not None:
+        encoders.append(BrotliEncoder())
+    encoders.append(GzipEncoder())
+    return encoders
+
+
+def parse_accept_encoding(header: str) -> dict[str, float]:
+    """
+    Map each coding in an Accept-Encoding header to its q-value.
+    """
+    accepted = {}
+    for item in header.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+def choose_encoder(header: str, encoders: list):
+    """
+    Pick the encoder the client accepts with the highest q-value, breaking
+    ties by the server's preference. Returns None for identity.
+    """
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoder in encoders:
+        quality = accepted.get(encoder.name, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoder, quality
+    return best
+
+
+class CompressionMiddleware:
+    """
+    Compress HTTP responses with the best coding the client accepts.
+
+    Bodies smaller than `minimum_size` are sent as they are. Compressing a
+    body (or streamed chunk) of `threadpool_size` bytes or more is moved off
+    the event loop so one large highlight list does not stall other
+    requests. Streaming responses are compressed chunk by chunk.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        threadpool_size: int = 256 * 1024,
+        encoders: list | None = None,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.threadpool_size = threadpool_size
+        self.encoders = encoders if encoders is not None else available_encoders()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoder = choose_encoder(Headers(scope=scope).get("accept-encoding", ""), self.encoders)
+        if encoder is None:
+            await self.app(scope, receive, send)
+            return
+        responder = CompressionResponder(send, encoder, self.minimum_size, self.threadpool_size)
+        await self.app(scope, receive, responder.send)
+
+
+class CompressionResponder:
+    def __init__(self, send: Send, encoder, minimum_size: int, threadpool_size: int) -> None:
+        self.downstream = send
+        self.encoder = encoder
+        self.minimum_size = minimum_size
+        self.threadpool_size = threadpool_size
+        self.start_message: Message | None = None
+        self.stream = None
+        self.passthrough = False
+
+    async def run(self, function, data: bytes) -> bytes:
+        if len(data) >= self.threadpool_size:
+            return await run_in_threadpool(function, data)
+        return function(data)
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "")
+            self.passthrough = (
+                "content-encoding" in headers
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+            )
+            if self.passthrough:
+                await self.downstream(message)
+            else:
+                self.start_message = message
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.downstream(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.start_message is not None:
+            start, self.start_message = self.start_message, None
+            headers = MutableHeaders(scope=start)
+            headers.add_vary_header("Accept-Encoding")
+            if not more_body:
+                if len(body) < self.minimum_size:
+                    await self.downstream(start)
+                    await self.downstream(message)
+                    return
+                body = await self.run(self.encoder.compress, body)
+                headers["Content-Length"] = str(len(body))
+            else:
+                self.stream = self.encoder.stream()
+                del headers["Content-Length"]
+            headers["Content-Encoding"] = self.encoder.name
+            await self.downstream(start)
+            if self.stream is None:
+                await self.downstream({"type": "http.response.body", "body": body})
+                return
+
+        chunk = await self.run(self.stream.compress, body) if body else b""
+        if not more_body:
+            chunk += self.stream.finish()
+        if chunk or not more_body:
+            await self.downstream({"type": "http.response.body", "body": chunk, "more_body": more_body})
@@ -1,5 +1,6 @@
 import logging
 from functools import lru_cache
+from pathlib import Path
 from pydantic import AnyUrl
 from pydantic_settings import BaseSettings
 
@@ -11,6 +12,53 @@ class Settings(BaseSettings):
     environment: str = "dev"
     testing: bool = 0
     database_url: AnyUrl = None
+    highlight_edit_window_ms: int = 50
+    highlight_edit_max_batch: int = 100
+    compression_minimum_size: int = 1024
+    compression_threadpool_size: int = 256 * 1024
+    log_level: str = "INFO"
+    log_format: str = "json"
+    log_debug_sample_rate: float = 0.01
+    threadpool_workers: int = 40
+    shutdown_timeout: float = 20.0
+    # HS256 signs with jwt_secret_key; EdDSA, ES256 and the other asymmetric
+    # algorithms sign with the PEM private key and verify with the public
+    # one (derived from the private key if not given). A process with only
+    # the public key can verify tokens but not issue them.
+    jwt_algorithm: str = "HS256"
+    jwt_secret_key: str | None = None
+    jwt_private_key_file: Path | None = None
+    jwt_public_key_file: Path | None = None
+    access_token_expire_minutes: int = 15
+    # Sessions expire after this many days without a renewal, and this
+    # many days after they started however often they are renewed. Refresh
+    # tokens are hashed with refresh_token_secret, or jwt_secret_key if unset.
+    refresh_token_expire_days: int = 30
+    session_max_days: int = 90
+    refresh_token_secret: str | None = None
+    # How often each worker deletes expired and ended sessions.
+    session_prune_seconds: float = 3600.0
+    # API keys are hashed with this, or jwt_secret_key if unset.
+    api_key_secret: str | None = None
+    # Requests allowed per key in any rate_limit_window_seconds; 0 for no
+    # limit. See app.ratelimit.
+    rate_limit_enabled: bool = True
+    rate_limit_window_seconds: float = 60.0
+    rate_limit_redis_url: str | None = None
+    login_attempts_per_ip: int = 30
+    login_failures_per_username: int = 10
+    login_failures_per_account: int = 100
+    summary_requests_per_ip: int = 30
+    token_refreshes_per_ip: int = 60
+    highlight_writes_per_user: int = 600
+    token_revocation_refresh_seconds: float = 10.0
+    # How often each worker checks for a newly activated policy set when no
+    # NOTIFY reaches it (always, on SQLite), and how many decisions it keeps.
+    policy_refresh_seconds: float = 10.0
+    policy_decision_cache_size: int = 10_000
+    # Summaries left empty are generated again at startup, by one worker,
+    # until this many attempts have been made at each.
+    summary_max_attempts: int = 3
 
 @lru_cache
 def get_settings() -> BaseSettings:
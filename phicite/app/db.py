@@ -1,45 +1,225 @@
-import os
+import asyncio
+import re
 
 import logging
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager, suppress
 
-from fastapi import FastAPI
-from tortoise import Tortoise, run_async
-from tortoise.contrib.fastapi import register_tortoise
+from tortoise import Tortoise, connections, run_async
+
+from app.config import Settings, get_settings
 
 log = logging.getLogger("uvicorn")
 
-TORTOISE_ORM = {
-    "connections": {"default": os.environ.get("DATABASE_URL")},
-    "apps": {
-        "models": {
-            "models": ["app.models.tortoise", "aerich.models"],
-            "default_connection": "default",
+# How often a listening connection is checked to be alive, and the shortest
+# and longest waits between attempts to reopen it.
+LISTEN_CHECK_SECONDS = 30
+LISTEN_RETRY_MIN_SECONDS = 1
+LISTEN_RETRY_MAX_SECONDS = 60
+
+MODULES = ["app.models.tortoise"]
+
+
+def tortoise_config(settings: Settings, migrations: bool = False) -> dict:
+    """
+    Tortoise configuration for the database in `settings`; with `migrations`,
+    including aerich's own model.
+    """
+    return {
+        "connections": {"default": str(settings.database_url)},
+        "apps": {
+            "models": {
+                "models": MODULES + (["aerich.models"] if migrations else []),
+                "default_connection": "default",
+            },
         },
-    },
-}
+    }
+
+
+def __getattr__(name: str):
+    # TORTOISE_ORM is read by aerich (see tool.aerich in pyproject.toml). It
+    # is built from the settings on access, so that importing this module
+    # does not need DATABASE_URL; the app connects with connect(settings).
+    if name == "TORTOISE_ORM":
+        return tortoise_config(get_settings(), migrations=True)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+async def connect(settings: Settings) -> None:
+    await Tortoise.init(config=tortoise_config(settings))
+
+
+async def disconnect() -> None:
+    await connections.close_all()
+
+_POSITIONAL_PARAMETER = re.compile(r"\$(\d+)")
+
+async def execute_sql(query: str, values: list | None = None) -> list[dict]:
+    """
+    Run raw SQL written with Postgres `$n` placeholders and return the rows.
+
+    SQLite (used by the CI test run) understands the same numbered
+    parameters spelled `?n`, so the placeholders are rewritten there. The
+    statement runs on the current transaction if there is one.
+    """
+    connection = connections.get("default")
+    if connection.capabilities.dialect == "sqlite":
+        query = _POSITIONAL_PARAMETER.sub(r"?\1", query)
+    return await connection.execute_query_dict(query, values)
+
+async def iterate_sql(query: str, values: list | None = None, prefetch: int = 100) -> AsyncIterator[dict]:
+    """
+    Like execute_sql, but yield the rows as they are read.
+
+    On Postgres they come from a server-side cursor, `prefetch` at a time,
+    on a pool connection held until the iteration ends, so a large result
+    is never all in memory at once. SQLite (the tests) reads them at once.
+    """
+    client = connections.get("default")
+    if client.capabilities.dialect != "postgres":
+        for row in await execute_sql(query, values):
+            yield row
+        return
+    async with client.acquire_connection() as connection:
+        # asyncpg cursors only exist in a transaction.
+        async with connection.transaction():
+            async for record in connection.cursor(query, *(values or []), prefetch=prefetch):
+                yield dict(record)
+
+def sql_in(column: str, values: list, position: int = 1) -> tuple[str, list]:
+    """
+    Build a `column IN (...)` condition for execute_sql.
+
+    On Postgres the list is bound as a single array parameter
+    (`column = ANY($n)`), so the statement text, and asyncpg's prepared
+    statement for it, is the same whatever the number of values. Returns
+    the SQL fragment and the parameter values it consumes.
+    """
+    if connections.get("default").capabilities.dialect == "postgres":
+        return f"{column} = ANY(${position})", [list(values)]
+    placeholders = ", ".join(f"${position + i}" for i in range(len(values)))
+    return f"{column} IN ({placeholders})", list(values)
 
-def init_db(app: FastAPI) -> None:
+@asynccontextmanager
+async def listening(channel: str, callback: Callable[[], None]) -> AsyncIterator[bool]:
     """
-    Initialize the database connection and register Tortoise ORM.
+    Call `callback` for each NOTIFY on `channel` while in the context.
+
+    The subscription has a connection of its own, opened outside the pool
+    so it neither takes a pooled connection nor dies with one. If that
+    connection is lost it is reopened, and `callback` called once for the
+    notifications that may have been missed meanwhile. Only Postgres has
+    notifications: elsewhere this yields False and nothing is called.
+
+    Raises:
+        OSError, asyncpg.PostgresError: If the connection cannot be opened
+            on entry
     """
-    register_tortoise(
-        app,
-        db_url=os.environ.get("DATABASE_URL"),
-        modules={"models": ["app.models.tortoise"]},
-        generate_schemas=False,
-        add_exception_handlers=True,
+    client = connections.get("default")
+    if client.capabilities.dialect != "postgres":
+        yield False
+        return
+    connection = await _subscribe(client, channel, callback)
+    task = asyncio.create_task(_keep_listening(client, channel, callback, connection))
+    try:
+        yield True
+    finally:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+
+async def _subscribe(client, channel: str, callback: Callable[[], None]):
+    import asyncpg
+
+    connection = await asyncpg.connect(
+        host=client.host,
+        port=client.port,
+        user=client.user,
+        password=client.password,
+        database=client.database,
+        server_settings=client.server_settings,
+        ssl=client.extra.get("ssl"),
     )
 
+    def notified(connection, pid, channel, payload) -> None:
+        callback()
+
+    try:
+        await connection.add_listener(channel, notified)
+    except BaseException:
+        connection.terminate()
+        raise
+    return connection
+
+async def _keep_listening(client, channel: str, callback: Callable[[], None], connection) -> None:
+    import asyncpg
+
+    try:
+        while True:
+            lost = asyncio.Event()
+            connection.add_termination_listener(lambda connection: lost.set())
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), LISTEN_CHECK_SECONDS)
+                except asyncio.TimeoutError:
+                    # A connection dropped without a FIN (a failover, say) is
+                    # only noticed by using it.
+                    try:
+                        await connection.execute("SELECT 1", timeout=LISTEN_CHECK_SECONDS)
+                    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                        connection.terminate()
+                        break
+            log.warning("Lost the connection listening on %s; reconnecting", channel)
+            delay = LISTEN_RETRY_MIN_SECONDS
+            while True:
+                await asyncio.sleep(delay)
+                try:
+                    connection = await _subscribe(client, channel, callback)
+                    break
+                except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                    delay = min(2 * delay, LISTEN_RETRY_MAX_SECONDS)
+                    log.warning("Could not listen on %s again (%s); retrying in %ss", channel, e, delay)
+            callback()
+    finally:
+        if not connection.is_closed():
+            connection.terminate()
+
+@asynccontextmanager
+async def advisory_lock(key: int) -> AsyncIterator[bool]:
+    """
+    Try to take the Postgres advisory lock `key`, without waiting, for the
+    context; yields whether it was taken. The lock belongs to a pool
+    connection held until the context exits, and is released with it if
+    the process dies. Without Postgres there is one process: this yields
+    True.
+    """
+    client = connections.get("default")
+    if client.capabilities.dialect != "postgres":
+        yield True
+        return
+    async with client.acquire_connection() as connection:
+        taken = await connection.fetchval("SELECT pg_try_advisory_lock($1)", key)
+        try:
+            yield taken
+        finally:
+            if taken:
+                await connection.execute("SELECT pg_advisory_unlock($1)", key)
+
+async def notify(channel: str, payload: str = "") -> None:
+    """
+    Send a NOTIFY on `channel`, on Postgres; delivered when the current
+    transaction, if any, commits.
+    """
+    if connections.get("default").capabilities.dialect == "postgres":
+        await execute_sql("SELECT pg_notify($1, $2)", [channel, payload])
+
 async def generate_schema() -> None:
     log.info("Initializing Tortoise...")
 
-    await Tortoise.init(
-        db_url=os.environ.get("DATABASE_URL"),
-        modules={"models": ["models.tortoise"]},
-    )
+    await connect(get_settings())
     log.info("Generating database schema via Tortoise...")
     await Tortoise.generate_schemas()
-    await Tortoise.close_connections()
+    await disconnect()
 
 
 if __name__ == "__main__":
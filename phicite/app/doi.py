@@ -0,0 +1,37 @@
+import hashlib
+import re
+from urllib.parse import unquote
+
+
+# An optional resolver or "doi:" prefix followed by the DOI itself. Matching
+# case-insensitively against the raw input avoids lowercasing the whole
+# string (prefix included) before we know it is a DOI at all.
+DOI_PATTERN = re.compile(
+    r"(?:doi:|(?:https?://)?(?:dx\.)?doi\.org/)?(10\.\d{4,9}/[-._;()/:a-z0-9]+)",
+    re.IGNORECASE,
+)
+
+
+def normalize_doi(doi: str) -> str:
+    """
+    Return the canonical, lowercase form of a DOI.
+
+    Accepts bare DOIs, the "doi:" prefix, doi.org and dx.doi.org resolver
+    URLs over http or https, and percent-encoded forms of any of these.
+    Raises ValueError if the input is not a DOI.
+    """
+    if "%" in doi:
+        doi = unquote(doi)
+    match = DOI_PATTERN.fullmatch(doi)
+    if match is None:
+        raise ValueError("Invalid DOI format")
+    return match.group(1).lower()
+
+
+def doi_key(doi: str) -> int:
+    """
+    Fixed-width lookup key for a normalized DOI: the first eight bytes of its
+    MD5 digest as a signed 64-bit integer. Postgres computes the same value
+    with ('x' || substr(md5(doi), 1, 16))::bit(64)::bigint.
+    """
+    return int.from_bytes(hashlib.md5(doi.encode()).digest()[:8], "big", signed=True)
@@ -0,0 +1,286 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Iterator
+
+import fastapi.routing
+from fastapi.responses import JSONResponse
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+# Request latency buckets, in seconds.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Per-request database query count buckets.
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+DB_METHODS = (
+    "execute_insert",
+    "execute_query",
+    "execute_query_dict",
+    "execute_many",
+    "execute_script",
+)
+
+# Phases whose time is summed per request and reported in Server-Timing.
+PHASES = ("db", "auth", "authz", "render")
+
+
+class RequestStats:
+    __slots__ = ("timings", "db_queries")
+
+    def __init__(self) -> None:
+        self.timings = dict.fromkeys(PHASES, 0.0)
+        self.db_queries = 0
+
+
+request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+# Called with the text of every statement the instrumented clients send, in
+# a request or not (the tests' query counter is one).
+statement_listeners: list[Callable[[str], None]] = []
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """
+    Add the time spent in the block to `phase` of the current request.
+    Does nothing outside a request.
+    """
+    stats = request_stats.get()
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.timings[phase] += time.perf_counter() - start
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    In-process request metrics, rendered in the Prometheus text format.
+    Each worker process keeps its own and serves only those.
+    """
+
+    def __init__(self) -> None:
+        self.durations: dict[tuple[str, str, str], Histogram] = {}
+        self.db_queries: dict[tuple[str, str], Histogram] = {}
+        self.phase_seconds: dict[tuple[str, str, str], float] = {}
+
+    def record(self, method: str, route: str, status: int, duration: float, stats: RequestStats) -> None:
+        key = (method, route, str(status))
+        histogram = self.durations.get(key)
+        if histogram is None:
+            histogram = self.durations[key] = Histogram(DURATION_BUCKETS)
+        histogram.observe(duration)
+
+        histogram = self.db_queries.get((method, route))
+        if histogram is None:
+            histogram = self.db_queries[(method, route)] = Histogram(QUERY_BUCKETS)
+        histogram.observe(stats.db_queries)
+
+        for phase, seconds in stats.timings.items():
+            if seconds:
+                key = (method, route, phase)
+                self.phase_seconds[key] = self.phase_seconds.get(key, 0.0) + seconds
+
+    def render(self) -> str:
+        lines = [
+            "# HELP phicite_request_duration_seconds Time to handle a request.",
+            "# TYPE phicite_request_duration_seconds histogram",
+        ]
+        for (method, route, status), histogram in self.durations.items():
+            lines += render_histogram(
+                "phicite_request_duration_seconds",
+                f'method="{method}",route="{escape(route)}",status="{status}"',
+                histogram,
+            )
+        lines += [
+            "# HELP phicite_request_db_queries Database statements run per request.",
+            "# TYPE phicite_request_db_queries histogram",
+        ]
+        for (method, route), histogram in self.db_queries.items():
+            lines += render_histogram(
+                "phicite_request_db_queries",
+                f'method="{method}",route="{escape(route)}"',
+                histogram,
+            )
+        lines += [
+            "# HELP phicite_request_phase_seconds_total Time spent per request phase.",
+            "# TYPE phicite_request_phase_seconds_total counter",
+        ]
+        for (method, route, phase), seconds in self.phase_seconds.items():
+            lines.append(
+                f'phicite_request_phase_seconds_total{{method="{method}",route="{escape(route)}",phase="{phase}"}} {seconds}'
+            )
+        return "\n".join(lines) + "\n"
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_histogram(name: str, labels: str, histogram: Histogram) -> list[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
+
+
+metrics = Metrics()
+
+
+def server_timing(stats: RequestStats, elapsed: float) -> str:
+    entries = [
+        f"{phase};dur={seconds * 1000:.2f}"
+        for phase, seconds in stats.timings.items()
+        if seconds or phase == "db"
+    ]
+    entries[0] += f';desc="{stats.db_queries} queries"'
+    entries.append(f"app;dur={elapsed * 1000:.2f}")
+    return ", ".join(entries)
+
+
+class InstrumentationMiddleware:
+    """
+    Time each HTTP request, collect its database and auth phases, report
+    them in a Server-Timing header and record them in `metrics` under the
+    matched route template.
+    """
+
+    def __init__(self, app: ASGIApp, registry: Metrics = metrics) -> None:
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", server_timing(stats, time.perf_counter() - start))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_stats.reset(token)
+            route = scope.get("route")
+            self.registry.record(
+                scope["method"],
+                route.path if route is not None else "unmatched",
+                status,
+                time.perf_counter() - start,
+                stats,
+            )
+
+
+class TimedJSONResponse(JSONResponse):
+    """
+    JSONResponse that counts the time spent encoding the body as "render".
+    Validating and converting the endpoint's return value comes before it;
+    instrument_serialization counts that too.
+    """
+
+    def render(self, content) -> bytes:
+        with timed("render"):
+            return super().render(content)
+
+
+def counted(method):
+    # wraps() copies the marker of any wrapper underneath, so a method that
+    # was already instrumented and then wrapped again is not instrumented twice.
+    @wraps(method)
+    async def wrapper(self, query, *args, **kwargs):
+        for listener in statement_listeners:
+            listener(query)
+        stats = request_stats.get()
+        if stats is None:
+            return await method(self, query, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return await method(self, query, *args, **kwargs)
+        finally:
+            stats.db_queries += 1
+            stats.timings["db"] += time.perf_counter() - start
+    wrapper.instrumented = True
+    return wrapper
+
+
+def timed_serialization(serialize_response):
+    @wraps(serialize_response)
+    async def wrapper(*args, **kwargs):
+        with timed("render"):
+            return await serialize_response(*args, **kwargs)
+    wrapper.instrumented = True
+    return wrapper
+
+
+def instrument_serialization() -> None:
+    """
+    Count FastAPI's serialize_response, which checks a route's return value
+    against its response_model and turns it into JSON-compatible data with
+    jsonable_encoder, as "render". Request handlers look the function up in
+    fastapi.routing on every call, so wrapping it there covers every route.
+    Safe to call more than once.
+    """
+    if not getattr(fastapi.routing.serialize_response, "instrumented", False):
+        fastapi.routing.serialize_response = timed_serialization(fastapi.routing.serialize_response)
+
+
+def instrument_db_clients() -> None:
+    """
+    Wrap the statement methods of every loaded Tortoise client class, so
+    each statement is counted and timed against the current request.
+
+    Transaction wrappers override some of these methods, so every class
+    that defines one is wrapped. Safe to call more than once.
+    """
+    # Import the backends so their classes exist before Tortoise.init.
+    for module in ("tortoise.backends.sqlite.client", "tortoise.backends.asyncpg.client"):
+        try:
+            __import__(module)
+        except ImportError:  # pragma: no cover - driver not installed
+            pass
+
+    classes = [BaseDBAsyncClient]
+    while classes:
+        cls = classes.pop()
+        classes.extend(cls.__subclasses__())
+        for name in DB_METHODS:
+            method = vars(cls).get(name)
+            if method is not None and not getattr(method, "instrumented", False):
+                setattr(cls, name, counted(method))
@@ -1,25 +1,69 @@
 import logging
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
+from tortoise.contrib.fastapi import tortoise_exception_handlers
 
-from app.api import ping, summaries, highlights, users
-from app.db import init_db
+from app.api import ping, summaries, highlights, users, annotations, metrics
+from app.compression import CompressionMiddleware
+from app.config import get_settings
+from app.instrumentation import InstrumentationMiddleware, TimedJSONResponse, instrument_db_clients, instrument_serialization
+from app.logs import RequestIdMiddleware, configure_logging
+from app.resources import Resources
 
 
 log = logging.getLogger("uvicorn")
 
-def create_application() -> FastAPI:
+
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    resources = application.state.resources
+    await resources.start()
+    try:
+        yield
+    finally:
+        # uvicorn has already waited for in-flight requests and closed the
+        # websockets (which flush their pending edits) by the time this runs.
+        await resources.drain(resources.settings.shutdown_timeout)
+        await resources.close()
+
+
+def create_application(manage_database: bool = False) -> FastAPI:
     """
-    Create and configure the FastAPI application.
+    Create and configure the FastAPI application. With `manage_database`,
+    the application connects to settings.database_url when it starts and
+    disconnects when it stops.
     """
-    application = FastAPI()
+    settings = get_settings()
+    configure_logging(
+        settings.log_level,
+        settings.log_format,
+        debug_sample_rate=settings.log_debug_sample_rate,
+    )
+    application = FastAPI(default_response_class=TimedJSONResponse, lifespan=lifespan)
+    application.state.resources = Resources(settings, manage_database)
+    if manage_database:
+        # DoesNotExist as 404 and IntegrityError as 422.
+        for exception, handler in tortoise_exception_handlers().items():
+            application.add_exception_handler(exception, handler)
+    application.add_middleware(
+        CompressionMiddleware,
+        minimum_size=settings.compression_minimum_size,
+        threadpool_size=settings.compression_threadpool_size,
+    )
+    # Middleware added later wraps what came before: instrumentation also
+    # times compression, and the request id is set around both.
+    application.add_middleware(InstrumentationMiddleware)
+    application.add_middleware(RequestIdMiddleware)
+    instrument_db_clients()
+    instrument_serialization()
     application.include_router(ping.router)
+    application.include_router(metrics.router)
     application.include_router(summaries.router, prefix="/summaries", tags=["summaries"])
     application.include_router(highlights.router, prefix="/highlights", tags=["highlights"])
+    application.include_router(annotations.router, prefix="/highlights", tags=["highlights"])
     application.include_router(users.router, prefix="/users", tags=["users"])
 
     return application
 
-app = create_application()
-
-init_db(app)
\ No newline at end of file
+app = create_application(manage_database=True)
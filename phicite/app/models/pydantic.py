@@ -1,8 +1,8 @@
-from typing import Annotated
-import zxcvbn
-from pydantic import BaseModel, AnyHttpUrl, AfterValidator, EmailStr
-import re
-from app.models.tortoise import User as UserDB, Token as TokenDB, TokenData as TokenDataDB
+from datetime import datetime
+from typing import Annotated, Literal
+from pydantic import BaseModel, AnyHttpUrl, AfterValidator, BeforeValidator, ConfigDict, EmailStr, Field, model_serializer
+from app.doi import normalize_doi
+from app.models.tortoise import User as UserDB, TokenData as TokenDataDB
 from tortoise.contrib.pydantic import pydantic_model_creator
 
 class SummaryPayloadSchema(BaseModel):
@@ -14,23 +14,87 @@ class SummaryResponseSchema(SummaryPayloadSchema):
 class SummaryUpdatePayloadSchema(SummaryPayloadSchema):
     summary: str
 
-def is_valid_doi(doi: str) -> str:
-    doi = doi.lower()
-    if doi.startswith("doi:"):
-        doi = doi[4:]
-    elif doi.startswith("https://doi.org/"):
-        doi = doi[16:]
-    doi_pattern = r"^10\.\d{4,9}/[-._;()/:A-Za-z0-9]+$"
-    if not bool(re.match(doi_pattern, doi)):
-        raise ValueError("Invalid DOI format")
-    return doi
+is_valid_doi = normalize_doi
 
+DOIStr = Annotated[str, AfterValidator(is_valid_doi)]
+
+
+MAX_HIGHLIGHT_PARTS = 256
+MAX_HIGHLIGHT_TEXT_LENGTH = 10_000
+
+class HighlightPartSchema(BaseModel):
+    # Keys other clients store on a part, such as a colour, are kept as
+    # they were before parts were validated.
+    model_config = ConfigDict(extra="allow")
+
+    page: Annotated[int, Field(ge=1)] | None = None
+    rect: tuple[float, float, float, float]
+    text: Annotated[str, Field(max_length=MAX_HIGHLIGHT_TEXT_LENGTH)]
+
+    @model_serializer(mode="wrap")
+    def omit_missing_fields(self, handler) -> dict:
+        # Parts saved before pages were recorded have no "page" key; keep
+        # new parts without a page looking the same on disk and on the wire.
+        data = handler(self)
+        for field in ("page", "rect", "text"):
+            if field in data and data[field] is None:
+                del data[field]
+        return data
+
+class StoredHighlightPartSchema(HighlightPartSchema):
+    """
+    A part as read back from the database. Rows written before parts were
+    validated may lack a rect or text; they are returned as stored.
+    """
+    page: int | None = None
+    rect: tuple[float, float, float, float] | None = None
+    text: str | None = None
+
+def number_highlight_parts(value):
+    """
+    Accept a highlight given as a list of parts as well as the stored form,
+    a dict keyed "1", "2", ... in order.
+    """
+    if isinstance(value, list):
+        return {str(number): part for number, part in enumerate(value, start=1)}
+    return value
+
+HighlightParts = Annotated[
+    dict[Annotated[str, Field(max_length=8)], HighlightPartSchema],
+    BeforeValidator(number_highlight_parts),
+    Field(min_length=1, max_length=MAX_HIGHLIGHT_PARTS),
+]
 
 class HighlightPayloadSchema(BaseModel):
-    doi: Annotated[str, AfterValidator(is_valid_doi)]
-    highlight: dict
+    doi: DOIStr
+    highlight: HighlightParts
     comment: str | None = None
 
+    def stored_highlight(self) -> dict:
+        """
+        The highlight as it is written to the database.
+        """
+        return self.model_dump(include={"highlight"})["highlight"]
+
+class HighlightBatchRequestSchema(BaseModel):
+    dois: Annotated[list[DOIStr], Field(min_length=1, max_length=100)]
+    limit_per_doi: Annotated[int, Field(ge=1, le=1000)] = 100
+
+class DOIStatsRequestSchema(BaseModel):
+    dois: Annotated[list[DOIStr], Field(min_length=1, max_length=500)]
+
+class HighlightEditSchema(HighlightPayloadSchema):
+    seq: int
+    id: Annotated[int, Field(gt=0)]
+
+class HighlightEditAckSchema(BaseModel):
+    seq: int | None = None
+    id: int | None = None
+    status: int
+    detail: str | list | None = None
+    # Seconds to wait before sending the edit again, with status 429.
+    retry_after: int | None = None
+
 class HighlightDeleteResponseSchema(BaseModel):
     id: int
 
@@ -40,12 +104,32 @@ class HighlightCreateResponseSchema(BaseModel):
     created_at: str
 
 class HighlightResponseSchemaPublic(HighlightCreateResponseSchema):
-    highlight: dict
+    highlight: dict[str, StoredHighlightPartSchema]
     comment: str | None = None
 
 class HighlightResponseSchema(HighlightResponseSchemaPublic):
     username: str
 
+class HighlightPagePartSchema(BaseModel):
+    highlight_id: int
+    part: str
+    page: int
+    rect: tuple[float, float, float, float]
+    text: str
+
+class HighlightLibraryEntrySchema(BaseModel):
+    doi: str
+    highlights: list[HighlightResponseSchemaPublic]
+
+class HighlightLibraryPageSchema(BaseModel):
+    items: list[HighlightLibraryEntrySchema]
+    next_cursor: str | None = None
+
+class HighlightDOISummarySchema(BaseModel):
+    doi: str
+    count: int
+    last_activity: str
+
 UserSchema = pydantic_model_creator(
     UserDB, 
     name="User",
@@ -62,7 +146,10 @@ def validate_password_strength(password: str) -> str:
     Validate password strength using zxcvbn.
     Returns the password if it's strong enough, otherwise raises ValueError.
     """
-    result = zxcvbn.zxcvbn(password)
+    # zxcvbn loads large frequency lists on import; only registration needs it.
+    from zxcvbn import zxcvbn
+
+    result = zxcvbn(password)
     
     # Scores range from 0-4, with 4 being strongest
     if result['score'] < 3:
@@ -87,11 +174,15 @@ class AuthenticationPayloadSchema(BaseModel):
     username: str
     password: str
 
-TokenSchema = pydantic_model_creator(
-    TokenDB, 
-    name="Token",
-    exclude=("id",)
-)
+class TokenSchema(BaseModel):
+    access_token: str
+    token_type: str
+    # Sent when a session is started or renewed; exchange it at
+    # /users/token/refresh for the next pair.
+    refresh_token: str | None = None
+
+class RefreshTokenPayloadSchema(BaseModel):
+    refresh_token: str
 
 TokenDataSchema = pydantic_model_creator(
     TokenDataDB,
@@ -99,5 +190,55 @@ TokenDataSchema = pydantic_model_creator(
     exclude=("id",)
 )
 
-class AuthSchema(UserSchema):
-    authorized: bool
\ No newline at end of file
+class CurrentUserSchema(BaseModel):
+    """
+    What authentication and authorization need to know about a user, all of
+    it carried by their access token.
+    """
+    id: int
+    username: str
+    is_admin: bool
+    disabled: bool
+    # What the API key the request came with may do; None when the user
+    # logged in, which is not limited by scopes.
+    scopes: list[str] | None = None
+
+class AuthSchema(CurrentUserSchema):
+    authorized: bool
+
+# See app.apikeys.
+ApiKeyScope = Literal["highlights:read", "highlights:write", "metrics:read"]
+
+class ApiKeyCreateSchema(BaseModel):
+    name: str = Field(min_length=1, max_length=100)
+    scopes: list[ApiKeyScope] = Field(min_length=1)
+
+class ApiKeySchema(BaseModel):
+    id: int
+    name: str
+    prefix: str
+    scopes: list[ApiKeyScope]
+    created_at: datetime
+
+class ApiKeyCreatedSchema(ApiKeySchema):
+    # The key itself, returned only when it is created.
+    key: str
+
+# See app.policy.
+class PolicyRuleSchema(BaseModel):
+    sub_rule: str = Field(min_length=1)
+    obj: str = Field(min_length=1, max_length=255)
+    act: str = Field(min_length=1, max_length=16)
+
+class PolicySetCreateSchema(BaseModel):
+    comment: str | None = None
+    rules: list[PolicyRuleSchema] = Field(min_length=1)
+
+class PolicySetSchema(BaseModel):
+    id: int
+    comment: str | None
+    created_at: datetime
+    activated_at: datetime | None
+
+class PolicySetDetailSchema(PolicySetSchema):
+    rules: list[PolicyRuleSchema]
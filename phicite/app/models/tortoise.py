@@ -1,4 +1,5 @@
 from tortoise import fields, models
+from app.doi import doi_key
 from tortoise.contrib.pydantic import pydantic_model_creator
 
 
@@ -6,19 +7,35 @@ class TextSummary(models.Model):
     url = fields.TextField()
     summary = fields.TextField()
     created_at = fields.DatetimeField(auto_now_add=True)
+    # How many times generating the summary has been started. An empty
+    # summary is generated again at startup until this reaches
+    # summary_max_attempts.
+    attempts = fields.SmallIntField(default=0)
 
     def __str__(self):
         return self.url
     
-SummarySchema = pydantic_model_creator(TextSummary)
+SummarySchema = pydantic_model_creator(TextSummary, exclude=("attempts",))
 
 class PDFHighlight(models.Model):
     doi = fields.CharField(max_length=255, db_index=True)
+    # app.doi.doi_key(doi); highlight lookups by DOI go through this index.
+    # Nullable only until app.backfill has filled in rows that predate it;
+    # lookups match NULL keys on the DOI alone until then.
+    doi_key = fields.BigIntField(null=True)
     highlight = fields.JSONField()
     comment = fields.TextField(null=True)
     created_at = fields.DatetimeField(auto_now_add=True)
     user = fields.ForeignKeyField("models.User", related_name="pdf_highlights")
 
+    class Meta:
+        indexes = (("user_id", "doi", "id"), ("doi_key", "id"))
+
+    async def save(self, *args, **kwargs) -> None:
+        if self.doi_key is None:
+            self.doi_key = doi_key(self.doi)
+        await super().save(*args, **kwargs)
+
     def highlight_text(self):
         return " ".join([highlight["text"] for highlight in self.highlight.values()])
 
@@ -34,6 +51,71 @@ PDFHighlightSchema = pydantic_model_creator(
     include=["id", "doi", "highlight", "comment", "created_at", "user.username"]
     ) 
 
+# One row per part of a highlight, so the viewer can ask for just the parts
+# on one page that intersect what is on screen. Kept in step with
+# pdfhighlight.highlight by the crud layer; the rect is stored with
+# x1 <= x2 and y1 <= y2.
+class HighlightPart(models.Model):
+    highlight = fields.ForeignKeyField(
+        "models.PDFHighlight", related_name="parts", on_delete=fields.CASCADE
+    )
+    doi_key = fields.BigIntField()
+    number = fields.CharField(max_length=8)
+    page = fields.IntField(null=True)
+    x1 = fields.FloatField()
+    y1 = fields.FloatField()
+    x2 = fields.FloatField()
+    y2 = fields.FloatField()
+    text = fields.TextField()
+
+    class Meta:
+        table = "highlight_part"
+        indexes = (("doi_key", "page"), ("highlight_id",))
+
+    @classmethod
+    def from_stored(cls, highlight_id: int, doi_key: int, highlight: dict) -> list["HighlightPart"]:
+        parts = []
+        for number, part in highlight.items():
+            x1, y1, x2, y2 = (float(value) for value in part["rect"])
+            parts.append(cls(
+                highlight_id=highlight_id,
+                doi_key=doi_key,
+                number=number,
+                page=part.get("page"),
+                x1=min(x1, x2),
+                y1=min(y1, y2),
+                x2=max(x1, x2),
+                y2=max(y1, y2),
+                text=part["text"],
+            ))
+        return parts
+
+# Running highlight and reader counts per DOI, kept in step with
+# pdfhighlight by the crud layer so reads never scan highlights.
+class DOIStats(models.Model):
+    doi = fields.CharField(max_length=255, primary_key=True)
+    highlight_count = fields.IntField(default=0)
+    reader_count = fields.IntField(default=0)
+
+    class Meta:
+        table = "doi_stats"
+
+    def __str__(self):
+        return f"{self.doi}: {self.highlight_count} highlights by {self.reader_count} readers"
+
+DOIStatsSchema = pydantic_model_creator(DOIStats, name="DOIStats")
+
+# How many highlights one user has on one DOI, so reader_count only
+# changes when a user's first highlight is added or last one removed.
+class DOIReader(models.Model):
+    doi = fields.CharField(max_length=255)
+    highlight_count = fields.IntField(default=0)
+    user = fields.ForeignKeyField("models.User", related_name="doi_readers")
+
+    class Meta:
+        table = "doi_reader"
+        unique_together = (("doi", "user_id"),)
+
 # Tortoise ORM model (single table)
 class User(models.Model):
     username = fields.CharField(max_length=50, unique=True)
@@ -48,6 +130,73 @@ class User(models.Model):
     
 UserSchema = pydantic_model_creator(User, exclude=("hashed_password",))
 
+# A login that can be renewed without the password. The refresh token is
+# "<id>.<generation>.<secret>"; only an HMAC of the current secret is
+# stored, and it changes on every renewal. generation counts renewals, so a
+# refresh token used again after being rotated away, however long ago, can
+# be recognized (app.sessions).
+class UserSession(models.Model):
+    user = fields.ForeignKeyField("models.User", related_name="sessions", on_delete=fields.CASCADE)
+    token_hash = fields.CharField(max_length=64)
+    generation = fields.IntField(default=0)
+    created_at = fields.DatetimeField(auto_now_add=True)
+    expires_at = fields.DatetimeField()
+    revoked_at = fields.DatetimeField(null=True)
+
+    class Meta:
+        table = "user_session"
+        indexes = (("user_id",),)
+
+# A key a service authenticates with instead of logging in as the user. The
+# key is "phc_<prefix>_<secret>": the prefix finds the row, and only an HMAC
+# of the secret is stored. scopes limits what the key may do (app.apikeys).
+class ApiKey(models.Model):
+    user = fields.ForeignKeyField("models.User", related_name="api_keys", on_delete=fields.CASCADE)
+    name = fields.CharField(max_length=100)
+    prefix = fields.CharField(max_length=16, unique=True)
+    key_hash = fields.CharField(max_length=64)
+    scopes = fields.JSONField()
+    created_at = fields.DatetimeField(auto_now_add=True)
+    revoked_at = fields.DatetimeField(null=True)
+
+    class Meta:
+        table = "api_key"
+        indexes = (("user_id",),)
+
+# A revoked access token (jti), or every token issued to a user before
+# revoked_at (user_id, which is not a foreign key: revoking a deleted user's
+# tokens is the point). Kept until the tokens it covers have expired.
+class RevokedToken(models.Model):
+    jti = fields.CharField(max_length=32, null=True, unique=True)
+    user_id = fields.IntField(null=True)
+    revoked_at = fields.DatetimeField()
+    expires_at = fields.DatetimeField(db_index=True)
+
+    class Meta:
+        table = "revoked_token"
+
+# A version of the ABAC policy (app.policy). Publishing a set activates it;
+# activating an older one again rolls back to it. The set activated last is
+# the policy, and with none the policy is abac_policy.csv.
+class PolicySet(models.Model):
+    comment = fields.TextField(null=True)
+    created_at = fields.DatetimeField(auto_now_add=True)
+    activated_at = fields.DatetimeField(null=True, db_index=True)
+
+    class Meta:
+        table = "policy_set"
+
+# One line of a policy set, as in abac_policy.csv: p, sub_rule, obj, act.
+class PolicyRule(models.Model):
+    policy_set = fields.ForeignKeyField("models.PolicySet", related_name="rules", on_delete=fields.CASCADE)
+    sub_rule = fields.TextField()
+    obj = fields.CharField(max_length=255)
+    act = fields.CharField(max_length=16)
+
+    class Meta:
+        table = "policy_rule"
+        indexes = (("policy_set_id",),)
+
 class Token(models.Model):
     access_token = fields.CharField(max_length=255)
     token_type = fields.CharField(max_length=50)
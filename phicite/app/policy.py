@@ -0,0 +1,239 @@
+"""
+The ABAC policy: which users may do what.
+
+A rule is a line `p, sub_rule, obj, act` as in abac_policy.csv, read with
+the model in abac_model.conf: a request (sub, obj, act, res) is allowed if
+a rule for its obj and act has a sub_rule that holds. sub_rule is an
+expression over the user (r.sub) and, for rules about one resource such as
+a highlight, the resource (r.res, a Resource).
+
+The rules in force are the policy set activated last in the database
+(published at /users/admin/policy/), or abac_policy.csv while none has
+been. Each worker holds them compiled: every rule's matcher is parsed once
+and indexed by obj and act, so a check evaluates only the rules that could
+apply, and decisions are kept in an LRU keyed by the attributes those
+rules read. Activating a set reloads it in this worker and notifies the
+others (NOTIFY on POLICY_CHANNEL, Postgres only), which also check for a
+new set every POLICY_REFRESH_SECONDS in case a notification was missed.
+"""
+import asyncio
+import logging
+import re
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, NamedTuple, Union
+
+from app.api import crud
+from app.config import get_settings
+from app.db import listening, notify
+from app.models.tortoise import PolicySet
+
+log = logging.getLogger("uvicorn")
+
+# The model and policy files sit beside the app package, wherever the
+# process was started from.
+BASE_DIR = Path(__file__).resolve().parent.parent
+MODEL_PATH = BASE_DIR / "abac_model.conf"
+POLICY_PATH = BASE_DIR / "abac_policy.csv"
+
+POLICY_CHANNEL = "policy"
+
+# r.sub.<attribute> and r.res.<attribute>, as casbin escapes them.
+_ATTRIBUTE = re.compile(r"\b(r_sub|r_res)\.(\w+)")
+_WHOLE = re.compile(r"\b(r_sub|r_res)\b(?!\.)")
+
+Rule = tuple[str, str, str]
+
+
+class Resource(NamedTuple):
+    """
+    The resource a request is about, as rules see it (r.res).
+    """
+    user_id: int
+
+
+class CompiledPolicy:
+    def __init__(self, rules: list[Rule], model, functions: dict) -> None:
+        # casbin.util and CoreEnforcer._get_expression are not public API,
+        # which is why casbin is pinned to one release in pyproject.toml and
+        # requirements.txt: check this class before upgrading it.
+        from casbin import util
+        from casbin.core_enforcer import CoreEnforcer
+
+        self.r_tokens = model["r"]["r"].tokens
+        p_tokens = model["p"]["p"].tokens
+        matcher = model["m"]["m"].value
+        # (obj, act) -> the rules for it, each with its parameters and its
+        # matcher parsed.
+        self.index: dict[tuple[str, str], list[tuple[dict, Any]]] = {}
+        # (obj, act) -> the attributes its rules read, or None if one of them
+        # reads all of r.sub or r.res and its decisions cannot be cached.
+        self.reads: dict[tuple[str, str], Union[tuple[tuple[str, str], ...], None]] = {}
+        for rule in rules:
+            if len(rule) != len(p_tokens):
+                raise ValueError(f"A rule has {len(p_tokens)} fields, not {len(rule)}: {rule}")
+            p_parameters = dict(zip(p_tokens, rule))
+            escaped = [util.escape_assertion(p_parameters[name]) for name in util.get_eval_value(matcher)]
+            expression = util.replace_eval(matcher, escaped)
+            try:
+                # casbin's own parsing, so rules mean what casbin.Enforcer
+                # takes them to.
+                parsed = CoreEnforcer._get_expression(expression, functions)
+            except SyntaxError as e:
+                raise ValueError(f"Invalid rule {rule}: {e.msg}") from e
+            # The model matches obj and act exactly, so no other rule can
+            # apply to a request.
+            key = (p_parameters["p_obj"], p_parameters["p_act"])
+            self.index.setdefault(key, []).append((p_parameters, parsed))
+            reads = self.reads.get(key, ())
+            if reads is not None:
+                reads = None if _WHOLE.search(expression) else tuple(sorted({*reads, *_ATTRIBUTE.findall(expression)}))
+            self.reads[key] = reads
+
+    def allows(self, sub, obj: str, act: str, res: Union[Resource, None] = None) -> bool:
+        from simpleeval import InvalidExpression
+
+        request = dict(zip(self.r_tokens, (sub, obj, act, res)))
+        for p_parameters, parsed in self.index.get((obj, act), ()):
+            try:
+                if parsed.eval({**request, **p_parameters}):
+                    return True
+            except InvalidExpression:
+                # Such as r.res.user_id with no resource: the rule does not
+                # apply.
+                continue
+        return False
+
+    def decision_key(self, sub, obj: str, act: str, res: Union[Resource, None] = None) -> Union[tuple, None]:
+        """
+        What a decision depends on, or None if it cannot be cached.
+        """
+        reads = self.reads.get((obj, act), ())
+        if reads is None:
+            return None
+        request = {"r_sub": sub, "r_res": res}
+        values = []
+        for name, attribute in reads:
+            value = getattr(request[name], attribute, None)
+            values.append(tuple(value) if isinstance(value, list) else value)
+        key = (obj, act, *values)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+
+class PolicyEngine:
+    def __init__(self, cache_size: int) -> None:
+        import casbin
+
+        # casbin reads the model and the file's rules; evaluating them is
+        # left to CompiledPolicy.
+        enforcer = casbin.Enforcer(str(MODEL_PATH), str(POLICY_PATH))
+        self.model = enforcer.model
+        self.functions = enforcer.fm.get_functions()
+        self.file_rules: list[Rule] = [tuple(rule) for rule in enforcer.get_policy()]
+        self.cache_size = cache_size
+        self.decisions: OrderedDict[tuple, bool] = OrderedDict()
+        # (policy set id, activated_at), or None for the file's rules.
+        self.version: Union[tuple[int, datetime], None] = None
+        self.policy = self.compile(self.file_rules)
+
+    def compile(self, rules: list[Rule]) -> CompiledPolicy:
+        """
+        Raises:
+            ValueError: If a rule does not parse
+        """
+        return CompiledPolicy(rules, self.model, self.functions)
+
+    def enforce(self, sub, obj: str, act: str, res: Union[Resource, None] = None) -> bool:
+        policy = self.policy
+        key = policy.decision_key(sub, obj, act, res)
+        if key is None:
+            return policy.allows(sub, obj, act, res)
+        allowed = self.decisions.get(key)
+        if allowed is None:
+            allowed = self.decisions[key] = policy.allows(sub, obj, act, res)
+            if len(self.decisions) > self.cache_size:
+                self.decisions.popitem(last=False)
+        else:
+            self.decisions.move_to_end(key)
+        return allowed
+
+    def use(self, policy: CompiledPolicy, version: Union[tuple[int, datetime], None]) -> None:
+        self.policy = policy
+        self.version = version
+        self.decisions.clear()
+
+    async def refresh(self) -> bool:
+        """
+        Load the policy set activated last, if it is not the one in use;
+        returns whether it was loaded.
+        """
+        active = await crud.get_active_policy_set()
+        version = (active["id"], active["activated_at"]) if active else None
+        if version == self.version:
+            return False
+        rules = await crud.get_policy_rules(active["id"]) if active else self.file_rules
+        self.use(self.compile(rules), version)
+        log.info("Loaded policy set %s", active["id"] if active else POLICY_PATH.name)
+        return True
+
+    async def publish(self, rules: list[Rule], comment: Union[str, None] = None) -> PolicySet:
+        """
+        Store `rules` as a new policy set and put it in force everywhere.
+
+        Raises:
+            ValueError: If a rule does not parse
+        """
+        self.compile(rules)
+        policy_set = await crud.post_policy_set(rules, comment, datetime.now(timezone.utc))
+        await self.changed()
+        return policy_set
+
+    async def activate(self, id: int) -> bool:
+        """
+        Put policy set `id` back in force everywhere; False if there is none.
+        """
+        if not await crud.activate_policy_set(id, datetime.now(timezone.utc)):
+            return False
+        await self.changed()
+        return True
+
+    async def changed(self) -> None:
+        await self.refresh()
+        await notify(POLICY_CHANNEL)
+
+    async def keep_fresh(self, interval: float) -> None:
+        changed = asyncio.Event()
+        try:
+            async with listening(POLICY_CHANNEL, changed.set):
+                await self.poll(changed, interval)
+        except Exception:
+            log.exception("Could not listen for policy changes; checking every %ss", interval)
+            await self.poll(changed, interval)
+
+    async def poll(self, changed: asyncio.Event, interval: float) -> None:
+        while True:
+            changed.clear()
+            try:
+                await self.refresh()
+            except Exception:
+                log.exception("Could not refresh the policy")
+            try:
+                await asyncio.wait_for(changed.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+@lru_cache
+def get_enforcer() -> PolicyEngine:
+    """
+    The ABAC policy engine, built from abac_policy.csv on first use. The
+    application lifespan calls this at startup, then loads the database's
+    policy set, so no request pays for either.
+    """
+    return PolicyEngine(get_settings().policy_decision_cache_size)
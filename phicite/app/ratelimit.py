@@ -0,0 +1,195 @@
+"""
+Sliding-window rate limits.
+
+Each limit keeps two counters per key: this window's and the previous
+window's. The previous count is weighted by how much of the previous window
+still overlaps the sliding window ending now, which approximates a true
+sliding window in constant memory per key.
+
+Counters are held per worker in memory, or shared by all workers and
+processes in Redis (RATE_LIMIT_REDIS_URL; needs the redis package). If
+Redis is unreachable, the worker falls back to its own counters rather than
+either refusing or waving through every request.
+
+Limits are attached to routes as dependencies, and are checked before the
+route does any work: a login over its limit is refused before the password
+is hashed.
+"""
+import logging
+import math
+import time
+from collections.abc import Callable
+from typing import Annotated, Union
+
+from fastapi import Depends, HTTPException, Request
+
+from app.config import Settings
+
+log = logging.getLogger("uvicorn")
+
+# Above this many keys, the memory backend drops the expired ones.
+MAX_MEMORY_KEYS = 100_000
+
+
+class MemoryBackend:
+    def __init__(self, clock: Callable[[], float] = time.time) -> None:
+        self.clock = clock
+        # key -> (window number, previous window's count, this window's count)
+        self.counters: dict[str, tuple[int, int, int]] = {}
+
+    async def increment(self, key: str, window: float, amount: int) -> tuple[int, int, float]:
+        """
+        Add `amount` to the key's count; returns the previous and current
+        window's counts and how far through the current window it is (0-1).
+        """
+        now = self.clock()
+        number = int(now // window)
+        counted_in, previous, current = self.counters.get(key, (number, 0, 0))
+        if counted_in != number:
+            previous = current if counted_in == number - 1 else 0
+            current = 0
+        current += amount
+        if amount:
+            if len(self.counters) >= MAX_MEMORY_KEYS and key not in self.counters:
+                self.prune(number)
+            self.counters[key] = (number, previous, current)
+        return previous, current, now / window - number
+
+    def prune(self, number: int) -> None:
+        self.counters = {key: value for key, value in self.counters.items() if value[0] >= number - 1}
+
+    async def close(self) -> None:
+        pass
+
+
+class RedisBackend:
+    def __init__(self, url: str, clock: Callable[[], float] = time.time) -> None:
+        import redis.asyncio as redis
+
+        self.errors = (redis.RedisError, OSError)
+        self.client = redis.from_url(url)
+        self.clock = clock
+        self.fallback = MemoryBackend(clock)
+
+    async def increment(self, key: str, window: float, amount: int) -> tuple[int, int, float]:
+        now = self.clock()
+        number = int(now // window)
+        try:
+            async with self.client.pipeline(transaction=False) as pipeline:
+                pipeline.incrby(f"ratelimit:{key}:{number}", amount)
+                pipeline.expire(f"ratelimit:{key}:{number}", math.ceil(2 * window))
+                pipeline.get(f"ratelimit:{key}:{number - 1}")
+                current, _, previous = await pipeline.execute()
+        except self.errors:
+            log.warning("Rate limit backend unavailable; counting in this worker", exc_info=True)
+            return await self.fallback.increment(key, window, amount)
+        return int(previous or 0), int(current), now / window - number
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+def retry_after(previous: int, current: int, elapsed: float, limit: int, window: float) -> float:
+    """
+    Seconds until the sliding count is back within `limit`, if nothing more
+    is counted.
+    """
+    if current > limit:
+        # Wait out this window, then for enough of this window's count to
+        # slide out of the next.
+        return (1 - elapsed) * window + (1 - limit / current) * window
+    # Wait for enough of the previous window's count to slide out.
+    return max(0.0, (1 - (limit - current) / previous - elapsed) * window)
+
+
+class RateLimit:
+    def __init__(self, backend, name: str, limit: int, window: float) -> None:
+        self.backend = backend
+        self.name = name
+        self.limit = limit
+        self.window = window
+
+    async def count(self, key: str, amount: int = 1) -> Union[float, None]:
+        """
+        Count `amount` requests against `key`. Returns how many seconds the
+        caller should wait if the key is now over the limit, else None. A
+        limit of 0 never refuses.
+        """
+        previous, current, elapsed = await self.backend.increment(f"{self.name}:{key}", self.window, amount)
+        return self.refusal(previous, current, elapsed)
+
+    async def check(self, key: str) -> Union[float, None]:
+        """
+        Like count, for one more request, without counting it.
+        """
+        previous, current, elapsed = await self.backend.increment(f"{self.name}:{key}", self.window, 0)
+        return self.refusal(previous, current + 1, elapsed)
+
+    def refusal(self, previous: int, current: int, elapsed: float) -> Union[float, None]:
+        if not self.limit or previous * (1 - elapsed) + current <= self.limit:
+            return None
+        return retry_after(previous, current, elapsed, self.limit, self.window)
+
+    async def enforce(self, key: str, amount: int = 1) -> None:
+        wait = await self.count(key, amount)
+        if wait is not None:
+            raise too_many_requests(wait)
+
+
+class RateLimits:
+    """
+    The application's limits, all sharing one backend.
+    """
+
+    def __init__(self, settings: Settings, backend=None) -> None:
+        self.backend = backend or MemoryBackend()
+        self.enabled = settings.rate_limit_enabled
+        window = settings.rate_limit_window_seconds
+        self.login_ip = RateLimit(self.backend, "login-ip", settings.login_attempts_per_ip, window)
+        # Only failed attempts count against a username, so its owner is not
+        # locked out by logging in often: login_username counts them from one
+        # address, and login_account, with a higher limit, from all of them,
+        # which catches guessing spread over many addresses.
+        self.login_username = RateLimit(self.backend, "login-username", settings.login_failures_per_username, window)
+        self.login_account = RateLimit(self.backend, "login-account", settings.login_failures_per_account, window)
+        self.summaries = RateLimit(self.backend, "summaries", settings.summary_requests_per_ip, window)
+        self.token_refreshes = RateLimit(self.backend, "token-refreshes", settings.token_refreshes_per_ip, window)
+        self.highlight_writes = RateLimit(self.backend, "highlight-writes", settings.highlight_writes_per_user, window)
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "RateLimits":
+        if settings.rate_limit_redis_url:
+            return cls(settings, RedisBackend(settings.rate_limit_redis_url))
+        return cls(settings)
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+
+def too_many_requests(wait: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Too many requests",
+        headers={"Retry-After": str(max(1, math.ceil(wait)))},
+    )
+
+
+def client_address(request: Request) -> str:
+    # Behind a proxy this is the proxy's address unless uvicorn is told to
+    # trust its X-Forwarded-For (FORWARDED_ALLOW_IPS, see gunicorn.conf.py).
+    return request.client.host if request.client else "unknown"
+
+
+def get_rate_limits(request: Request) -> RateLimits:
+    return request.app.state.resources.rate_limits
+
+
+def rate_limited(name: str, key: Callable[[Request], str] = client_address):
+    """
+    A dependency counting each request against the limit `name`, keyed by
+    client address unless `key` says otherwise.
+    """
+    async def limit_rate(request: Request, rate_limits: Annotated[RateLimits, Depends(get_rate_limits)]) -> None:
+        if rate_limits.enabled:
+            await getattr(rate_limits, name).enforce(key(request))
+    return limit_rate
@@ -0,0 +1,98 @@
+"""
+Everything the application holds for as long as it serves: the database
+connections, the threadpool, the policy engine, the token service and its
+revocation list, the rate limit counters, and background jobs such as
+summarization. The lifespan
+in app.main starts them before the first request and, on shutdown (SIGTERM
+during a deploy), lets running jobs finish before closing the connections
+they use.
+"""
+import asyncio
+import logging
+from typing import Coroutine
+
+from anyio import to_thread
+
+from app.config import Settings
+from app.db import connect, disconnect
+from app.policy import get_enforcer
+from app.ratelimit import RateLimits
+from app.sessions import get_session_store
+from app.summarizer import resume_summaries
+from app.tokens import get_token_service
+
+log = logging.getLogger("uvicorn")
+
+
+class Resources:
+    def __init__(self, settings: Settings, manage_database: bool = True) -> None:
+        # Tests connect Tortoise themselves, to a database rolled back after
+        # each test, so they leave the connections alone.
+        self.settings = settings
+        self.manage_database = manage_database
+        self.rate_limits = RateLimits.from_settings(settings)
+        self.jobs: set[asyncio.Task] = set()
+        # Loops that run until shutdown, cancelled rather than waited for.
+        self.services: set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        if self.manage_database:
+            await connect(self.settings)
+        # Shared by run_in_threadpool: the summarizer, compression of large
+        # bodies and the sync parts of FastAPI.
+        to_thread.current_default_thread_limiter().total_tokens = self.settings.threadpool_workers
+        # Build the policy engine before serving rather than on the first
+        # authorized request.
+        policy = get_enforcer()
+        tokens = get_token_service()
+        # Only a process that issues tokens renews them.
+        sessions = get_session_store() if tokens.signing_key is not None else None
+        if self.manage_database:
+            interval = self.settings.token_revocation_refresh_seconds
+            self.services.add(asyncio.create_task(tokens.keep_revocations_fresh(interval)))
+            if sessions is not None:
+                self.services.add(asyncio.create_task(sessions.keep_pruned(self.settings.session_prune_seconds)))
+            await policy.refresh()
+            self.services.add(asyncio.create_task(policy.keep_fresh(self.settings.policy_refresh_seconds)))
+            self.spawn(resume_summaries(self.settings.summary_max_attempts))
+
+    def spawn(self, job: Coroutine) -> asyncio.Task:
+        """
+        Run `job` in the background, outside any request, and wait for it
+        on shutdown.
+        """
+        task = asyncio.create_task(job)
+        self.jobs.add(task)
+        task.add_done_callback(self._finished)
+        return task
+
+    def _finished(self, task: asyncio.Task) -> None:
+        self.jobs.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Background job %s failed", task.get_name(), exc_info=task.exception())
+
+    async def drain(self, timeout: float) -> None:
+        """
+        Wait up to `timeout` seconds for the background jobs, then cancel the
+        rest. A cancelled summary is left empty, and the next start
+        generates it again if it has attempts left
+        (app.summarizer.resume_summaries).
+        """
+        if not self.jobs:
+            return
+        log.info("Waiting up to %ss for %d background jobs", timeout, len(self.jobs))
+        _, pending = await asyncio.wait(set(self.jobs), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            log.warning("Cancelled %d background jobs still running at shutdown", len(pending))
+
+    async def close(self) -> None:
+        for task in self.services:
+            task.cancel()
+        await asyncio.gather(*self.services, return_exceptions=True)
+        self.services.clear()
+        await self.rate_limits.close()
+        if self.manage_database:
+            await disconnect()
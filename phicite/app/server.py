@@ -0,0 +1,74 @@
+"""
+Process setup for serving the app with gunicorn; gunicorn.conf.py calls
+these from its server hooks.
+"""
+import logging
+
+from tortoise import Tortoise, connections
+
+log = logging.getLogger("uvicorn")
+
+# Fields of /proc/<pid>/smaps_rollup reported by memory_usage, in kB.
+MEMORY_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def preload() -> None:
+    """
+    Load the read-only state every worker would otherwise load for itself,
+    so that after fork the workers share one copy of it: the policy engine,
+    zxcvbn's frequency lists, and the summarizer's libraries and tokenizer.
+    """
+    from app.policy import get_enforcer
+
+    get_enforcer()
+
+    import zxcvbn  # noqa: F401
+    import newspaper  # noqa: F401
+    from nltk.tokenize import sent_tokenize
+
+    try:
+        # nltk 3.9 splits sentences with a PunktTokenizer built from
+        # punkt_tab on first use and cached; sent_tokenize builds it here.
+        sent_tokenize("x")
+    except LookupError:
+        # punkt_tab is not downloaded yet; the first summary fetches it.
+        pass
+
+
+def discard_inherited_connections() -> None:
+    """
+    Forget any database clients copied from the parent by fork, without
+    closing them: their sockets still belong to the parent. Each worker
+    opens its own pool in the application lifespan.
+    """
+    if not Tortoise._inited:
+        return
+    for client in connections.all():
+        connections.discard(client.connection_name)
+
+
+def memory_usage(pid: int | str = "self") -> dict[str, int]:
+    """
+    Resident memory of a process in kB, split into what is shared with
+    other processes and what is private to it. Empty where /proc is not
+    available.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines = f.readlines()
+    except OSError:
+        return {}
+    usage = {}
+    for line in lines:
+        name, _, value = line.partition(":")
+        if name in MEMORY_FIELDS:
+            usage[name] = int(value.split()[0])
+    return usage
+
+
+def format_memory(usage: dict[str, int]) -> str:
+    if not usage:
+        return "unavailable"
+    shared = usage["Shared_Clean"] + usage["Shared_Dirty"]
+    private = usage["Private_Clean"] + usage["Private_Dirty"]
+    return f"rss={usage['Rss'] // 1024}MiB pss={usage['Pss'] // 1024}MiB shared={shared // 1024}MiB private={private // 1024}MiB"
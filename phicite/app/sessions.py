@@ -0,0 +1,192 @@
+"""
+Refresh tokens: renewing an access token without the password.
+
+Logging in starts a session and returns a refresh token along with the
+access token. Exchanging the refresh token at /users/token/refresh costs a
+primary-key lookup, an HMAC and a conditional UPDATE rather than a bcrypt
+verify, and rotates it, so each refresh token works once.
+
+A refresh token is "<session id>.<generation>.<secret>". Only an HMAC of
+the current secret is stored, and each rotation derives the next secret
+from the current one with the key, so the session's recent tokens can be
+recognised by deriving forward from them. One presented again within
+MAX_GENERATIONS_BEHIND rotations of being rotated away has been copied:
+the session is ended and the user's access tokens are revoked. Older ones
+are refused like any invalid token.
+
+A session expires REFRESH_TOKEN_EXPIRE_DAYS after its last renewal, and
+SESSION_MAX_DAYS after it started whatever its renewals. Sessions that
+expired or were ended are deleted every SESSION_PRUNE_SECONDS.
+
+The user a renewed access token is issued to is cached for
+USER_CACHE_SECONDS, so a renewal does not usually read the user's row.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import secrets
+import time
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Union
+
+from app.api import crud
+from app.config import Settings, get_settings
+from app.models.tortoise import User
+from app.tokens import get_token_service
+
+log = logging.getLogger("uvicorn")
+
+USER_CACHE_SECONDS = 60.0
+# How many rotations back a presented token is followed to tell reuse from
+# a forgery: enough for tabs racing each other to renew, and few enough
+# that an unauthenticated request cannot keep the event loop on HMACs.
+MAX_GENERATIONS_BEHIND = 50
+
+
+def parse_refresh_token(refresh_token: str) -> Union[tuple[int, int, str], None]:
+    """
+    (session id, generation, secret). Tokens issued before generations were
+    counted have none and are generation 0.
+    """
+    parts = refresh_token.split(".")
+    if len(parts) == 2:
+        parts.insert(1, "0")
+    if len(parts) != 3:
+        return None
+    id, generation, secret = parts
+    if not id.isdigit() or not generation.isdigit() or not secret:
+        return None
+    return int(id), int(generation), secret
+
+
+class SessionStore:
+    def __init__(self, key: bytes, expire_days: int, max_days: int) -> None:
+        self.key = key
+        self.expires = timedelta(days=expire_days)
+        self.lifetime = timedelta(days=max_days)
+        # User id -> (monotonic expiry, user).
+        self.users: dict[int, tuple[float, User]] = {}
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "SessionStore":
+        secret = settings.refresh_token_secret or settings.jwt_secret_key
+        if not secret:
+            raise ValueError("REFRESH_TOKEN_SECRET or JWT_SECRET_KEY is required for refresh tokens")
+        return cls(secret.encode(), settings.refresh_token_expire_days, settings.session_max_days)
+
+    def hash(self, secret: str) -> str:
+        return hmac.new(self.key, secret.encode(), hashlib.sha256).hexdigest()
+
+    def successor(self, secret: str) -> str:
+        """
+        The secret of the token that replaces the one with `secret`.
+        """
+        digest = hmac.new(self.key, b"next:" + secret.encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+    async def start(self, user_id: int) -> str:
+        """
+        Start a session and return its first refresh token.
+        """
+        secret = secrets.token_urlsafe(32)
+        expires_at = datetime.now(timezone.utc) + min(self.expires, self.lifetime)
+        id = await crud.post_session(user_id, self.hash(secret), expires_at)
+        return f"{id}.0.{secret}"
+
+    async def renew(self, refresh_token: str) -> Union[tuple[User, str], None]:
+        """
+        The session's user and its next refresh token, or None if
+        `refresh_token` is not the current token of a live session.
+        """
+        parsed = parse_refresh_token(refresh_token)
+        if parsed is None:
+            return None
+        id, generation, secret = parsed
+        session = await crud.get_session(id)
+        if session is None:
+            return None
+        behind = session.generation - generation
+        if not 0 <= behind <= MAX_GENERATIONS_BEHIND:
+            return None
+        current = secret
+        for _ in range(behind):
+            current = self.successor(current)
+        if not hmac.compare_digest(self.hash(current), session.token_hash):
+            return None
+        now = datetime.now(timezone.utc)
+        if behind:
+            # A token of this session that was already rotated away.
+            if session.revoked_at is None:
+                await self.end_after_reuse(id, session.user_id, now)
+            return None
+        expires_at = min(now + self.expires, session.created_at + self.lifetime)
+        if session.revoked_at is not None or session.expires_at <= now or expires_at <= now:
+            return None
+
+        new_secret = self.successor(secret)
+        # Fails if the session was ended or renewed since it was read.
+        if not await crud.rotate_session(id, generation, self.hash(new_secret), now, expires_at):
+            return None
+        user = await self.user(session.user_id)
+        if user is None:
+            return None
+        return user, f"{id}.{generation + 1}.{new_secret}"
+
+    async def end_after_reuse(self, id: int, user_id: int, now: datetime) -> None:
+        # The access tokens issued from this session cannot be told from the
+        # user's others, so all of them go; the other sessions renew theirs.
+        log.warning("Refresh token reused after rotation; ending session %d", id, extra={"user_id": user_id})
+        await crud.revoke_session(id, now)
+        await get_token_service().revoke_user(user_id)
+        self.users.pop(user_id, None)
+
+    async def end(self, refresh_token: str) -> None:
+        """
+        End the session `refresh_token` belongs to, if it is its current
+        token.
+        """
+        parsed = parse_refresh_token(refresh_token)
+        if parsed is None:
+            return
+        id, generation, secret = parsed
+        session = await crud.get_session(id)
+        if (
+            session is not None
+            and session.generation == generation
+            and hmac.compare_digest(self.hash(secret), session.token_hash)
+        ):
+            await crud.revoke_session(id, datetime.now(timezone.utc))
+
+    async def end_all(self, user_id: int) -> int:
+        """
+        End every session of a user; returns how many were live.
+        """
+        self.users.pop(user_id, None)
+        return await crud.revoke_user_sessions(user_id, datetime.now(timezone.utc))
+
+    async def keep_pruned(self, interval: float) -> None:
+        while True:
+            try:
+                pruned = await crud.prune_sessions(datetime.now(timezone.utc))
+                if pruned:
+                    log.info("Pruned %d expired or ended sessions", pruned)
+            except Exception:
+                log.exception("Could not prune sessions")
+            await asyncio.sleep(interval)
+
+    async def user(self, user_id: int) -> Union[User, None]:
+        cached = self.users.get(user_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        user = await crud.get_user_by_id(user_id)
+        if user is not None:
+            self.users[user_id] = (time.monotonic() + USER_CACHE_SECONDS, user)
+        return user
+
+
+@lru_cache
+def get_session_store() -> SessionStore:
+    return SessionStore.from_settings(get_settings())
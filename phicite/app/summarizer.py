@@ -1,10 +1,24 @@
-import nltk
-from newspaper import Article
+import asyncio
+import logging
 
+from starlette.concurrency import run_in_threadpool
+
+from app.api import crud
+from app.db import advisory_lock
 from app.models.tortoise import TextSummary
 
+log = logging.getLogger("uvicorn")
+
+# The Postgres advisory lock held by the worker resuming summaries.
+RESUME_LOCK_KEY = 0x7068_6963_0001
+
+
+def summarize(url: str) -> str:
+    # newspaper and nltk take a few hundred milliseconds to import and are
+    # only needed here, so only processes that summarize pay for them.
+    import nltk
+    from newspaper import Article
 
-async def generate_summary(summary_id: int, url: str) -> None:
     article = Article(url)
     article.download()
     article.parse()
@@ -16,6 +30,43 @@ async def generate_summary(summary_id: int, url: str) -> None:
     finally:
         article.nlp()
 
-    summary = article.summary
+    return article.summary
+
+
+async def generate_summary(summary_id: int, url: str) -> None:
+    await crud.count_summary_attempt(summary_id)
+    # Downloading and parsing block, so keep them off the event loop.
+    try:
+        summary = await run_in_threadpool(summarize, url)
+    except asyncio.CancelledError:
+        # Shut down before finishing; the summary stays empty until
+        # resume_summaries runs at the next start. The thread running
+        # summarize cannot be interrupted: it runs on, after the database
+        # connections are closed, until it returns or the process exits, and
+        # its result is dropped.
+        log.warning("Summary %d of %s interrupted by shutdown", summary_id, url)
+        raise
+
+    await TextSummary.filter(id=summary_id).update(summary=summary)
+
 
-    await TextSummary.filter(id=summary_id).update(summary=summary)
\ No newline at end of file
+async def resume_summaries(max_attempts: int) -> None:
+    """
+    Generate again, one at a time, the summaries left empty by a failure or
+    by a previous process shutting down, giving up on each after
+    `max_attempts` attempts. Only the worker holding RESUME_LOCK_KEY does
+    this; the others starting with it skip it. A summary still being
+    generated by a running worker may be generated twice; both write the
+    same text.
+    """
+    async with advisory_lock(RESUME_LOCK_KEY) as taken:
+        if not taken:
+            return
+        pending = await crud.get_pending_summaries(max_attempts)
+        if pending:
+            log.info("Resuming %d unfinished summaries", len(pending))
+        for summary in pending:
+            try:
+                await generate_summary(summary["id"], summary["url"])
+            except Exception:
+                log.exception("Summary %d of %s failed", summary["id"], summary["url"])
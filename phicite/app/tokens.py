@@ -0,0 +1,161 @@
+"""
+Access tokens: issued at login and verified on every authenticated request.
+
+The keys are read and parsed once, when the service is built. A token
+carries the user's id and is_admin/disabled flags, so verifying it is
+enough to authenticate and authorize a request without a database lookup.
+Tokens without those claims (issued before they were added) fall back to
+looking the user up by name. Tokens are signed, not encrypted, so they
+carry nothing more personal than that.
+
+Since a verified token is trusted until it expires, tokens are short-lived,
+and revocations (an explicit revoke, a deleted user) are held in memory: a
+process applies its own at once and picks up the other workers' every
+token_revocation_refresh_seconds (see app.resources).
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Union
+
+import jwt
+from jwt.algorithms import HMACAlgorithm
+from jwt.exceptions import InvalidTokenError
+
+from app.api import crud
+from app.config import Settings, get_settings
+from app.models.pydantic import CurrentUserSchema, UserInDBSchema
+
+log = logging.getLogger("uvicorn")
+
+# The claims a token needs to stand in for the user's row.
+USER_CLAIMS = ("uid", "adm", "dis")
+
+
+class TokenService:
+    def __init__(self, algorithm: str, signing_key, verification_key, expire_minutes: int) -> None:
+        self.algorithm = algorithm
+        self.algorithms = [algorithm]
+        # None where the process only verifies tokens.
+        self.signing_key = signing_key
+        self.verification_key = verification_key
+        self.expires = timedelta(minutes=expire_minutes)
+        self.revoked_tokens: set[str] = set()
+        # User id -> tokens issued at or before this timestamp are revoked.
+        self.revoked_users: dict[int, float] = {}
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "TokenService":
+        name = settings.jwt_algorithm
+        try:
+            algorithm = jwt.get_algorithm_by_name(name)
+        except NotImplementedError:
+            raise ValueError(f"Unsupported JWT algorithm {name}")
+        if isinstance(algorithm, HMACAlgorithm):
+            if not settings.jwt_secret_key:
+                raise ValueError(f"JWT_SECRET_KEY is required for {name}")
+            key = algorithm.prepare_key(settings.jwt_secret_key)
+            return cls(name, key, key, settings.access_token_expire_minutes)
+
+        signing_key = None
+        if settings.jwt_private_key_file:
+            signing_key = algorithm.prepare_key(settings.jwt_private_key_file.read_bytes())
+        if settings.jwt_public_key_file:
+            verification_key = algorithm.prepare_key(settings.jwt_public_key_file.read_bytes())
+        elif signing_key is not None:
+            verification_key = signing_key.public_key()
+        else:
+            raise ValueError(f"JWT_PRIVATE_KEY_FILE or JWT_PUBLIC_KEY_FILE is required for {name}")
+        return cls(name, signing_key, verification_key, settings.access_token_expire_minutes)
+
+    def issue(self, user: UserInDBSchema) -> str:
+        if self.signing_key is None:
+            raise RuntimeError("Tokens cannot be issued without the private key")
+        now = datetime.now(timezone.utc)
+        claims = {
+            "sub": user.username,
+            "uid": user.id,
+            "adm": user.is_admin,
+            "dis": user.disabled,
+            "jti": uuid.uuid4().hex,
+            "iat": now,
+            "exp": now + self.expires,
+        }
+        return jwt.encode(claims, self.signing_key, algorithm=self.algorithm)
+
+    def verify(self, token: str) -> dict:
+        """
+        The claims of a valid, unexpired and unrevoked token. Raises
+        InvalidTokenError otherwise.
+        """
+        claims = jwt.decode(token, self.verification_key, algorithms=self.algorithms)
+        if self.is_revoked(claims):
+            raise InvalidTokenError("Token has been revoked")
+        return claims
+
+    def is_revoked(self, claims: dict) -> bool:
+        if claims.get("jti") in self.revoked_tokens:
+            return True
+        revoked_at = self.revoked_users.get(claims.get("uid"))
+        # iat has a resolution of a second, so a token issued in the same
+        # second as the revocation is revoked too.
+        return revoked_at is not None and claims.get("iat", 0) <= revoked_at
+
+    def user(self, claims: dict) -> Union[CurrentUserSchema, None]:
+        """
+        The user a token was issued to, from its claims alone; None if the
+        token predates them.
+        """
+        if not all(claim in claims for claim in USER_CLAIMS):
+            return None
+        return CurrentUserSchema(
+            id=claims["uid"],
+            username=claims["sub"],
+            is_admin=claims["adm"],
+            disabled=claims["dis"],
+        )
+
+    async def revoke(self, claims: dict) -> None:
+        expires_at = datetime.fromtimestamp(claims["exp"], timezone.utc)
+        await crud.post_token_revocation(claims["jti"], None, datetime.now(timezone.utc), expires_at)
+        self.revoked_tokens.add(claims["jti"])
+
+    async def revoke_user(self, user_id: int) -> None:
+        """
+        Revoke every token issued to the user so far.
+        """
+        now = datetime.now(timezone.utc)
+        await crud.post_token_revocation(None, user_id, now, now + self.expires)
+        self.revoked_users[user_id] = max(self.revoked_users.get(user_id, 0), now.timestamp())
+
+    async def refresh_revocations(self) -> None:
+        revoked_tokens = set()
+        revoked_users = {}
+        for revocation in await crud.get_token_revocations(datetime.now(timezone.utc)):
+            if revocation["jti"] is not None:
+                revoked_tokens.add(revocation["jti"])
+            else:
+                revoked_at = revocation["revoked_at"].timestamp()
+                revoked_users[revocation["user_id"]] = max(revoked_users.get(revocation["user_id"], 0), revoked_at)
+        self.revoked_tokens = revoked_tokens
+        self.revoked_users = revoked_users
+
+    async def keep_revocations_fresh(self, interval: float) -> None:
+        while True:
+            try:
+                await self.refresh_revocations()
+            except Exception:
+                log.exception("Could not refresh the token revocation list")
+            await asyncio.sleep(interval)
+
+
+@lru_cache
+def get_token_service() -> TokenService:
+    """
+    The token service, with its keys loaded on first use. The application
+    lifespan calls this at startup, so a missing or invalid key stops the
+    process before it serves.
+    """
+    return TokenService.from_settings(get_settings())
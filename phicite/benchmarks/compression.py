@@ -0,0 +1,81 @@
+"""
+CPU cost against bytes saved for each response coding, on highlight lists
+shaped like GET /highlights/public responses.
+
+    python -m benchmarks.compression --sizes 100 1000 10000
+
+Needs no database. brotli and zstd are measured when installed.
+"""
+import argparse
+import json
+import random
+import time
+
+from app.compression import BrotliEncoder, GzipEncoder, ZstdEncoder, brotli, zstandard
+
+WORDS = "the of cell protein binding structure results analysis model data expression".split()
+
+
+def highlight_list(count: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    highlights = []
+    for id in range(1, count + 1):
+        parts = {
+            str(number): {
+                "rect": [round(rng.uniform(0, 600), 2) for _ in range(4)],
+                "text": " ".join(rng.choices(WORDS, k=rng.randint(5, 40))),
+            }
+            for number in range(1, rng.randint(1, 4) + 1)
+        }
+        highlights.append({
+            "id": id,
+            "doi": f"10.{rng.randint(1000, 9999)}/example.{rng.randint(1, 500)}",
+            "created_at": "2026-10-19 09:00:00.000000+00:00",
+            "highlight": parts,
+            "comment": None,
+        })
+    return json.dumps(highlights, separators=(",", ":")).encode()
+
+
+def encoders() -> list:
+    candidates = [GzipEncoder(level) for level in (1, 6, 9)]
+    if brotli is not None:
+        candidates += [BrotliEncoder(quality) for quality in (1, 4, 11)]
+    if zstandard is not None:
+        candidates += [ZstdEncoder(level) for level in (1, 3, 19)]
+    return candidates
+
+
+def measure(encoder, body: bytes, min_time: float) -> tuple[float, int]:
+    runs, start = 0, time.perf_counter()
+    while True:
+        compressed = encoder.compress(body)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / runs, len(compressed)
+
+
+def main(args: argparse.Namespace) -> None:
+    print(f"{'highlights':>10} {'coding':<9} {'bytes':>11} {'ratio':>6} {'ms':>8} {'MB/s':>8} {'ms saved @':>10}")
+    for size in args.sizes:
+        body = highlight_list(size)
+        for encoder in encoders():
+            level = getattr(encoder, "level", getattr(encoder, "quality", ""))
+            seconds, compressed = measure(encoder, body, args.min_time)
+            # Transfer time saved on a link of --mbps, net of compression time.
+            saved = (len(body) - compressed) * 8 / (args.mbps * 1e6) - seconds
+            print(
+                f"{size:>10} {encoder.name + '-' + str(level):<9} {compressed:>11} "
+                f"{len(body) / compressed:>6.1f} {seconds * 1000:>8.2f} "
+                f"{len(body) / seconds / 1e6:>8.1f} {saved * 1000:>10.1f}"
+            )
+        print(f"{size:>10} {'identity':<9} {len(body):>11}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--mbps", type=float, default=20.0, help="client bandwidth used for the 'ms saved' column")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds to spend on each measurement")
+    main(parser.parse_args())
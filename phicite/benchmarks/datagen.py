@@ -0,0 +1,265 @@
+"""
+Fill a migrated database with synthetic users, highlights and summaries at
+realistic scale, for benchmarks and query-plan checks.
+
+    python -m benchmarks.datagen --users 100000 --dois 1000000 --highlights 10000000 --seed 1
+
+DOI popularity follows a Zipf distribution, as does how many highlights each
+user makes. Highlights have one to four parts shaped like the ones the API
+stores, and come with their doi_key, highlight_part rows and the doi_reader
+and doi_stats counts the crud layer would have kept. Rows are streamed in
+chunks with COPY on Postgres (executemany on SQLite). Every user's password
+is PASSWORD. The same seed against an empty database gives the same rows.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from typing import Iterator
+
+from tortoise import Tortoise, connections
+from tortoise.transactions import in_transaction
+
+from app.auth import get_password_hash
+from app.db import execute_sql
+from app.doi import doi_key
+
+PASSWORD = "Synthetic-Password-2026!"
+
+WORDS = (
+    "the of cell protein binding structure results analysis model data expression "
+    "gene sample method response signal membrane pathway effect rate level control "
+    "measured observed increase significant function activity network region"
+).split()
+
+# Highlights are dated across the year before this, so runs are reproducible.
+CREATED_BEFORE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+USER_COLUMNS = ("id", "username", "email", "full_name", "disabled", "hashed_password", "is_admin")
+HIGHLIGHT_COLUMNS = ("id", "doi", "doi_key", "highlight", "comment", "created_at", "user_id")
+PART_COLUMNS = ("highlight_id", "doi_key", "number", "page", "x1", "y1", "x2", "y2", "text")
+SUMMARY_COLUMNS = ("url", "summary", "created_at")
+
+
+def zipf_cum_weights(count: int, exponent: float) -> list[float]:
+    """
+    Cumulative weights for picking rank r (0-based) with probability
+    proportional to 1 / (r + 1) ** exponent.
+    """
+    return list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def zipf_sampler(rng: random.Random, count: int, exponent: float):
+    cum_weights = zipf_cum_weights(count, exponent)
+    total = cum_weights[-1]
+    return lambda: bisect_left(cum_weights, rng.random() * total)
+
+
+def synthetic_doi(rank: int) -> str:
+    return f"10.{1000 + rank % 9000}/synthetic.{rank}"
+
+
+def sentence(rng: random.Random, low: int, high: int) -> str:
+    return " ".join(rng.choices(WORDS, k=rng.randint(low, high)))
+
+
+# Drawing text from a fixed pool, rather than word by word, keeps generation
+# fast enough for tens of millions of rows.
+TEXT_POOL_SIZE = 10_000
+# Parts per highlight: 1 in 55% of highlights, 2 in 25%, 3 in 12%, 4 in 8%.
+PART_COUNTS = (1,) * 55 + (2,) * 25 + (3,) * 12 + (4,) * 8
+
+
+def text_pool(rng: random.Random, low: int, high: int) -> list[str]:
+    return [sentence(rng, low, high) for _ in range(TEXT_POOL_SIZE)]
+
+
+def generate_users(first_id: int, count: int, hashed_password: str) -> Iterator[tuple]:
+    for id in range(first_id, first_id + count):
+        yield (id, f"synthetic{id}", f"synthetic{id}@example.com", f"Synthetic User {id}", False, hashed_password, False)
+
+
+def generate_highlight(rng: random.Random, texts: list[str]) -> dict:
+    """
+    One to four parts on consecutive lines of one page, keyed "1", "2", ...
+    like HighlightPayloadSchema.stored_highlight().
+    """
+    random = rng.random
+    page = 1 + int(random() * 40)
+    x1 = round(50 + random() * 250, 2)
+    y1 = round(50 + random() * 650, 2)
+    x2 = round(x1 + 80 + random() * 180, 2)
+    highlight = {}
+    for number in range(1, PART_COUNTS[int(random() * 100)] + 1):
+        top = round(y1 + (number - 1) * 14, 2)
+        highlight[str(number)] = {
+            "page": page,
+            "rect": [x1, top, x2, round(top + 12, 2)],
+            "text": texts[int(random() * TEXT_POOL_SIZE)],
+        }
+    return highlight
+
+
+def generate_highlights(
+    rng: random.Random,
+    first_id: int,
+    count: int,
+    user_ids: list[int],
+    dois: int,
+    exponent: float,
+) -> Iterator[tuple[tuple, list[tuple]]]:
+    """
+    Yield each highlight row with its highlight_part rows.
+    """
+    pick_doi = zipf_sampler(rng, dois, exponent)
+    pick_user = zipf_sampler(rng, len(user_ids), 1.0)
+    texts = text_pool(rng, 4, 30)
+    comments = text_pool(rng, 3, 15)
+    dumps = json.dumps
+    seconds = 365 * 24 * 3600
+    keys: dict[int, int] = {}
+    for id in range(first_id, first_id + count):
+        rank = pick_doi()
+        doi = synthetic_doi(rank)
+        key = keys.get(rank)
+        if key is None:
+            key = keys[rank] = doi_key(doi)
+        highlight = generate_highlight(rng, texts)
+        comment = comments[int(rng.random() * TEXT_POOL_SIZE)] if rng.random() < 0.2 else None
+        created_at = CREATED_BEFORE - timedelta(seconds=int(rng.random() * seconds))
+        parts = [
+            (id, key, number, part["page"], *part["rect"], part["text"])
+            for number, part in highlight.items()
+        ]
+        yield (id, doi, key, dumps(highlight), comment, created_at, user_ids[pick_user()]), parts
+
+
+def generate_summaries(rng: random.Random, count: int) -> Iterator[tuple]:
+    for number in range(count):
+        summary = ". ".join(sentence(rng, 8, 20) for _ in range(rng.randint(3, 8)))
+        created_at = CREATED_BEFORE - timedelta(seconds=rng.randrange(365 * 24 * 3600))
+        yield (f"https://example.com/articles/{rng.randrange(10**9)}/{number}", summary, created_at)
+
+
+def chunked(rows: Iterator, size: int) -> Iterator[list]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def copy_rows(table: str, columns: tuple, rows: list[tuple]) -> None:
+    connection = connections.get("default")
+    if connection.capabilities.dialect == "postgres":
+        async with connection.acquire_connection() as raw:
+            await raw.copy_records_to_table(table, records=rows, columns=columns)
+        return
+    if "created_at" in columns:
+        # SQLite stores datetimes as text, the way Tortoise writes them.
+        position = columns.index("created_at")
+        rows = [(*row[:position], str(row[position]), *row[position + 1:]) for row in rows]
+    names = ", ".join(f'"{column}"' for column in columns)
+    placeholders = ", ".join("?" for _ in columns)
+    await connection.execute_many(f'INSERT INTO "{table}" ({names}) VALUES ({placeholders})', rows)
+
+
+async def next_id(table: str) -> int:
+    rows = await execute_sql(f'SELECT COALESCE(MAX("id"), 0) + 1 AS "next" FROM "{table}"')
+    return rows[0]["next"]
+
+
+async def rebuild_doi_counts() -> None:
+    """
+    Recompute doi_reader and doi_stats from pdfhighlight.
+    """
+    async with in_transaction():
+        await execute_sql('DELETE FROM "doi_stats"')
+        await execute_sql('DELETE FROM "doi_reader"')
+        await execute_sql(
+            'INSERT INTO "doi_reader" ("doi", "user_id", "highlight_count") '
+            'SELECT "doi", "user_id", COUNT(*) FROM "pdfhighlight" GROUP BY "doi", "user_id"'
+        )
+        await execute_sql(
+            'INSERT INTO "doi_stats" ("doi", "highlight_count", "reader_count") '
+            'SELECT "doi", SUM("highlight_count"), COUNT(*) FROM "doi_reader" GROUP BY "doi"'
+        )
+
+
+async def generate(
+    users: int,
+    dois: int,
+    highlights: int,
+    summaries: int,
+    seed: int = 0,
+    exponent: float = 1.1,
+    chunk_size: int = 50_000,
+) -> dict[str, int]:
+    """
+    Add the requested rows to the current database and return how many of
+    each were written. Highlights are spread over the users created here.
+    """
+    if highlights and not users:
+        raise ValueError("Highlights need at least one user")
+    rng = random.Random(seed)
+    connection = connections.get("default")
+
+    first_user = await next_id("user")
+    for chunk in chunked(generate_users(first_user, users, get_password_hash(PASSWORD)), chunk_size):
+        await copy_rows("user", USER_COLUMNS, chunk)
+    user_ids = list(range(first_user, first_user + users))
+
+    first_highlight = await next_id("pdfhighlight")
+    parts = 0
+    if highlights:
+        rows = generate_highlights(rng, first_highlight, highlights, user_ids, dois, exponent)
+        for chunk in chunked(rows, chunk_size):
+            await copy_rows("pdfhighlight", HIGHLIGHT_COLUMNS, [highlight for highlight, _ in chunk])
+            chunk_parts = [part for _, highlight_parts in chunk for part in highlight_parts]
+            await copy_rows("highlight_part", PART_COLUMNS, chunk_parts)
+            parts += len(chunk_parts)
+
+    for chunk in chunked(generate_summaries(rng, summaries), chunk_size):
+        await copy_rows("textsummary", SUMMARY_COLUMNS, chunk)
+
+    await rebuild_doi_counts()
+    if connection.capabilities.dialect == "postgres":
+        # Rows were written with explicit ids, so move the sequences past them.
+        for table in ("user", "pdfhighlight"):
+            await execute_sql(
+                f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), "
+                f'(SELECT COALESCE(MAX("id"), 1) FROM "{table}"))'
+            )
+        await execute_sql("ANALYZE")
+    return {"users": users, "highlights": highlights, "highlight_parts": parts, "summaries": summaries}
+
+
+async def main(args: argparse.Namespace) -> None:
+    await Tortoise.init(db_url=args.db_url, modules={"models": ["app.models.tortoise"]})
+    try:
+        written = await generate(
+            args.users, args.dois, args.highlights, args.summaries, args.seed, args.zipf_exponent, args.chunk_size
+        )
+        print(", ".join(f"{count} {name}" for name, count in written.items()))
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--dois", type=int, default=10_000)
+    parser.add_argument("--highlights", type=int, default=100_000)
+    parser.add_argument("--summaries", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--zipf-exponent", type=float, default=1.1, help="skew of DOI popularity")
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="rows per COPY")
+    asyncio.run(main(parser.parse_args()))
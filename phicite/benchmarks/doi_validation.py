@@ -0,0 +1,49 @@
+"""
+Time DOI validation, which runs on every highlight request.
+
+    python -m benchmarks.doi_validation --calls 30000 --budget 20
+
+Needs no database. Exits 1 if a call takes longer than --budget
+microseconds on average (best of --runs); a call takes a microsecond or two,
+so the budget only catches regressions such as recompiling the pattern per
+call.
+"""
+import argparse
+import sys
+import time
+
+from app.models.pydantic import is_valid_doi
+
+DOIS = (
+    "10.1234/example.5678",
+    "https://doi.org/10.1000/Journal.Article.123",
+    "doi:10.5555/12345678",
+)
+
+
+def time_per_call(calls: int) -> float:
+    """
+    Mean seconds per is_valid_doi call over `calls` calls.
+    """
+    dois = [DOIS[i % len(DOIS)] for i in range(calls)]
+    start = time.perf_counter()
+    for doi in dois:
+        is_valid_doi(doi)
+    return (time.perf_counter() - start) / calls
+
+
+def main(args: argparse.Namespace) -> int:
+    best_us = min(time_per_call(args.calls) for _ in range(args.runs)) * 1e6
+    print(f"is_valid_doi: {best_us:.2f} us per call (best of {args.runs})")
+    if args.budget is not None and best_us > args.budget:
+        print(f"FAIL: over the budget of {args.budget} us")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=30_000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--budget", type=float, help="fail above this many microseconds per call")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,91 @@
+"""
+Highlight creation throughput: the current crud.post_highlight against the
+previous fetch-the-user-then-insert path. Both write the highlight, its
+parts and the DOI's statistics in one transaction, so the difference is the
+user fetch alone.
+
+    python -m benchmarks.highlight_writes --count 5000 --concurrency 20
+
+Runs against DATABASE_URL (which must already be migrated) unless --db-url
+is given. Pass --generate-schemas for a throwaway SQLite file.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+
+from app.api import crud
+from app.models.pydantic import HighlightPayloadSchema
+from app.models.tortoise import HighlightPart, PDFHighlight, User
+
+PAYLOAD = HighlightPayloadSchema(
+    doi="10.1234/benchmark.0001",
+    highlight={
+        "1": {"rect": [100, 200, 300, 220], "text": "first part"},
+        "2": {"rect": [50, 100, 250, 120], "text": "second part"},
+    },
+    comment="benchmark",
+)
+
+
+async def post_highlight_with_user_fetch(payload: HighlightPayloadSchema, user_id: int):
+    async with in_transaction():
+        user = await User.get(id=user_id)
+        highlight = PDFHighlight(
+            doi=payload.doi,
+            highlight=payload.stored_highlight(),
+            comment=payload.comment,
+            user=user,
+        )
+        await highlight.save()
+        await HighlightPart.bulk_create(
+            HighlightPart.from_stored(highlight.id, highlight.doi_key, highlight.highlight)
+        )
+        await crud.increment_doi_stats(payload.doi, user_id)
+    return highlight.id, highlight.created_at
+
+
+async def run(create, user_id: int, count: int, concurrency: int) -> float:
+    remaining = iter(range(count))
+
+    async def worker():
+        for _ in remaining:
+            await create(PAYLOAD, user_id)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return count / (time.perf_counter() - start)
+
+
+async def main(args: argparse.Namespace) -> None:
+    await Tortoise.init(db_url=args.db_url, modules={"models": ["app.models.tortoise"]})
+    if args.generate_schemas:
+        await Tortoise.generate_schemas()
+    user = await User.create(
+        username="benchmark-writer",
+        email="benchmark-writer@example.com",
+        hashed_password="not-a-real-hash",
+    )
+    try:
+        for name, create in (
+            ("fetch user + insert", post_highlight_with_user_fetch),
+            ("insert by user_id", crud.post_highlight),
+        ):
+            await run(create, user.id, min(args.count, 100), args.concurrency)
+            rate = await run(create, user.id, args.count, args.concurrency)
+            print(f"{name:<22} {rate:10.1f} highlights/s")
+    finally:
+        await user.delete()
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--generate-schemas", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,68 @@
+"""
+Time `import app.main` with `python -X importtime` and list the slowest
+imports.
+
+    python -m benchmarks.importtime --budget 1500
+
+Exits 1 if the import takes longer than --budget milliseconds (best of
+--runs), or if it pulls in a module that should only load when used: the
+summarizer's newspaper and nltk, zxcvbn, and the casbin policy engine.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+LAZY_MODULES = ("newspaper", "nltk", "zxcvbn", "casbin")
+
+
+def import_times(module: str) -> dict[str, tuple[int, int]]:
+    """
+    Self and cumulative import time, in microseconds, of every module
+    imported by a fresh interpreter importing `module`.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main(args: argparse.Namespace) -> int:
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    best = min(runs, key=lambda times: times[args.module][1])
+    total_ms = best[args.module][1] / 1000
+
+    print(f"{'cumulative ms':>13} {'self ms':>8}  module")
+    slowest = sorted(best.items(), key=lambda item: item[1][1], reverse=True)
+    for name, (self_us, cumulative_us) in slowest[: args.top]:
+        print(f"{cumulative_us / 1000:>13.1f} {self_us / 1000:>8.1f}  {name}")
+    print(f"import {args.module}: {total_ms:.0f} ms (best of {args.runs})")
+
+    failed = False
+    eager = sorted(name for name in best if name.split(".")[0] in LAZY_MODULES)
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}")
+        failed = True
+    if args.budget is not None and total_ms > args.budget:
+        print(f"FAIL: over the budget of {args.budget} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=20, help="how many of the slowest imports to list")
+    parser.add_argument("--budget", type=float, help="fail above this many milliseconds")
+    sys.exit(main(parser.parse_args()))
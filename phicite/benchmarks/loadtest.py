@@ -0,0 +1,316 @@
+"""
+Mixed-workload load test against a running copy of the API.
+
+    python -m benchmarks.loadtest --seed --duration 60 --concurrency 50 \\
+        --output loadtest.json --baseline previous.json
+
+Starts uvicorn on --port against --db-url (which must already be migrated),
+optionally seeds it with benchmarks.datagen, then drives public DOI reads, authenticated highlight
+writes, logins and summary submissions in the proportions given by --mix.
+A `refresh` operation (renewing a session's tokens) can be added to the mix.
+Latency percentiles and throughput per operation are written to --output as
+JSON. With --baseline, each operation is compared against a previous run and
+the exit status is 1 if any p95 or throughput regressed by more than
+--tolerance.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from tortoise import Tortoise
+
+from app.models.tortoise import User
+from benchmarks import datagen
+
+ARTICLE = (
+    "<html><head><title>Load test article</title></head><body><article>"
+    + "<p>" + "The protein binding results support the structural model of the cell. " * 40 + "</p>"
+    + "</article></body></html>"
+).encode()
+DEFAULT_MIX = "public_read=60,write=20,login=10,summary=10"
+
+
+async def prepare(args: argparse.Namespace) -> list[str]:
+    """
+    Optionally fill the database with benchmarks.datagen, then return the names of
+    up to --users synthetic users to log in as.
+    """
+    await Tortoise.init(db_url=args.db_url, modules={"models": ["app.models.tortoise"]})
+    try:
+        if args.seed:
+            await datagen.generate(args.users, args.dois, args.highlights, args.summaries, args.random_seed)
+        users = User.filter(username__startswith="synthetic").order_by("id").limit(args.users)
+        return await users.values_list("username", flat=True)
+    finally:
+        await Tortoise.close_connections()
+
+
+def start_server(args: argparse.Namespace) -> subprocess.Popen:
+    # Every request comes from one address and a few users, so the rate
+    # limits would measure themselves refusing.
+    env = {**os.environ, "DATABASE_URL": args.db_url, "LOG_LEVEL": "WARNING", "RATE_LIMIT_ENABLED": "0"}
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "app.main:app",
+            "--host", "127.0.0.1", "--port", str(args.port),
+            "--workers", str(args.workers), "--no-access-log",
+        ],
+        env=env,
+    )
+
+
+class ArticleHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(ARTICLE)))
+        self.end_headers()
+        self.wfile.write(ARTICLE)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def start_article_server() -> ThreadingHTTPServer:
+    """
+    Serve a fixed article for summary submissions to point at, so the
+    summarizer does not reach outside sites.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ArticleHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get("/ping")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError("server did not become ready")
+        await asyncio.sleep(0.2)
+
+
+async def login(client: httpx.AsyncClient, username: str) -> httpx.Response:
+    return await client.post("/users/token", data={"username": username, "password": datagen.PASSWORD})
+
+
+class Workload:
+    def __init__(self, args: argparse.Namespace, usernames: list[str], tokens: list[str], article_url: str) -> None:
+        self.usernames = usernames
+        self.tokens = tokens
+        self.article_url = article_url
+        self.rng = random.Random(args.random_seed)
+        # Read and write DOIs with the popularity the data was generated with.
+        self.pick_doi = datagen.zipf_sampler(self.rng, args.dois, 1.1)
+        self.texts = datagen.text_pool(self.rng, 4, 30)
+        # Refresh tokens not in use; each is taken out while it is renewed,
+        # since renewing one twice would be taken for token theft.
+        self.refresh_tokens: list[str] = []
+
+    def doi(self) -> str:
+        return datagen.synthetic_doi(self.pick_doi())
+
+    async def public_read(self, client: httpx.AsyncClient) -> httpx.Response:
+        return await client.get(f"/highlights/doi/{self.doi()}/public")
+
+    async def write(self, client: httpx.AsyncClient) -> httpx.Response:
+        return await client.post(
+            "/highlights/",
+            json={"doi": self.doi(), "highlight": datagen.generate_highlight(self.rng, self.texts)},
+            headers={"Authorization": f"Bearer {self.rng.choice(self.tokens)}"},
+        )
+
+    async def login(self, client: httpx.AsyncClient) -> httpx.Response:
+        return await login(client, self.rng.choice(self.usernames))
+
+    async def refresh(self, client: httpx.AsyncClient) -> httpx.Response:
+        if not self.refresh_tokens:
+            response = await login(client, self.rng.choice(self.usernames))
+            if response.status_code != 200:
+                return response
+            self.refresh_tokens.append(response.json()["refresh_token"])
+        response = await client.post("/users/token/refresh", json={"refresh_token": self.refresh_tokens.pop()})
+        if response.status_code == 200:
+            self.refresh_tokens.append(response.json()["refresh_token"])
+        return response
+
+    async def summary(self, client: httpx.AsyncClient) -> httpx.Response:
+        url = f"{self.article_url}/article/{self.rng.randrange(1_000_000)}"
+        return await client.post("/summaries/", json={"url": url})
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    # Nearest-rank percentile.
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def summarize(latencies: dict[str, list[float]], errors: dict[str, int], elapsed: float) -> dict:
+    operations = {}
+    for name, values in latencies.items():
+        values.sort()
+        operations[name] = {
+            "count": len(values),
+            "errors": errors[name],
+            "rps": round(len(values) / elapsed, 2),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        }
+    total = sum(len(values) for values in latencies.values())
+    return {"operations": operations, "total_rps": round(total / elapsed, 2)}
+
+
+async def drive(args: argparse.Namespace, usernames: list[str], article_url: str) -> dict:
+    base_url = f"http://127.0.0.1:{args.port}"
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0) as client:
+        await wait_until_ready(client)
+        tokens = []
+        for username in usernames[:20]:
+            response = await login(client, username)
+            response.raise_for_status()
+            tokens.append(response.json()["access_token"])
+
+        workload = Workload(args, usernames, tokens, article_url)
+        mix = parse_mix(args.mix)
+        operations = list(mix)
+        weights = [mix[name] for name in operations]
+        latencies = {name: [] for name in operations}
+        errors = dict.fromkeys(operations, 0)
+        rng = random.Random(args.random_seed + 1)
+
+        async def user(deadline: float) -> None:
+            while time.perf_counter() < deadline:
+                name = rng.choices(operations, weights=weights)[0]
+                start = time.perf_counter()
+                try:
+                    response = await getattr(workload, name)(client)
+                    failed = response.status_code >= 500 or (
+                        response.status_code >= 400 and name != "public_read"
+                    )
+                except httpx.HTTPError:
+                    failed = True
+                latencies[name].append(time.perf_counter() - start)
+                errors[name] += failed
+
+        if args.warmup:
+            await asyncio.gather(*(user(time.perf_counter() + args.warmup) for _ in range(args.concurrency)))
+            latencies = {name: [] for name in operations}
+            errors = dict.fromkeys(operations, 0)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user(start + args.duration) for _ in range(args.concurrency)))
+        return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Describe every operation whose p95 latency rose, or whose throughput
+    fell, by more than `tolerance` relative to the baseline.
+    """
+    regressions = []
+    for name, current in result["operations"].items():
+        previous = baseline["operations"].get(name)
+        if previous is None:
+            continue
+        if previous["p95_ms"] and current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms")
+        if previous["rps"] and current["rps"] < previous["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {previous['rps']} -> {current['rps']} req/s")
+    return regressions
+
+
+def print_result(result: dict, baseline: dict | None) -> None:
+    print(f"{'operation':<12} {'count':>8} {'errors':>7} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, stats in result["operations"].items():
+        line = (
+            f"{name:<12} {stats['count']:>8} {stats['errors']:>7} {stats['rps']:>9} "
+            f"{stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}"
+        )
+        previous = (baseline or {}).get("operations", {}).get(name)
+        if previous:
+            line += f"   (baseline p95 {previous['p95_ms']} ms, {previous['rps']} rps)"
+        print(line)
+    print(f"total {result['total_rps']} req/s")
+
+
+def main(args: argparse.Namespace) -> int:
+    usernames = asyncio.run(prepare(args))
+    if not usernames:
+        raise SystemExit("No synthetic users in the database; run with --seed")
+    articles = start_article_server()
+    server = start_server(args)
+    try:
+        result = asyncio.run(drive(args, usernames, f"http://127.0.0.1:{articles.server_port}"))
+    finally:
+        server.terminate()
+        server.wait()
+        articles.shutdown()
+
+    result["meta"] = {
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "duration": args.duration,
+        "concurrency": args.concurrency,
+        "workers": args.workers,
+        "mix": args.mix,
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_result(result, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(result, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", action="store_true", help="fill the database with benchmarks.datagen before the run")
+    parser.add_argument("--users", type=int, default=1000, help="users to seed and log in as")
+    parser.add_argument("--dois", type=int, default=10_000, help="keep it the same when reusing a seeded database")
+    parser.add_argument("--highlights", type=int, default=1_000_000)
+    parser.add_argument("--summaries", type=int, default=10_000)
+    parser.add_argument("--random-seed", type=int, default=2026)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation=weight pairs")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to measure")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds to run before measuring")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against this earlier --output file")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,83 @@
+"""
+Memory per gunicorn worker with and without preloading the app.
+
+    python -m benchmarks.worker_memory --workers 4
+
+Starts gunicorn.conf.py twice, with GUNICORN_PRELOAD=0 and =1, warms every
+worker with a few requests, and reports each worker's resident, proportional
+(Pss) and private memory. Pss splits shared pages between the processes
+sharing them, so the Pss total is what the workers really cost. Linux only.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from app.server import memory_usage
+
+
+def children(pid: int) -> list[int]:
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def measure(args: argparse.Namespace, preload: bool) -> list[dict[str, int]]:
+    env = {**os.environ, "PORT": str(args.port), "GUNICORN_PRELOAD": "1" if preload else "0"}
+    master = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "--workers", str(args.workers), "app.main:app"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = f"http://127.0.0.1:{args.port}"
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                httpx.get(f"{url}/ping").raise_for_status()
+                break
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("gunicorn did not start")
+                time.sleep(0.5)
+        # Enough requests that every worker has handled a few.
+        with httpx.Client(base_url=url) as client:
+            for number in range(args.requests):
+                client.get("/ping")
+                client.get("/highlights/doi/10.1234/example.5678/stats")
+                client.get("/users/me/", headers={"Authorization": "Bearer invalid"})
+                # Rejected by the password-strength check, so nothing is written.
+                client.post("/users/", json={
+                    "username": f"memory{number}",
+                    "email": f"memory{number}@example.com",
+                    "password": "password",
+                })
+        return [memory_usage(pid) for pid in children(master.pid)]
+    finally:
+        master.terminate()
+        master.wait()
+
+
+def report(label: str, workers: list[dict[str, int]]) -> None:
+    print(label)
+    print(f"{'worker':>8} {'rss MiB':>9} {'pss MiB':>9} {'private MiB':>12}")
+    for number, usage in enumerate(workers, 1):
+        private = usage["Private_Clean"] + usage["Private_Dirty"]
+        print(f"{number:>8} {usage['Rss'] / 1024:>9.1f} {usage['Pss'] / 1024:>9.1f} {private / 1024:>12.1f}")
+    print(f"{'total':>8} {sum(u['Rss'] for u in workers) / 1024:>9.1f} {sum(u['Pss'] for u in workers) / 1024:>9.1f}")
+
+
+def main(args: argparse.Namespace) -> None:
+    report("Without preload", measure(args, preload=False))
+    report("With preload and gc.freeze", measure(args, preload=True))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--requests", type=int, default=50, help="rounds of warm-up requests")
+    main(parser.parse_args())
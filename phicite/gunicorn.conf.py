@@ -0,0 +1,58 @@
+"""
+Production gunicorn settings.
+
+    gunicorn --config gunicorn.conf.py app.main:app
+
+The app and its read-only state (app.server.preload) are loaded once in the
+master, which then forks the uvicorn workers, so they share those pages
+copy-on-write instead of each loading its own copy. Set GUNICORN_PRELOAD=0
+to load the app in every worker instead. WEB_CONCURRENCY sets the number of
+workers. FORWARDED_ALLOW_IPS lists the proxies trusted for the client
+address. Each process logs its memory use as it starts.
+
+On SIGTERM a worker stops accepting connections, finishes its in-flight
+requests, then gives background jobs SHUTDOWN_TIMEOUT seconds (see
+app.resources); gunicorn kills it after GRACEFUL_TIMEOUT, so keep that the
+larger of the two.
+"""
+import gc
+import os
+
+from app.server import discard_inherited_connections, format_memory, memory_usage, preload
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+# Addresses whose X-Forwarded-For the workers trust for the client address
+# that rate limits key on: the load balancer's, or "*" where only it can
+# reach the app (Heroku). Left at localhost, every request seems to come
+# from the proxy and shares its limits.
+forwarded_allow_ips = os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1,::1")
+
+if preload_app:
+    # A collection in the master frees objects between the ones workers will
+    # share, and one in a worker writes to every object it scans, copying
+    # the page. So: no collections in the master, freeze what it has loaded
+    # right before each fork, and collect as usual in the workers.
+    gc.disable()
+
+
+def when_ready(server):
+    if preload_app:
+        preload()
+    server.log.info("Master %s memory: %s", os.getpid(), format_memory(memory_usage()))
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
+    discard_inherited_connections()
+
+
+def post_worker_init(worker):
+    worker.log.info("Worker %s memory: %s", worker.pid, format_memory(memory_usage()))
@@ -0,0 +1,26 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "policy_set" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "comment" TEXT,
+    "created_at" TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "activated_at" TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS "idx_policy_set_activat_5c7d21" ON "policy_set" ("activated_at");
+CREATE TABLE IF NOT EXISTS "policy_rule" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "sub_rule" TEXT NOT NULL,
+    "obj" VARCHAR(255) NOT NULL,
+    "act" VARCHAR(16) NOT NULL,
+    "policy_set_id" INT NOT NULL REFERENCES "policy_set" ("id") ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS "idx_policy_rule_policy__9e4b07" ON "policy_rule" ("policy_set_id");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "policy_rule";
+        DROP TABLE IF EXISTS "policy_set";"""
@@ -0,0 +1,22 @@
+from tortoise import BaseDBAsyncClient
+
+
+# crud.get_highlights_for_dois_public reads the first highlights of each DOI
+# in id order; (doi_key, id) serves that with a bounded index scan per DOI
+# and every other doi_key lookup, so it replaces the doi_key index. Both
+# statements run CONCURRENTLY, one at a time, so pdfhighlight stays
+# writable; apply with `aerich upgrade --in-transaction false`.
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    await db.execute_script(
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_pdfhighligh_doi_key_7910d9" ON "pdfhighlight" ("doi_key", "id");'
+    )
+    return """
+        DROP INDEX CONCURRENTLY IF EXISTS "idx_pdfhighligh_doi_key_b72c94";"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    await db.execute_script(
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_pdfhighligh_doi_key_b72c94" ON "pdfhighlight" ("doi_key");'
+    )
+    return """
+        DROP INDEX CONCURRENTLY IF EXISTS "idx_pdfhighligh_doi_key_7910d9";"""
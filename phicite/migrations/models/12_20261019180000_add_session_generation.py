@@ -0,0 +1,16 @@
+from tortoise import BaseDBAsyncClient
+
+
+# Refresh tokens issued before this carry no generation and are read as
+# generation 0, which is where every existing session starts, so they keep
+# working.
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "user_session" ADD "generation" INT NOT NULL DEFAULT 0;
+ALTER TABLE "user_session" DROP COLUMN "previous_hash";"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "user_session" ADD "previous_hash" VARCHAR(64);
+ALTER TABLE "user_session" DROP COLUMN "generation";"""
@@ -0,0 +1,14 @@
+from tortoise import BaseDBAsyncClient
+
+
+# Summaries already empty count as tried once, so each gets the remaining
+# attempts at the next start rather than a full set.
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "textsummary" ADD "attempts" SMALLINT NOT NULL DEFAULT 0;
+UPDATE "textsummary" SET "attempts" = 1 WHERE "summary" = '';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "textsummary" DROP COLUMN "attempts";"""
@@ -0,0 +1,29 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "doi_stats" (
+    "doi" VARCHAR(255) NOT NULL PRIMARY KEY,
+    "highlight_count" INT NOT NULL DEFAULT 0,
+    "reader_count" INT NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS "doi_reader" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "doi" VARCHAR(255) NOT NULL,
+    "highlight_count" INT NOT NULL DEFAULT 0,
+    "user_id" INT NOT NULL REFERENCES "user" ("id") ON DELETE CASCADE,
+    CONSTRAINT "uid_doi_reader_doi_8b3836" UNIQUE ("doi", "user_id")
+);
+INSERT INTO "doi_reader" ("doi", "user_id", "highlight_count")
+    SELECT "doi", "user_id", COUNT(*) FROM "pdfhighlight" GROUP BY "doi", "user_id"
+    ON CONFLICT ("doi", "user_id") DO NOTHING;
+INSERT INTO "doi_stats" ("doi", "highlight_count", "reader_count")
+    SELECT "doi", SUM("highlight_count"), COUNT(*) FROM "doi_reader" GROUP BY "doi"
+    ON CONFLICT ("doi") DO NOTHING;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "doi_reader";
+DROP TABLE IF EXISTS "doi_stats";"""
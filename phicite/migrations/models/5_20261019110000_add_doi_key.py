@@ -0,0 +1,19 @@
+from tortoise import BaseDBAsyncClient
+
+
+# Adding a nullable column is a catalog-only change, and the index is built
+# CONCURRENTLY, so neither rewrites pdfhighlight or blocks writes to it.
+# CONCURRENTLY cannot run in a transaction block, so the index is created
+# on its own after the column; apply with `aerich upgrade --in-transaction
+# false`. Existing rows are filled in afterwards, in small batches, by
+# `python -m app.backfill`.
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    await db.execute_script('ALTER TABLE "pdfhighlight" ADD "doi_key" BIGINT;')
+    return """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_pdfhighligh_doi_key_b72c94" ON "pdfhighlight" ("doi_key");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_pdfhighligh_doi_key_b72c94";
+ALTER TABLE "pdfhighlight" DROP COLUMN "doi_key";"""
@@ -0,0 +1,61 @@
+from tortoise import BaseDBAsyncClient
+
+
+# The GiST index is on the same box(point(x1, y1), point(x2, y2)) expression
+# crud.get_highlight_parts_for_page filters on. Existing highlights are split
+# into parts with jsonb_each; doi_key is computed here rather than read from
+# pdfhighlight, where it may not have been backfilled yet. Every cast is
+# guarded by a CASE, so a malformed part (a rect that is not four numbers, a
+# page that is not a positive integer as the API requires, text that is not
+# a string) is skipped instead of aborting the migration. Parts saved before
+# pages were recorded get a NULL page: they stay in the highlight but are not
+# returned by page.
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "highlight_part" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "doi_key" BIGINT NOT NULL,
+    "number" VARCHAR(8) NOT NULL,
+    "page" INT,
+    "x1" DOUBLE PRECISION NOT NULL,
+    "y1" DOUBLE PRECISION NOT NULL,
+    "x2" DOUBLE PRECISION NOT NULL,
+    "y2" DOUBLE PRECISION NOT NULL,
+    "text" TEXT NOT NULL,
+    "highlight_id" INT NOT NULL REFERENCES "pdfhighlight" ("id") ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS "idx_highlight_p_doi_key_fb7cb7" ON "highlight_part" ("doi_key", "page");
+CREATE INDEX IF NOT EXISTS "idx_highlight_p_highlig_bba25a" ON "highlight_part" ("highlight_id");
+CREATE INDEX IF NOT EXISTS "idx_highlight_p_box" ON "highlight_part"
+    USING GIST (box(point("x1", "y1"), point("x2", "y2")));
+INSERT INTO "highlight_part" ("highlight_id", "doi_key", "number", "page", "x1", "y1", "x2", "y2", "text")
+    SELECT "id", ('x' || substr(md5("doi"), 1, 16))::bit(64)::bigint, "key", "page",
+           LEAST("ax", "bx"), LEAST("ay", "by"), GREATEST("ax", "bx"), GREATEST("ay", "by"), "text"
+    FROM (
+        SELECT h."id", h."doi", part."key",
+               CASE WHEN part."value"->>'page' ~ '^[1-9][0-9]{0,8}$' THEN (part."value"->>'page')::int END AS "page",
+               part."value"->>'page' IS NOT NULL AS "has_page",
+               CASE WHEN part."value"->'rect'->>0 ~ '^[-+]?([0-9]+[.]?[0-9]*|[.][0-9]+)([eE][-+]?[0-9]+)?$'
+                    THEN (part."value"->'rect'->>0)::float8 END AS "ax",
+               CASE WHEN part."value"->'rect'->>1 ~ '^[-+]?([0-9]+[.]?[0-9]*|[.][0-9]+)([eE][-+]?[0-9]+)?$'
+                    THEN (part."value"->'rect'->>1)::float8 END AS "ay",
+               CASE WHEN part."value"->'rect'->>2 ~ '^[-+]?([0-9]+[.]?[0-9]*|[.][0-9]+)([eE][-+]?[0-9]+)?$'
+                    THEN (part."value"->'rect'->>2)::float8 END AS "bx",
+               CASE WHEN part."value"->'rect'->>3 ~ '^[-+]?([0-9]+[.]?[0-9]*|[.][0-9]+)([eE][-+]?[0-9]+)?$'
+                    THEN (part."value"->'rect'->>3)::float8 END AS "by",
+               part."value"->>'text' AS "text"
+        FROM "pdfhighlight" AS h,
+             jsonb_each(CASE WHEN jsonb_typeof(h."highlight") = 'object' THEN h."highlight" ELSE '{}' END) AS part
+        WHERE jsonb_typeof(part."value") = 'object'
+          AND length(part."key") <= 8
+          AND jsonb_typeof(part."value"->'rect') = 'array'
+          AND jsonb_array_length(part."value"->'rect') = 4
+          AND jsonb_typeof(part."value"->'text') = 'string'
+    ) AS "parts"
+    WHERE ("page" IS NOT NULL OR NOT "has_page")
+      AND "ax" IS NOT NULL AND "ay" IS NOT NULL AND "bx" IS NOT NULL AND "by" IS NOT NULL;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "highlight_part";"""
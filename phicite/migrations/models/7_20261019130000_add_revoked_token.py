@@ -0,0 +1,18 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "revoked_token" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "jti" VARCHAR(32) UNIQUE,
+    "user_id" INT,
+    "revoked_at" TIMESTAMPTZ NOT NULL,
+    "expires_at" TIMESTAMPTZ NOT NULL
+);
+CREATE INDEX IF NOT EXISTS "idx_revoked_tok_expires_6c1d2e" ON "revoked_token" ("expires_at");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "revoked_token";"""
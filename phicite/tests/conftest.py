@@ -1,13 +1,12 @@
+import functools
 import os
 from datetime import datetime, UTC, timedelta
-import logging
 
 import unittest.mock
 import pytest
 import pytest_asyncio
 from starlette.testclient import TestClient
 from httpx import AsyncClient, ASGITransport
-from tortoise import Tortoise
 import jwt
 
 
@@ -18,6 +17,26 @@ from app.models.pydantic import UserSchema, TokenDataSchema, AuthSchema
 from app.auth import get_password_hash
 from app.api import crud
 from app.api import users
+from app.apikeys import get_api_key_store
+from app.policy import get_enforcer
+from app.sessions import get_session_store
+from app.tokens import get_token_service
+
+# query_counter records every test's SQL and provides count_queries,
+# assert_max_queries and the max_queries marker; database provides
+# init_test_db, on a database of each xdist worker's own.
+pytest_plugins = ["tests.query_counter", "tests.database"]
+
+@pytest.fixture(autouse=True)
+def token_service():
+    # A fresh service for each test: the cached ones keep revocations,
+    # users, API keys and policy sets in memory, and user ids repeat once each test's
+    # rows are rolled back.
+    get_token_service.cache_clear()
+    get_session_store.cache_clear()
+    get_api_key_store.cache_clear()
+    get_enforcer.cache_clear()
+    return get_token_service()
 
 
 @pytest.fixture(scope="function")
@@ -219,58 +238,10 @@ async def authenticated_client(test_app):
     yield client, fake_user
 
 
-@pytest_asyncio.fixture(scope="function")
-async def init_test_db():
-    logger = logging.getLogger("test_db")
-    logger.setLevel(logging.DEBUG)
-
-    # Create a console handler
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.DEBUG)
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
-    ch.setFormatter(formatter)
-    logger.addHandler(ch)
-
-    db_url = os.environ.get("DATABASE_TEST_URL")
-    logger.info(f"Connecting to database with URL: {db_url}")
-
-    try:
-        logger.info("Initializing Tortoise...")
-        await Tortoise.init(
-            db_url=os.environ.get("DATABASE_TEST_URL"),
-            modules={"models": ["app.models.tortoise"]},
-        )
-
-        # Get connection
-        _ = Tortoise.get_connection("default")
-
-        # Get all model classes
-        models = Tortoise.apps.get("models").values()
-
-        # Clear all tables (more selective than dropping the whole database)
-        for model in models:
-            if hasattr(model, "_meta") and hasattr(model._meta, "table"):
-                logger.info(f"Clearing table: {model._meta.table}")
-                await model.all().delete()
-
-        # Generate schemas to ensure all tables exist with correct structure
-        await Tortoise.generate_schemas()
-
-        yield
-    except Exception as e:
-        logger.error(f"Error during database initialization: {str(e)}")
-        logger.exception("Full exception details:")
-        raise
-    finally:
-        logger.info("Cleaning up database connections...")
-        try:
-            await Tortoise.close_connections()
-            logger.info("Database connections closed")
-        except Exception as e:
-            logger.error(f"Error closing connections: {str(e)}")
-            logger.exception("Full exception details:")
+@functools.cache
+def hash_password(password: str) -> str:
+    # bcrypt is deliberately slow; the fixture users' passwords never change.
+    return get_password_hash(password)
 
 
 async def create_user_directly(user_data):
@@ -278,7 +249,7 @@ async def create_user_directly(user_data):
         username=user_data["username"],
         email=user_data["email"],
         full_name=user_data["full_name"],
-        hashed_password=get_password_hash(user_data["password"]),
+        hashed_password=hash_password(user_data["password"]),
         is_admin=user_data.get("is_admin", False),
     )
     await user.save()
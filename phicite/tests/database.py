@@ -0,0 +1,160 @@
+"""
+One test database per pytest-xdist worker, reset by rolling back.
+
+On Postgres the schema is generated once into a template database by the
+controlling process, and each worker clones it with CREATE DATABASE ...
+TEMPLATE. On SQLite each worker gets its own file. Every test then runs
+inside a transaction that is rolled back afterwards (code under test that
+opens its own transaction gets a savepoint), so no test sees another's
+rows and nothing is truncated or regenerated between tests.
+
+    python -m pytest -n auto
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit, urlunsplit
+
+import asyncpg
+import pytest_asyncio
+from tortoise import Tortoise, connections
+
+MODULES = {"models": ["app.models.tortoise"]}
+
+
+class _Rollback(Exception):
+    pass
+
+
+def worker_id() -> str:
+    return os.environ.get("PYTEST_XDIST_WORKER", "main")
+
+
+def is_postgres(url: str) -> bool:
+    return urlsplit(url).scheme in ("postgres", "postgresql", "asyncpg", "psycopg")
+
+
+def with_database(url: str, name: str) -> str:
+    """
+    `url` with its database (the path) replaced by `name`.
+    """
+    parts = urlsplit(url)
+    return urlunsplit(parts._replace(path=f"/{name}"))
+
+
+def database_name(url: str) -> str:
+    return urlsplit(url).path.lstrip("/")
+
+
+def template_url(url: str) -> str:
+    return with_database(url, f"{database_name(url)}_template")
+
+
+def worker_url(url: str, worker: str | None = None) -> str:
+    """
+    The database URL a worker's tests connect to. Without xdist this is
+    `url` itself.
+    """
+    worker = worker or worker_id()
+    if worker == "main":
+        return url
+    if is_postgres(url):
+        return with_database(url, f"{database_name(url)}_{worker}")
+    # sqlite://path/to/file.db -> sqlite://path/to/file_gw0.db
+    if url.endswith(":memory:"):
+        return url
+    root, extension = os.path.splitext(url)
+    return f"{root}_{worker}{extension}"
+
+
+async def _admin(url: str, statements: list[str]) -> None:
+    # CREATE and DROP DATABASE cannot run in a transaction, and are run from
+    # the maintenance database so neither side has open connections.
+    admin_url = urlsplit(with_database(url, "postgres"))._replace(scheme="postgresql")
+    connection = await asyncpg.connect(urlunsplit(admin_url))
+    try:
+        for statement in statements:
+            await connection.execute(statement)
+    finally:
+        await connection.close()
+
+
+async def _generate_schemas(url: str) -> None:
+    await Tortoise.init(db_url=url, modules=MODULES)
+    try:
+        await Tortoise.generate_schemas()
+    finally:
+        await Tortoise.close_connections()
+
+
+async def build_template(url: str) -> None:
+    """
+    Create the Postgres template database with the current schema.
+    """
+    template = database_name(template_url(url))
+    await _admin(url, [
+        f'DROP DATABASE IF EXISTS "{template}"',
+        f'CREATE DATABASE "{template}"',
+    ])
+    await _generate_schemas(template_url(url))
+
+
+async def prepare_worker_database(url: str) -> None:
+    """
+    Give this worker a fresh database with the current schema.
+    """
+    target = worker_url(url)
+    if is_postgres(url):
+        name = database_name(target)
+        await _admin(url, [
+            f'DROP DATABASE IF EXISTS "{name}"',
+            f'CREATE DATABASE "{name}" TEMPLATE "{database_name(template_url(url))}"',
+        ])
+        return
+    path = target.removeprefix("sqlite://")
+    if path != ":memory:" and os.path.exists(path):
+        os.remove(path)
+    await _generate_schemas(target)
+
+
+@asynccontextmanager
+async def rolled_back(url: str):
+    """
+    Connect Tortoise to `url` for the duration of the block, inside a
+    transaction that is always rolled back.
+    """
+    await Tortoise.init(db_url=url, modules=MODULES)
+    try:
+        if url.endswith(":memory:"):
+            await Tortoise.generate_schemas()
+        transaction = connections.get("default")._in_transaction()
+        await transaction.__aenter__()
+        try:
+            yield
+        finally:
+            await transaction.__aexit__(_Rollback, _Rollback(), None)
+    finally:
+        await Tortoise.close_connections()
+
+
+def pytest_configure(config) -> None:
+    url = os.environ.get("DATABASE_TEST_URL")
+    if not url:
+        return
+    # The controller builds the template before starting any worker; without
+    # xdist the one process builds it and runs the tests.
+    is_worker = hasattr(config, "workerinput")
+    if is_postgres(url) and not is_worker:
+        asyncio.run(build_template(url))
+    if is_worker or not getattr(config.option, "numprocesses", None):
+        asyncio.run(prepare_worker_database(url))
+
+
+@pytest_asyncio.fixture
+async def init_test_db():
+    """
+    Connect to this worker's test database; everything the test writes is
+    rolled back afterwards.
+    """
+    async with rolled_back(worker_url(os.environ.get("DATABASE_TEST_URL"))):
+        yield
@@ -0,0 +1,95 @@
+"""
+Count the SQL statements tests send through Tortoise.
+
+Every test's statements are recorded and attached to its report (and to
+JUnit XML as the `queries` property). Tests can bound them in three ways:
+
+    @pytest.mark.max_queries(3)            # the whole test body
+    with assert_max_queries(1): ...        # one block
+    count_queries.queries                  # inspect them directly
+"""
+from contextlib import contextmanager
+
+import pytest
+
+from app.instrumentation import instrument_db_clients, statement_listeners
+
+
+class QueryCounter:
+    def __init__(self) -> None:
+        self.queries: list[str] = []
+
+    def __len__(self) -> int:
+        return len(self.queries)
+
+    def reset(self) -> None:
+        self.queries.clear()
+
+    def report(self) -> str:
+        return "\n".join(f"{number}. {' '.join(query.split())}" for number, query in enumerate(self.queries, 1))
+
+
+# Counters currently collecting; every statement is appended to each.
+_active: list[QueryCounter] = []
+
+
+@contextmanager
+def counting():
+    counter = QueryCounter()
+    _active.append(counter)
+    try:
+        yield counter
+    finally:
+        _active.remove(counter)
+
+
+def record(query: str) -> None:
+    for counter in _active:
+        counter.queries.append(query)
+
+
+def pytest_configure(config) -> None:
+    config.addinivalue_line(
+        "markers", "max_queries(n): fail if the test body sends more than n SQL statements"
+    )
+    # The statements are seen through the app's own instrumentation, the
+    # wrapper that counts them per request for /metrics.
+    instrument_db_clients()
+    statement_listeners.append(record)
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_call(item):
+    with counting() as counter:
+        yield
+    item.user_properties.append(("queries", len(counter)))
+    if counter.queries:
+        item.add_report_section("call", "queries", counter.report())
+    marker = item.get_closest_marker("max_queries")
+    if marker is not None and len(counter) > marker.args[0]:
+        pytest.fail(
+            f"{len(counter)} queries exceeds max_queries({marker.args[0]}):\n{counter.report()}",
+            pytrace=False,
+        )
+
+
+@pytest.fixture
+def count_queries(init_test_db):
+    """Count every statement sent to the database while the test runs."""
+    with counting() as counter:
+        yield counter
+
+
+@pytest.fixture
+def assert_max_queries(init_test_db):
+    """
+    Context manager failing the test if the block sends more than `limit`
+    statements.
+    """
+    @contextmanager
+    def assert_max_queries(limit: int):
+        with counting() as counter:
+            yield counter
+        if len(counter) > limit:
+            pytest.fail(f"{len(counter)} queries exceeds the limit of {limit}:\n{counter.report()}")
+    return assert_max_queries
@@ -1,17 +1,218 @@
-from app.api.users import enforcer
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from app import db
+from app.api import crud
+from app.policy import POLICY_CHANNEL, Resource, get_enforcer
 
 
 def test_regular_user_permissions(mock_user):
-    assert enforcer.enforce(mock_user, "/users/me/", "GET")
-    assert enforcer.enforce(mock_user, "/users/me/highlights/", "GET")
-    assert not enforcer.enforce(mock_user, "/users/admin/username/", "GET")
+    assert get_enforcer().enforce(mock_user, "/users/me/", "GET")
+    assert get_enforcer().enforce(mock_user, "/users/me/highlights/", "GET")
+    assert not get_enforcer().enforce(mock_user, "/users/admin/username/", "GET")
 
 def test_admin_user_permissions(mock_admin_user):
-    assert enforcer.enforce(mock_admin_user, "/users/admin/username/", "GET")
-    assert enforcer.enforce(mock_admin_user, "/users/admin/username/", "DELETE")
-    assert enforcer.enforce(mock_admin_user, "/users/admin/id/", "GET")
-    assert enforcer.enforce(mock_admin_user, "/users/admin/id/", "DELETE")
-    assert enforcer.enforce(mock_admin_user, "/users/admin/email/", "GET")
-    assert enforcer.enforce(mock_admin_user, "/users/admin/email/", "DELETE")
-    assert enforcer.enforce(mock_admin_user, "/users/me/", "GET")
-    assert enforcer.enforce(mock_admin_user, "/users/me/highlights/", "GET")
\ No newline at end of file
+    assert get_enforcer().enforce(mock_admin_user, "/users/admin/username/", "GET")
+    assert get_enforcer().enforce(mock_admin_user, "/users/admin/username/", "DELETE")
+    assert get_enforcer().enforce(mock_admin_user, "/users/admin/id/", "GET")
+    assert get_enforcer().enforce(mock_admin_user, "/users/admin/id/", "DELETE")
+    assert get_enforcer().enforce(mock_admin_user, "/users/admin/email/", "GET")
+    assert get_enforcer().enforce(mock_admin_user, "/users/admin/email/", "DELETE")
+    assert get_enforcer().enforce(mock_admin_user, "/users/me/", "GET")
+    assert get_enforcer().enforce(mock_admin_user, "/users/me/highlights/", "GET")
+
+def test_policy_loads_from_any_working_directory(monkeypatch, tmp_path, mock_user):
+    monkeypatch.chdir(tmp_path)
+    get_enforcer.cache_clear()
+    try:
+        assert get_enforcer().enforce(mock_user, "/users/me/", "GET")
+    finally:
+        get_enforcer.cache_clear()
+
+
+def test_ownership_is_policy(mock_user):
+    policy = get_enforcer()
+    assert policy.enforce(mock_user, "/highlights/id/", "DELETE", Resource(user_id=mock_user.id))
+    assert not policy.enforce(mock_user, "/highlights/id/", "DELETE", Resource(user_id=mock_user.id + 1))
+    assert not policy.enforce(mock_user, "/highlights/id/", "DELETE")
+
+
+def test_decisions_are_cached_per_attribute(monkeypatch, mock_user, mock_admin_user):
+    policy = get_enforcer()
+    evaluated = []
+    allows = policy.policy.allows
+    monkeypatch.setattr(policy.policy, "allows", lambda *args: evaluated.append(args) or allows(*args))
+
+    for _ in range(3):
+        assert policy.enforce(mock_user, "/users/me/", "GET")
+    # Another user with the same attributes, as far as the rules read them.
+    assert policy.enforce(mock_user.model_copy(update={"id": 99, "username": "other"}), "/users/me/", "GET")
+    assert not policy.enforce(mock_user, "/users/admin/id/", "GET")
+    assert policy.enforce(mock_admin_user, "/users/admin/id/", "GET")
+    assert len(evaluated) == 3
+
+
+def test_invalid_rules_are_refused():
+    with pytest.raises(ValueError):
+        get_enforcer().compile([("r.sub.is_admin ==", "/users/me/", "GET")])
+
+
+def admin_rules(*rules):
+    return [
+        {"sub_rule": "r.sub.is_admin == True", "obj": "/users/admin/policy/", "act": act}
+        for act in ("GET", "POST")
+    ] + [{"sub_rule": sub_rule, "obj": obj, "act": act} for sub_rule, obj, act in rules]
+
+
+@pytest.mark.asyncio
+async def test_published_policy_is_in_force_and_can_be_rolled_back(authenticated_admin_client_with_db, setup_users):
+    client, _ = authenticated_admin_client_with_db
+    user, _, _ = setup_users
+    response = await client.post(
+        "/users/token",
+        data={"username": user["username"], "password": user["password"]},
+        headers={"Authorization": ""},
+    )
+    user_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    assert (await client.get("/users/me/", headers=user_headers)).status_code == 200
+
+    response = await client.post("/users/admin/policy/", json={"comment": "admins only", "rules": admin_rules(
+        ("r.sub.is_admin == True", "/users/me/", "GET"),
+    )})
+    assert response.status_code == 201
+    first = response.json()
+    assert (await client.get("/users/me/", headers=user_headers)).status_code == 403
+
+    response = await client.post("/users/admin/policy/", json={"rules": admin_rules(
+        ("r.sub.disabled == False", "/users/me/", "GET"),
+    )})
+    assert response.status_code == 201
+    assert (await client.get("/users/me/", headers=user_headers)).status_code == 200
+
+    response = await client.post(f"/users/admin/policy/{first['id']}/activate")
+    assert response.status_code == 204
+    assert (await client.get("/users/me/", headers=user_headers)).status_code == 403
+
+    response = await client.get(f"/users/admin/policy/{first['id']}/")
+    assert response.status_code == 200
+    assert response.json()["comment"] == "admins only"
+    assert len(response.json()["rules"]) == 3
+    response = await client.get("/users/admin/policy/")
+    assert [policy_set["id"] for policy_set in response.json()] == [first["id"] + 1, first["id"]]
+
+
+@pytest.mark.asyncio
+async def test_policy_that_locks_out_the_admin_is_refused(authenticated_admin_client_with_db):
+    client, _ = authenticated_admin_client_with_db
+
+    response = await client.post("/users/admin/policy/", json={"rules": [
+        {"sub_rule": "r.sub.disabled == False", "obj": "/users/me/", "act": "GET"},
+    ]})
+    assert response.status_code == 422
+    response = await client.post("/users/admin/policy/", json={"rules": admin_rules(
+        ("r.sub.is_admin = True", "/users/me/", "GET"),
+    )})
+    assert response.status_code == 422
+    assert get_enforcer().version is None
+
+
+@pytest.mark.asyncio
+async def test_policy_can_let_admins_remove_any_highlight(authenticated_admin_client_with_db, test_highlights):
+    client, _ = authenticated_admin_client_with_db
+    highlight = test_highlights["single_highlight"][0]
+
+    response = await client.delete(f"/highlights/id/{highlight['id']}/")
+    assert response.status_code == 403
+    assert response.json()["detail"] == "Not authorized to delete this highlight"
+
+    rules = [
+        {"sub_rule": sub_rule, "obj": obj, "act": act} for sub_rule, obj, act in get_enforcer().file_rules
+    ] + [{"sub_rule": "r.sub.is_admin == True", "obj": "/highlights/id/", "act": "DELETE"}]
+    response = await client.post("/users/admin/policy/", json={"rules": rules})
+    assert response.status_code == 201
+
+    response = await client.delete(f"/highlights/id/{highlight['id']}/")
+    assert response.status_code == 200
+    assert response.json()["id"] == highlight["id"]
+
+
+@pytest.mark.asyncio
+async def test_policy_sets_activated_elsewhere_are_picked_up(init_test_db, mock_user):
+    policy = get_enforcer()
+    assert policy.enforce(mock_user, "/users/me/", "GET")
+
+    # Activated by another worker: this one only learns of it on refresh.
+    await crud.post_policy_set([("r.sub.is_admin == True", "/users/me/", "GET")], None, datetime.now(timezone.utc))
+    assert policy.enforce(mock_user, "/users/me/", "GET")
+
+    assert await policy.refresh()
+    assert not policy.enforce(mock_user, "/users/me/", "GET")
+    assert not await policy.refresh()
+
+
+class FakeListenConnection:
+    def __init__(self):
+        self.listeners = []
+        self.termination_listeners = []
+        self.closed = False
+
+    async def add_listener(self, channel, callback):
+        self.listeners.append(callback)
+
+    def add_termination_listener(self, callback):
+        self.termination_listeners.append(callback)
+
+    def notify(self):
+        for callback in self.listeners:
+            callback(self, 1, POLICY_CHANNEL, "")
+
+    def drop(self):
+        self.closed = True
+        for callback in self.termination_listeners:
+            callback(self)
+
+    def terminate(self):
+        self.closed = True
+
+    def is_closed(self):
+        return self.closed
+
+
+@pytest.mark.asyncio
+async def test_listening_reconnects_and_catches_up(monkeypatch):
+    import asyncpg
+
+    class Client:
+        capabilities = SimpleNamespace(dialect="postgres")
+        host, port, user, password, database = "db", 5432, "phicite", "secret", "phicite"
+        server_settings, extra = {}, {}
+
+    opened = []
+
+    async def connect(**kwargs):
+        opened.append(FakeListenConnection())
+        return opened[-1]
+    monkeypatch.setattr(db, "connections", SimpleNamespace(get=lambda name: Client()))
+    monkeypatch.setattr(db, "LISTEN_RETRY_MIN_SECONDS", 0)
+    monkeypatch.setattr(asyncpg, "connect", connect)
+    calls = []
+
+    async with db.listening(POLICY_CHANNEL, lambda: calls.append(len(opened))) as listening:
+        assert listening
+        opened[0].notify()
+        assert calls == [1]
+
+        await asyncio.sleep(0)
+        opened[0].drop()
+        for _ in range(10):
+            await asyncio.sleep(0)
+        # Subscribed again, and told to catch up on what it missed.
+        assert len(opened) == 2
+        assert calls == [1, 2]
+        opened[1].notify()
+        assert calls == [1, 2, 2]
+
+    assert opened[1].is_closed()
@@ -0,0 +1,180 @@
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from app.api import annotations, crud
+from app.config import get_settings, Settings
+from app.ratelimit import RateLimits
+
+
+def edit(seq, id=1, text="highlighted text", doi="10.1234/example.5678"):
+    return {
+        "seq": seq,
+        "id": id,
+        "doi": doi,
+        "highlight": {"1": {"rect": [100, 200, 300, 220], "text": text}},
+    }
+
+
+def override_window(test_app, window_ms, max_batch=100):
+    test_app.app.dependency_overrides[get_settings] = lambda: Settings(
+        testing=1, highlight_edit_window_ms=window_ms, highlight_edit_max_batch=max_batch
+    )
+
+
+def test_edit_channel_requires_authentication(test_app):
+    with pytest.raises(WebSocketDisconnect) as exc_info:
+        with test_app.websocket_connect("/highlights/ws"):
+            pass
+    assert exc_info.value.code == 1008
+
+
+def test_edit_channel_coalesces_edits_to_same_highlight(
+    test_app,
+    monkeypatch,
+    mock_get_user_by_token_data_user,
+    mock_user,
+    mock_jwt_decode_user,
+):
+    batches = []
+
+    async def mock_put_highlights(edits, user_id):
+        assert user_id == mock_user.id
+        batches.append(edits)
+        return [{"id": id} for id, _ in edits]
+    monkeypatch.setattr(crud, "put_highlights", mock_put_highlights)
+    override_window(test_app, 200)
+
+    with test_app.websocket_connect("/highlights/ws?token=fake_valid_token") as websocket:
+        websocket.send_json(edit(1, text="first"))
+        websocket.send_json(edit(2, text="second"))
+        websocket.send_json(edit(3, text="third"))
+        websocket.send_json(edit(4, id=2))
+        acks = [websocket.receive_json() for _ in range(4)]
+
+    assert sorted(acks, key=lambda ack: ack["seq"]) == [
+        {"seq": 1, "id": 1, "status": 200},
+        {"seq": 2, "id": 1, "status": 200},
+        {"seq": 3, "id": 1, "status": 200},
+        {"seq": 4, "id": 2, "status": 200},
+    ]
+    assert len(batches) == 1
+    assert [id for id, _ in batches[0]] == [1, 2]
+    assert batches[0][0][1].highlight["1"].text == "third"
+
+
+def test_edit_channel_flushes_when_batch_is_full(
+    test_app,
+    monkeypatch,
+    mock_get_user_by_token_data_user,
+    mock_jwt_decode_user,
+):
+    batches = []
+
+    async def mock_put_highlights(edits, user_id):
+        batches.append(edits)
+        return [{"id": id} for id, _ in edits]
+    monkeypatch.setattr(crud, "put_highlights", mock_put_highlights)
+    override_window(test_app, 60_000, max_batch=2)
+
+    with test_app.websocket_connect(
+        "/highlights/ws", headers={"Authorization": "Bearer fake_valid_token"}
+    ) as websocket:
+        websocket.send_json(edit(1, id=1))
+        websocket.send_json(edit(2, id=2))
+        acks = [websocket.receive_json() for _ in range(2)]
+
+    assert [ack["status"] for ack in acks] == [200, 200]
+    assert [id for id, _ in batches[0]] == [1, 2]
+
+
+def test_edit_channel_counts_writes_against_the_rate_limit(
+    test_app,
+    monkeypatch,
+    mock_get_user_by_token_data_user,
+    mock_jwt_decode_user,
+):
+    batches = []
+
+    async def mock_put_highlights(edits, user_id):
+        batches.append(edits)
+        return [{"id": id} for id, _ in edits]
+    monkeypatch.setattr(crud, "put_highlights", mock_put_highlights)
+    override_window(test_app, 60_000, max_batch=2)
+    test_app.app.state.resources.rate_limits = RateLimits(Settings(highlight_writes_per_user=3))
+
+    with test_app.websocket_connect("/highlights/ws?token=fake_valid_token") as websocket:
+        websocket.send_json(edit(1, id=1))
+        websocket.send_json(edit(2, id=2))
+        first = [websocket.receive_json() for _ in range(2)]
+        websocket.send_json(edit(3, id=3))
+        websocket.send_json(edit(4, id=4))
+        second = [websocket.receive_json() for _ in range(2)]
+
+    assert [ack["status"] for ack in first] == [200, 200]
+    assert [ack["status"] for ack in second] == [429, 429]
+    assert all(ack["retry_after"] > 0 for ack in second)
+    assert len(batches) == 1
+
+
+def test_edit_channel_acks_errors_per_edit(
+    test_app,
+    monkeypatch,
+    mock_get_user_by_token_data_user,
+    mock_jwt_decode_user,
+):
+    async def mock_put_highlights(edits, user_id):
+        return [
+            None,
+            crud.NotOwnerError(owner_id=3),
+            ValueError("DOI does not match existing highlight"),
+        ]
+    monkeypatch.setattr(crud, "put_highlights", mock_put_highlights)
+    override_window(test_app, 200)
+
+    with test_app.websocket_connect("/highlights/ws?token=fake_valid_token") as websocket:
+        websocket.send_json(edit(1, id=999))
+        websocket.send_json(edit(2, id=2))
+        websocket.send_json(edit(3, id=3))
+        websocket.send_json(edit(4, doi="invalid-doi"))
+        invalid_ack = websocket.receive_json()
+        acks = [websocket.receive_json() for _ in range(3)]
+
+    assert invalid_ack["seq"] == 4
+    assert invalid_ack["status"] == 422
+    assert invalid_ack["detail"][0]["msg"] == "Value error, Invalid DOI format"
+    assert acks == [
+        {"seq": 1, "id": 999, "status": 404, "detail": "highlight not found"},
+        {"seq": 2, "id": 2, "status": 403, "detail": "Not authorized to update this highlight"},
+        {"seq": 3, "id": 3, "status": 422, "detail": "Value error, DOI does not match existing highlight"},
+    ]
+
+
+def test_edit_channel_writes_as_the_owner_where_the_policy_allows(
+    test_app,
+    monkeypatch,
+    mock_get_user_by_token_data_user,
+    mock_user,
+    mock_jwt_decode_user,
+):
+    calls = []
+
+    async def mock_put_highlights(edits, user_id):
+        calls.append((user_id, [id for id, _ in edits]))
+        if user_id == mock_user.id:
+            return [{"id": 1}, crud.NotOwnerError(owner_id=7)]
+        return [{"id": id} for id, _ in edits]
+    monkeypatch.setattr(crud, "put_highlights", mock_put_highlights)
+
+    class AllowAll:
+        def enforce(self, sub, obj, act, res=None):
+            return True
+    monkeypatch.setattr(annotations, "get_enforcer", AllowAll)
+    override_window(test_app, 60_000, max_batch=2)
+
+    with test_app.websocket_connect("/highlights/ws?token=fake_valid_token") as websocket:
+        websocket.send_json(edit(1, id=1))
+        websocket.send_json(edit(2, id=2))
+        acks = [websocket.receive_json() for _ in range(2)]
+
+    assert [ack["status"] for ack in acks] == [200, 200]
+    assert calls == [(mock_user.id, [1, 2]), (7, [2])]
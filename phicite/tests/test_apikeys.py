@@ -0,0 +1,129 @@
+import pytest
+
+from app.apikeys import get_api_key_store
+
+HIGHLIGHT = {"doi": "10.1234/example.5678", "highlight": {"1": {"rect": [1, 2, 3, 4], "text": "a"}}}
+
+
+async def create_key(client, scopes, name="ingestion"):
+    response = await client.post("/users/me/api-keys/", json={"name": name, "scopes": scopes})
+    assert response.status_code == 201
+    return response.json()
+
+
+def bearer(key):
+    return {"Authorization": f"Bearer {key['key']}"}
+
+
+@pytest.mark.asyncio
+async def test_api_key_writes_highlights(authenticated_client_with_db, count_queries):
+    client, user = authenticated_client_with_db
+    key = await create_key(client, ["highlights:read", "highlights:write"])
+    assert key["key"].startswith(f"phc_{key['prefix']}_")
+
+    response = await client.post("/highlights/", json=HIGHLIGHT, headers=bearer(key))
+    assert response.status_code == 201
+    id = response.json()["id"]
+
+    response = await client.get(f"/highlights/id/{id}/", headers=bearer(key))
+    assert response.status_code == 200
+    assert response.json()["username"] == user["username"]
+
+    # The key is cached after its first use.
+    count_queries.reset()
+    assert (await get_api_key_store().resolve(key["key"])).id == user["id"]
+    assert len(count_queries) == 0
+
+
+@pytest.mark.asyncio
+async def test_api_key_is_limited_to_its_scopes(authenticated_client_with_db):
+    client, _ = authenticated_client_with_db
+    key = await create_key(client, ["highlights:read"])
+
+    response = await client.get("/users/me/highlights/", headers=bearer(key))
+    assert response.status_code == 200
+
+    response = await client.post("/highlights/", json=HIGHLIGHT, headers=bearer(key))
+    assert response.status_code == 403
+    assert response.headers["WWW-Authenticate"] == 'Bearer scope="highlights:write"'
+
+
+@pytest.mark.asyncio
+async def test_api_key_cannot_manage_the_account(authenticated_client_with_db):
+    client, _ = authenticated_client_with_db
+    key = await create_key(client, ["highlights:read", "highlights:write"])
+
+    assert (await client.get("/users/me/", headers=bearer(key))).status_code == 403
+    assert (await client.get("/users/me/api-keys/", headers=bearer(key))).status_code == 403
+    response = await client.post(
+        "/users/me/api-keys/", json={"name": "more", "scopes": ["highlights:write"]}, headers=bearer(key)
+    )
+    assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_revoked_api_key_is_rejected(authenticated_client_with_db):
+    client, _ = authenticated_client_with_db
+    key = await create_key(client, ["highlights:read"])
+    other = await create_key(client, ["highlights:read"], name="other")
+    assert (await client.get("/users/me/highlights/", headers=bearer(key))).status_code == 200
+
+    response = await client.delete(f"/users/me/api-keys/{key['id']}/")
+    assert response.status_code == 204
+    response = await client.delete(f"/users/me/api-keys/{key['id']}/")
+    assert response.status_code == 404
+
+    assert (await client.get("/users/me/highlights/", headers=bearer(key))).status_code == 401
+    response = await client.get("/users/me/api-keys/")
+    assert [listed["prefix"] for listed in response.json()] == [other["prefix"]]
+    assert "key" not in response.json()[0]
+
+
+@pytest.mark.asyncio
+async def test_invalid_api_keys_are_rejected(authenticated_client_with_db):
+    client, _ = authenticated_client_with_db
+    key = await create_key(client, ["highlights:read"])
+    assert (await client.get("/users/me/highlights/", headers=bearer(key))).status_code == 200
+
+    for invalid in (f"phc_{key['prefix']}_wrong", "phc_unknown_secret", "phc_", f"phc_{key['prefix']}"):
+        response = await client.get("/users/me/highlights/", headers={"Authorization": f"Bearer {invalid}"})
+        assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_api_keys_of_another_user_cannot_be_revoked(test_app_with_db, authenticated_client_with_db):
+    client, _ = authenticated_client_with_db
+    _, _, other_user, _ = test_app_with_db
+    response = await client.post(
+        "/users/token",
+        data={"username": other_user["username"], "password": other_user["password"]},
+        headers={"Authorization": ""},
+    )
+    other_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    key = await create_key(client, ["highlights:read"])
+
+    response = await client.delete(f"/users/me/api-keys/{key['id']}/", headers=other_headers)
+    assert response.status_code == 404
+    assert (await client.get("/users/me/highlights/", headers=bearer(key))).status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_deleting_a_user_invalidates_cached_api_keys(authenticated_admin_client_with_db, setup_users):
+    client, _ = authenticated_admin_client_with_db
+    user, _, _ = setup_users
+    response = await client.post(
+        "/users/token",
+        data={"username": user["username"], "password": user["password"]},
+        headers={"Authorization": ""},
+    )
+    user_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    response = await client.post(
+        "/users/me/api-keys/", json={"name": "ingestion", "scopes": ["highlights:read"]}, headers=user_headers
+    )
+    key = response.json()
+    assert (await client.get("/users/me/highlights/", headers=bearer(key))).status_code == 200
+
+    response = await client.delete(f"/users/admin/username/{user['username']}/")
+    assert response.status_code == 200
+
+    assert (await client.get("/users/me/highlights/", headers=bearer(key))).status_code == 401
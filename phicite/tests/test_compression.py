@@ -0,0 +1,161 @@
+import gzip
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.testclient import TestClient
+
+from app import compression
+from app.compression import (
+    BrotliEncoder,
+    CompressionMiddleware,
+    GzipEncoder,
+    ZstdEncoder,
+    choose_encoder,
+)
+
+HIGHLIGHTS = [
+    {
+        "id": i,
+        "doi": "10.1234/example.5678",
+        "highlight": {"1": {"rect": [100.0, 200.0, 300.0, 220.0], "text": f"highlighted text {i}"}},
+        "comment": None,
+        "created_at": "2026-10-19 09:00:00+00:00",
+    }
+    for i in range(200)
+]
+
+
+def client_for(**options) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, **options)
+
+    @app.get("/highlights")
+    async def highlights():
+        return HIGHLIGHTS
+
+    @app.get("/small")
+    async def small():
+        return {"ping": "pong"}
+
+    @app.get("/stream")
+    async def stream():
+        async def rows():
+            yield b"["
+            for i, highlight in enumerate(HIGHLIGHTS):
+                yield (b"," if i else b"") + json.dumps(highlight).encode()
+            yield b"]"
+        return StreamingResponse(rows(), media_type="application/json")
+
+    @app.get("/encoded")
+    async def encoded():
+        return Response(gzip.compress(b"x" * 4096), media_type="application/json", headers={"Content-Encoding": "gzip"})
+
+    @app.get("/binary")
+    async def binary():
+        return Response(b"\0" * 4096, media_type="application/pdf")
+
+    @app.get("/text")
+    async def text():
+        return PlainTextResponse("highlight " * 1000)
+
+    return TestClient(app)
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("gzip", "gzip"),
+        ("gzip, br", "br"),
+        ("gzip;q=1.0, br;q=0.5", "gzip"),
+        ("zstd, br, gzip", "zstd"),
+        ("*", "zstd"),
+        ("br;q=0, *;q=0.1", "zstd"),
+        ("identity", None),
+        ("gzip;q=0", None),
+        ("", None),
+    ],
+)
+def test_choose_encoder_honours_quality_and_server_preference(header, expected):
+    encoders = [ZstdEncoder(), BrotliEncoder(), GzipEncoder()]
+    encoder = choose_encoder(header, encoders)
+    assert (encoder.name if encoder else None) == expected
+
+
+def test_large_json_is_gzipped():
+    response = client_for().get("/highlights", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) < len(json.dumps(HIGHLIGHTS)) / 5
+    assert response.json() == HIGHLIGHTS
+
+
+def test_large_body_is_compressed_off_the_event_loop(monkeypatch):
+    calls = []
+
+    async def run_in_threadpool(function, *args):
+        calls.append(function)
+        return function(*args)
+    monkeypatch.setattr(compression, "run_in_threadpool", run_in_threadpool)
+
+    response = client_for(threadpool_size=1024).get("/highlights", headers={"Accept-Encoding": "gzip"})
+    assert response.json() == HIGHLIGHTS
+    assert len(calls) == 1
+
+    response = client_for().get("/highlights", headers={"Accept-Encoding": "gzip"})
+    assert response.json() == HIGHLIGHTS
+    assert len(calls) == 1
+
+
+def test_small_and_unaccepted_responses_are_not_compressed():
+    client = client_for()
+
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.json() == {"ping": "pong"}
+
+    response = client.get("/highlights", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.json() == HIGHLIGHTS
+
+
+def test_encoded_and_binary_responses_pass_through():
+    client = client_for()
+
+    response = client.get("/encoded", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.content == b"x" * 4096
+
+    response = client.get("/binary", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.content == b"\0" * 4096
+
+    response = client.get("/text", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+
+
+def test_streaming_response_is_compressed_incrementally():
+    response = client_for().get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert response.json() == HIGHLIGHTS
+
+
+@pytest.mark.skipif(compression.brotli is None, reason="brotli is not installed")
+def test_brotli_when_available():
+    client = client_for(encoders=[BrotliEncoder(), GzipEncoder()])
+    for path in ("/highlights", "/stream"):
+        response = client.get(path, headers={"Accept-Encoding": "gzip, br"})
+        assert response.headers["content-encoding"] == "br"
+        assert response.json() == HIGHLIGHTS
+
+
+@pytest.mark.skipif(compression.zstandard is None, reason="zstandard is not installed")
+def test_zstd_when_available():
+    client = client_for(encoders=[ZstdEncoder(), GzipEncoder()])
+    response = client.get("/highlights", headers={"Accept-Encoding": "zstd"})
+    assert response.headers["content-encoding"] == "zstd"
+    assert response.json() == HIGHLIGHTS
@@ -0,0 +1,59 @@
+import random
+from collections import Counter
+
+import pytest
+
+from app.api import crud
+from app.doi import doi_key
+from app.models.tortoise import DOIReader, DOIStats, HighlightPart, PDFHighlight, TextSummary, User
+from benchmarks import datagen
+
+
+def test_zipf_sampler_favours_low_ranks():
+    sample = datagen.zipf_sampler(random.Random(1), 1000, 1.1)
+    counts = Counter(sample() for _ in range(20_000))
+    assert min(counts) == 0 and max(counts) < 1000
+    assert counts[0] > counts[9] > counts[99]
+
+
+def test_generated_highlights_are_reproducible():
+    def rows(seed):
+        return list(datagen.generate_highlights(random.Random(seed), 1, 50, [1, 2, 3], 20, 1.1))
+
+    assert rows(7) == rows(7)
+    assert rows(7) != rows(8)
+
+
+def test_generated_highlight_is_stored_shape():
+    rng = random.Random(3)
+    highlight = datagen.generate_highlight(rng, datagen.text_pool(rng, 4, 30))
+    assert list(highlight) == [str(number) for number in range(1, len(highlight) + 1)]
+    for part in highlight.values():
+        assert part.keys() == {"page", "rect", "text"}
+        x1, y1, x2, y2 = part["rect"]
+        assert x1 < x2 and y1 < y2
+
+
+@pytest.mark.asyncio
+async def test_generate_fills_every_table(init_test_db):
+    written = await datagen.generate(users=20, dois=30, highlights=500, summaries=10, seed=5, chunk_size=64)
+
+    assert await User.filter(username__startswith="synthetic").count() == 20
+    assert await PDFHighlight.all().count() == 500
+    assert await TextSummary.all().count() == 10
+    assert await HighlightPart.all().count() == written["highlight_parts"]
+
+    highlights = await PDFHighlight.all().values("doi", "doi_key", "user_id", "highlight")
+    assert all(row["doi_key"] == doi_key(row["doi"]) for row in highlights)
+    assert sum(len(row["highlight"]) for row in highlights) == written["highlight_parts"]
+
+    per_doi = Counter(row["doi"] for row in highlights)
+    readers = Counter(doi for doi, _ in {(row["doi"], row["user_id"]) for row in highlights})
+    stats = {row["doi"]: row for row in await DOIStats.all().values()}
+    assert {doi: row["highlight_count"] for doi, row in stats.items()} == per_doi
+    assert {doi: row["reader_count"] for doi, row in stats.items()} == readers
+    assert await DOIReader.all().count() == sum(readers.values())
+
+    # The generated rows read back through the API paths.
+    doi, count = per_doi.most_common(1)[0]
+    assert len(await crud.get_highlights_for_doi_public(doi)) == count
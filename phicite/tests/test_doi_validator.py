@@ -1,6 +1,7 @@
 from typing import Annotated
 import pytest
 from pydantic import ValidationError, AfterValidator, BaseModel
+from app.doi import doi_key
 from app.models.pydantic import is_valid_doi
 
 
@@ -52,4 +53,24 @@ def test_doi_url_normalization():
     for input_doi, expected_output in test_cases:
         doi_obj = DoiUrl(doi=input_doi)
         # Test the string representation or a normalize() method
-        assert str(doi_obj.doi) == expected_output  # or doi_obj.normalize() == expected_output
\ No newline at end of file
+        assert str(doi_obj.doi) == expected_output  # or doi_obj.normalize() == expected_output
+
+def test_doi_url_resolver_and_encoded_formats():
+    test_cases = [
+        ("http://doi.org/10.1234/example", "10.1234/example"),
+        ("https://dx.doi.org/10.1234/Example", "10.1234/example"),
+        ("HTTPS://DOI.ORG/10.1234/EXAMPLE", "10.1234/example"),
+        ("DOI:10.1234/example", "10.1234/example"),
+        ("10.1234%2Fexample", "10.1234/example"),
+        ("https%3A%2F%2Fdoi.org%2F10.1234%2Fexample", "10.1234/example"),
+    ]
+
+    for input_doi, expected_output in test_cases:
+        assert is_valid_doi(input_doi) == expected_output
+
+def test_doi_key_matches_postgres_md5_bigint():
+    # ('x' || substr(md5(doi), 1, 16))::bit(64)::bigint, i.e. the first 16
+    # hex digits of the digest read as a two's complement 64-bit integer.
+    prefix = int("90ed81101fed2b67", 16)
+    assert doi_key("10.1234/example") == prefix - 2**64
+    assert doi_key("10.1234/example") != doi_key("10.1234/example2")
@@ -1,6 +1,11 @@
 import pytest
+from tortoise.exceptions import IntegrityError
+from app.backfill import backfill_doi_keys
+from app.doi import doi_key
 from app.models.tortoise import PDFHighlight
 from app.api.users import get_current_user
+from app.api import crud
+from app.models.pydantic import HighlightPayloadSchema
 
 highlight_json = {
     "doi": "10.1234/example.5678",
@@ -267,6 +272,61 @@ async def test_unauthenticated_user_can_read_all_public_highlights_for_a_doi(
     response = await client.get(f"/highlights/doi/{doi}/public")
     assert response.status_code == 404
 
+@pytest.mark.asyncio
+async def test_legacy_highlight_parts_are_returned_as_stored(test_app_with_db, test_highlights):
+    client, _, _, _ = test_app_with_db
+    client.headers.pop("Authorization", None)
+    single_highlight = test_highlights["single_highlight"][0]
+    legacy = {"1": {"text": "no rect"}, "2": {"rect": [1, 2, 3, 4]}, "3": {"page": 0, "rect": [1, 2, 3, 4], "text": "t"}}
+    await PDFHighlight.filter(id=single_highlight["id"]).update(highlight=legacy)
+
+    response = await client.get(f"/highlights/id/{single_highlight['id']}/public")
+    assert response.status_code == 200
+    assert response.json()["highlight"] == {
+        "1": {"text": "no rect"},
+        "2": {"rect": [1.0, 2.0, 3.0, 4.0]},
+        "3": {"page": 0, "rect": [1.0, 2.0, 3.0, 4.0], "text": "t"},
+    }
+
+@pytest.mark.asyncio
+async def test_highlights_for_a_doi_are_found_by_any_doi_spelling(
+    test_app_with_db, test_highlights
+):
+    doi = test_highlights["single_highlight"][0]["doi"]
+    client, _, _, _ = test_app_with_db
+    client.headers.pop("Authorization", None)
+
+    expected = (await client.get(f"/highlights/doi/{doi}/public")).json()
+    for spelling in (f"https://doi.org/{doi.upper()}", f"doi:{doi}", f"http://dx.doi.org/{doi}"):
+        response = await client.get(f"/highlights/doi/{spelling}/public")
+        assert response.status_code == 200
+        assert response.json() == expected
+
+@pytest.mark.asyncio
+async def test_backfill_sets_missing_doi_keys(test_highlights):
+    doi = test_highlights["single_highlight"][0]["doi"]
+    highlight_id = test_highlights["single_highlight"][0]["id"]
+    assert (await PDFHighlight.get(id=highlight_id)).doi_key == doi_key(doi)
+
+    await PDFHighlight.all().update(doi_key=None)
+    # Rows the backfill has not reached yet are still found by their DOI.
+    assert len(await crud.get_highlights_for_doi_public(doi)) == 3
+    assert len([row async for row in crud.iterate_highlights_for_dois_public([doi], 10)]) == 3
+
+    assert await backfill_doi_keys(batch_size=2) == await PDFHighlight.all().count()
+    assert await PDFHighlight.filter(doi_key__isnull=True).count() == 0
+    assert len(await crud.get_highlights_for_doi_public(doi)) == 3
+    assert await backfill_doi_keys() == 0
+
+
+@pytest.mark.asyncio
+async def test_backfill_hashes_the_normalized_doi(test_highlights):
+    highlight_id = test_highlights["single_highlight"][0]["id"]
+    await PDFHighlight.filter(id=highlight_id).update(doi="https://doi.org/10.1234/EXAMPLE.5678", doi_key=None)
+
+    await backfill_doi_keys()
+    assert (await PDFHighlight.get(id=highlight_id)).doi_key == doi_key("10.1234/example.5678")
+
 
 @pytest.mark.asyncio
 async def test_authenticated_user_can_remove_their_highlight(
@@ -427,4 +487,186 @@ async def test_authenticated_user_tries_to_update_highlight_with_doi_not_matchin
                 "type": "value_error",
             }
         ]
-    }
\ No newline at end of file
+    }
+
+@pytest.mark.asyncio
+async def test_put_highlights_applies_batch_in_one_transaction(test_highlights, setup_users):
+    user1, _, _ = setup_users
+    single_highlight = test_highlights["single_highlight"][0]
+    another_user_highlight = test_highlights["another_user_highlight"][0]
+    updated = {"1": {"rect": [100, 200, 300, 220], "text": "batched edit"}}
+
+    results = await crud.put_highlights(
+        [
+            (single_highlight["id"], HighlightPayloadSchema(doi=single_highlight["doi"], highlight=updated)),
+            (another_user_highlight["id"], HighlightPayloadSchema(doi=another_user_highlight["doi"], highlight=updated)),
+            (999, HighlightPayloadSchema(doi=single_highlight["doi"], highlight=updated)),
+        ],
+        user1["id"],
+    )
+
+    assert results[0]["id"] == single_highlight["id"]
+    assert str(results[1]) == "User does not own this highlight"
+    assert results[2] is None
+    assert (await PDFHighlight.get(id=single_highlight["id"])).highlight == updated
+    assert (await PDFHighlight.get(id=another_user_highlight["id"])).highlight == another_user_highlight["highlight"]
+
+
+@pytest.mark.asyncio
+async def test_post_highlight_for_dangling_user_id(setup_users):
+    with pytest.raises(ValueError, match="User 999999 does not exist") as excinfo:
+        await crud.post_highlight(HighlightPayloadSchema(**highlight_json), 999999)
+    assert isinstance(excinfo.value.__cause__, IntegrityError)
+    assert not await PDFHighlight.filter(user_id=999999).exists()
+
+
+@pytest.mark.asyncio
+async def test_doi_stats_track_highlight_creation_and_deletion(authenticated_client_with_db, setup_users):
+    client, user1 = authenticated_client_with_db
+    _, user2, _ = setup_users
+    doi = highlight_json["doi"]
+
+    for _ in range(2):
+        response = await client.post("/highlights/", json=highlight_json)
+        assert response.status_code == 201
+    other_id, _ = await crud.post_highlight(HighlightPayloadSchema(**highlight_json), user2["id"])
+
+    response = await client.get(f"/highlights/doi/{doi}/stats")
+    assert response.status_code == 200
+    assert response.json() == {"doi": doi, "highlight_count": 3, "reader_count": 2}
+
+    await crud.delete_highlight(other_id, user2["id"])
+    response = await client.get(f"/highlights/doi/{doi}/stats")
+    assert response.json() == {"doi": doi, "highlight_count": 2, "reader_count": 1}
+
+    response = await client.get("/highlights/doi/10.9999/unhighlighted/stats")
+    assert response.json() == {"doi": "10.9999/unhighlighted", "highlight_count": 0, "reader_count": 0}
+
+
+@pytest.mark.asyncio
+async def test_doi_stats_batch(authenticated_client_with_db):
+    client, _ = authenticated_client_with_db
+    await client.post("/highlights/", json=highlight_json)
+
+    response = await client.post(
+        "/highlights/stats", json={"dois": [highlight_json["doi"], "10.9999/unhighlighted"]}
+    )
+    assert response.status_code == 200
+    assert response.json() == [
+        {"doi": highlight_json["doi"], "highlight_count": 1, "reader_count": 1},
+        {"doi": "10.9999/unhighlighted", "highlight_count": 0, "reader_count": 0},
+    ]
+
+    response = await client.post("/highlights/stats", json={"dois": ["invalid-doi"]})
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_deleting_a_user_removes_their_doi_stats(setup_users):
+    user1, user2, _ = setup_users
+    payload = HighlightPayloadSchema(**highlight_json)
+    await crud.post_highlight(payload, user1["id"])
+    await crud.post_highlight(payload, user1["id"])
+    await crud.post_highlight(payload, user2["id"])
+
+    await crud.delete_user_in_db_by_username(user1["username"])
+
+    assert await crud.get_doi_stats([payload.doi]) == [
+        {"doi": payload.doi, "highlight_count": 1, "reader_count": 1}
+    ]
+
+
+@pytest.mark.asyncio
+async def test_unauthenticated_user_can_batch_read_highlights_for_dois(
+    test_app_with_db, test_highlights, count_queries
+):
+    client, _, _, _ = test_app_with_db
+    first_doi_highlights = test_highlights["single_highlight"] + test_highlights["another_user_highlight"]
+    second_doi_highlight = test_highlights["multiple_highlights"][1]
+
+    count_queries.reset()
+    response = await client.post(
+        "/highlights/doi/batch",
+        json={
+            "dois": ["10.9999/unhighlighted", "doi:10.1234/EXAMPLE.5679", "10.1234/example.5678"],
+            "limit_per_doi": 2,
+        },
+    )
+
+    assert response.status_code == 200
+    assert len(count_queries) == 1
+    groups = response.json()
+    assert list(groups.keys()) == ["10.1234/example.5678", "10.1234/example.5679", "10.9999/unhighlighted"]
+    assert groups["10.9999/unhighlighted"] == []
+    assert groups["10.1234/example.5678"] == [
+        {key: value for key, value in highlight.items() if key != "username"}
+        for highlight in first_doi_highlights
+    ]
+    assert groups["10.1234/example.5679"] == [
+        {key: value for key, value in second_doi_highlight.items() if key != "username"}
+    ]
+
+
+@pytest.mark.asyncio
+async def test_batch_read_highlights_rejects_invalid_requests(test_app_with_db):
+    client, _, _, _ = test_app_with_db
+
+    response = await client.post("/highlights/doi/batch", json={"dois": ["invalid-doi"]})
+    assert response.status_code == 422
+
+    response = await client.post(
+        "/highlights/doi/batch", json={"dois": [f"10.1234/example.{i}" for i in range(101)]}
+    )
+    assert response.status_code == 422
+
+    response = await client.post(
+        "/highlights/doi/batch", json={"dois": ["10.1234/example.5678"], "limit_per_doi": 0}
+    )
+    assert response.status_code == 422
+
+@pytest.mark.asyncio
+async def test_unauthenticated_user_can_read_highlight_parts_for_a_page(test_app_with_db, setup_users):
+    user1, _, _ = setup_users
+    doi = "10.1234/page.query"
+    first_id, _ = await crud.post_highlight(HighlightPayloadSchema(
+        doi=doi,
+        highlight=[
+            {"page": 1, "rect": [100, 200, 300, 220], "text": "top of page one"},
+            {"page": 2, "rect": [300, 700, 50, 680], "text": "bottom of page two"},
+        ],
+    ), user1["id"])
+    second_id, _ = await crud.post_highlight(HighlightPayloadSchema(
+        doi=doi,
+        highlight=[{"page": 1, "rect": [100, 600, 300, 620], "text": "bottom of page one"}],
+    ), user1["id"])
+    client, _, _, _ = test_app_with_db
+    client.headers.pop("Authorization", None)
+
+    response = await client.get(f"/highlights/doi/{doi}/page/1")
+    assert response.status_code == 200
+    assert [(part["highlight_id"], part["text"]) for part in response.json()] == [
+        (first_id, "top of page one"),
+        (second_id, "bottom of page one"),
+    ]
+
+    response = await client.get(f"/highlights/doi/{doi}/page/1", params={"bbox": "0,0,612,400"})
+    assert response.json() == [{
+        "highlight_id": first_id,
+        "part": "1",
+        "page": 1,
+        "rect": [100.0, 200.0, 300.0, 220.0],
+        "text": "top of page one",
+    }]
+
+    response = await client.get(f"/highlights/doi/{doi}/page/2", params={"bbox": "612,690,0,650"})
+    assert [part["rect"] for part in response.json()] == [[50.0, 680.0, 300.0, 700.0]]
+
+    await crud.put_highlight(second_id, HighlightPayloadSchema(
+        doi=doi, highlight={"1": {"page": 3, "rect": [0, 0, 10, 10], "text": "moved"}},
+    ), user1["id"])
+    assert len((await client.get(f"/highlights/doi/{doi}/page/1")).json()) == 1
+
+    response = await client.get(f"/highlights/doi/{doi}/page/1", params={"bbox": "0,0,612"})
+    assert response.status_code == 422
+    response = await client.get(f"/highlights/doi/{doi}/page/0")
+    assert response.status_code == 422
@@ -1,5 +1,9 @@
+import json
+
+import pytest
+
 from tests.conftest import current_datetime_utc_z
-from app.api import crud
+from app.api import crud, highlights
 
 def test_create_highlight_authenticated(
     test_app,
@@ -218,4 +222,161 @@ def test_update_highlight(
         headers=auth_headers
     )
     assert response.status_code == 200
-    assert response.json() == test_response_payload
\ No newline at end of file
+    assert response.json() == test_response_payload
+
+def test_create_highlight_for_missing_user(
+    test_app,
+    monkeypatch,
+    mock_get_user_by_token_data_user,
+    mock_user,
+    auth_headers,
+    mock_jwt_decode_user,
+):
+    async def mock_post_highlight(payload, user_id):
+        raise ValueError(f"User {user_id} does not exist")
+    monkeypatch.setattr(crud, "post_highlight", mock_post_highlight)
+
+    response = test_app.post(
+        "/highlights/",
+        json={
+            "doi": "10.1234/example.5678",
+            "highlight": {"1": {"rect": [100, 200, 300, 220], "text": "highlighted text"}}
+        },
+        headers=auth_headers
+    )
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "User not found"
+
+def test_create_highlight_accepts_list_of_parts(
+    test_app,
+    monkeypatch,
+    mock_get_user_by_token_data_user,
+    auth_headers,
+    mock_jwt_decode_user,
+):
+    stored = []
+
+    async def mock_post_highlight(payload, user_id):
+        stored.append(payload.stored_highlight())
+        return 1, current_datetime_utc_z()
+    monkeypatch.setattr(crud, "post_highlight", mock_post_highlight)
+
+    response = test_app.post(
+        "/highlights/",
+        json={
+            "doi": "10.1234/example.5678",
+            "highlight": [
+                {"rect": [100, 200, 300, 220], "text": "first part"},
+                {"page": 2, "rect": [50, 100, 250, 120], "text": "second part"},
+            ],
+        },
+        headers=auth_headers
+    )
+
+    assert response.status_code == 201
+    assert stored == [{
+        "1": {"rect": (100.0, 200.0, 300.0, 220.0), "text": "first part"},
+        "2": {"page": 2, "rect": (50.0, 100.0, 250.0, 120.0), "text": "second part"},
+    }]
+
+def test_create_highlight_keeps_unknown_part_keys(
+    test_app,
+    monkeypatch,
+    mock_get_user_by_token_data_user,
+    auth_headers,
+    mock_jwt_decode_user,
+):
+    stored = []
+
+    async def mock_post_highlight(payload, user_id):
+        stored.append(payload.stored_highlight())
+        return 1, current_datetime_utc_z()
+    monkeypatch.setattr(crud, "post_highlight", mock_post_highlight)
+
+    response = test_app.post(
+        "/highlights/",
+        json={
+            "doi": "10.1234/example.5678",
+            "highlight": {"1": {"rect": [100, 200, 300, 220], "text": "first part", "color": "#ffe066"}},
+        },
+        headers=auth_headers
+    )
+
+    assert response.status_code == 201
+    assert stored == [{"1": {"rect": (100.0, 200.0, 300.0, 220.0), "text": "first part", "color": "#ffe066"}}]
+
+@pytest.mark.parametrize(
+    "highlight, loc",
+    [
+        ({}, ["body", "highlight"]),
+        ({"1": {"rect": [100, 200, 300], "text": "short rect"}}, ["body", "highlight", "1", "rect", 3]),
+        ({"1": {"rect": [100, 200, 300, 220]}}, ["body", "highlight", "1", "text"]),
+        ({"1": {"rect": [100, 200, 300, 220], "text": "x" * 10_001}}, ["body", "highlight", "1", "text"]),
+        ({"1": {"page": 0, "rect": [100, 200, 300, 220], "text": "no page 0"}}, ["body", "highlight", "1", "page"]),
+        (
+            {str(i): {"rect": [0, 0, 1, 1], "text": ""} for i in range(257)},
+            ["body", "highlight"],
+        ),
+    ],
+)
+def test_create_highlight_rejects_malformed_parts(
+    test_app,
+    mock_get_user_by_token_data_user,
+    auth_headers,
+    mock_jwt_decode_user,
+    highlight,
+    loc,
+):
+    response = test_app.post(
+        "/highlights/",
+        json={"doi": "10.1234/example.5678", "highlight": highlight},
+        headers=auth_headers
+    )
+
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == loc
+
+async def encode_highlight_groups(dois, rows):
+    async def read():
+        for row in rows:
+            yield row
+    return b"".join([chunk async for chunk in highlights.encode_highlight_groups(dois, read())])
+
+@pytest.mark.asyncio
+async def test_encode_highlight_groups_without_rows():
+    body = await encode_highlight_groups(["10.1234/a", "10.1234/b"], [])
+    assert json.loads(body) == {"10.1234/a": [], "10.1234/b": []}
+
+@pytest.mark.asyncio
+async def test_encode_highlight_groups_copies_stored_json():
+    rows = [
+        {"id": 1, "doi": "10.1234/a", "highlight": '{"1": {"rect": [1, 2, 3, 4], "text": "a"}}', "comment": None, "created_at": "2025-01-01 00:00:00+00:00"},
+        {"id": 2, "doi": "10.1234/a", "highlight": {"1": {"rect": [1, 2, 3, 4], "text": "b"}}, "comment": "c", "created_at": "2025-01-01 00:00:00+00:00"},
+    ]
+    body = await encode_highlight_groups(["10.1234/a", "10.1234/b"], rows)
+    assert json.loads(body) == {
+        "10.1234/a": [
+            {"id": 1, "doi": "10.1234/a", "created_at": "2025-01-01 00:00:00+00:00", "comment": None, "highlight": {"1": {"rect": [1, 2, 3, 4], "text": "a"}}},
+            {"id": 2, "doi": "10.1234/a", "created_at": "2025-01-01 00:00:00+00:00", "comment": "c", "highlight": {"1": {"rect": [1, 2, 3, 4], "text": "b"}}},
+        ],
+        "10.1234/b": [],
+    }
+
+
+def test_read_highlights_for_a_doi_public_normalizes_doi(test_app, monkeypatch):
+    requested = []
+
+    async def mock_get_highlights_for_doi_public(doi):
+        requested.append(doi)
+        return []
+    monkeypatch.setattr(crud, "get_highlights_for_doi_public", mock_get_highlights_for_doi_public)
+
+    response = test_app.get("/highlights/doi/https://dx.doi.org/10.1234/Example.5678/public")
+    assert response.status_code == 404
+    assert requested == ["10.1234/example.5678"]
+
+    response = test_app.get("/highlights/doi/not-a-doi/public")
+    assert response.status_code == 404
+    assert response.json()["detail"] == "No highlights found for doi not-a-doi"
+    assert requested == ["10.1234/example.5678"]
@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+import fastapi.routing
+import pytest
+
+from app.instrumentation import Metrics, RequestStats, metrics, request_stats, timed_serialization
+
+
+def test_server_timing_header_reports_phases(test_app):
+    response = test_app.get("/ping")
+    assert response.status_code == 200
+    entries = [entry.strip() for entry in response.headers["server-timing"].split(",")]
+    assert entries[0].startswith("db;dur=")
+    assert entries[0].endswith('desc="0 queries"')
+    assert entries[-1].startswith("app;dur=")
+
+
+def test_authenticated_request_times_auth_and_authz(
+    test_app, mock_get_user_by_token_data_user, mock_get_user_by_id, mock_jwt_decode_user, auth_headers
+):
+    response = test_app.get("/users/me/", headers=auth_headers)
+    assert response.status_code == 200
+    phases = {entry.split(";")[0].strip() for entry in response.headers["server-timing"].split(",")}
+    assert {"db", "auth", "authz", "render", "app"} <= phases
+
+
+def test_response_serialization_is_timed_as_render(test_app):
+    assert fastapi.routing.serialize_response.instrumented
+
+    async def serialize_response(**kwargs):
+        time.sleep(0.01)
+        return kwargs["response_content"]
+
+    stats = RequestStats()
+    token = request_stats.set(stats)
+    try:
+        content = asyncio.run(timed_serialization(serialize_response)(response_content=[1]))
+    finally:
+        request_stats.reset(token)
+    assert content == [1]
+    assert stats.timings["render"] >= 0.01
+
+
+def test_metrics_endpoint_exposes_route_histograms(
+    test_app, mock_get_user_by_token_data_admin, mock_jwt_decode_admin_user, auth_headers
+):
+    test_app.get("/ping")
+    test_app.get("/no/such/route")
+
+    response = test_app.get("/metrics", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert "# TYPE phicite_request_duration_seconds histogram" in body
+    assert 'phicite_request_duration_seconds_count{method="GET",route="/ping",status="200"}' in body
+    assert 'route="unmatched",status="404"' in body
+    assert 'phicite_request_db_queries_bucket{method="GET",route="/ping",le="0"}' in body
+
+
+def test_metrics_endpoint_is_for_admins(
+    test_app, mock_get_user_by_token_data_user, mock_jwt_decode_user, auth_headers
+):
+    assert test_app.get("/metrics", headers={"Authorization": ""}).status_code == 401
+    assert test_app.get("/metrics", headers=auth_headers).status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_db_queries_are_counted_per_request(test_app_with_db, test_highlights):
+    client, _, _, _ = test_app_with_db
+    highlight = test_highlights["single_highlight"][0]
+
+    response = await client.get(f"/highlights/id/{highlight['id']}/public")
+    assert response.status_code == 200
+    assert 'desc="1 queries"' in response.headers["server-timing"]
+    assert 'route="/highlights/id/{id}/public"' in metrics.render()
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Metrics()
+    for duration in (0.001, 0.02, 0.02, 20.0):
+        registry.record("GET", "/x", 200, duration, RequestStats())
+    body = registry.render()
+    assert 'phicite_request_duration_seconds_bucket{method="GET",route="/x",status="200",le="0.005"} 1' in body
+    assert 'phicite_request_duration_seconds_bucket{method="GET",route="/x",status="200",le="0.025"} 3' in body
+    assert 'phicite_request_duration_seconds_bucket{method="GET",route="/x",status="200",le="+Inf"} 4' in body
+    assert 'phicite_request_duration_seconds_count{method="GET",route="/x",status="200"} 4' in body
@@ -0,0 +1,90 @@
+import io
+import json
+import logging
+import os
+import queue
+
+from app.logs import (
+    DebugSampler,
+    DroppingQueueHandler,
+    JSONFormatter,
+    configure_logging,
+    request_id,
+    stop_logging,
+)
+
+
+def record(level=logging.INFO, msg="hello %s", args=("world",), **extra):
+    entry = logging.LogRecord("uvicorn", level, __file__, 1, msg, args, None)
+    entry.__dict__.update(extra)
+    return entry
+
+
+def test_json_formatter_includes_request_id_and_extra_fields():
+    entry = record(request_id="abc123", username="testuser")
+    line = json.loads(JSONFormatter().format(entry))
+    assert line["message"] == "hello world"
+    assert line["level"] == "INFO"
+    assert line["logger"] == "uvicorn"
+    assert line["request_id"] == "abc123"
+    assert line["username"] == "testuser"
+
+
+def test_debug_sampler_only_samples_debug_records():
+    assert not DebugSampler(0.0).filter(record(logging.DEBUG))
+    assert DebugSampler(1.0).filter(record(logging.DEBUG))
+    assert DebugSampler(0.0).filter(record(logging.INFO))
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    handler.handle(record())
+    handler.handle(record())
+    assert handler.dropped == 1
+    assert handler.queue.get_nowait().msg == "hello world"
+
+
+def test_configured_loggers_write_json_with_request_id():
+    stream = io.StringIO()
+    configure_logging("INFO", "json", stream=stream)
+    token = request_id.set("req-1")
+    try:
+        logging.getLogger("uvicorn").info("Login failed", extra={"username": "testuser"})
+        logging.getLogger("uvicorn").debug("not logged at INFO")
+    finally:
+        request_id.reset(token)
+        stop_logging()
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [(line["message"], line["request_id"], line["username"]) for line in lines] == [
+        ("Login failed", "req-1", "testuser")
+    ]
+
+
+def test_request_id_is_echoed_or_generated(test_app):
+    response = test_app.get("/ping", headers={"X-Request-ID": "client-supplied.id"})
+    assert response.headers["x-request-id"] == "client-supplied.id"
+
+    response = test_app.get("/ping", headers={"X-Request-ID": "not a valid id!"})
+    assert len(response.headers["x-request-id"]) == 32
+    assert response.headers["x-request-id"] != test_app.get("/ping").headers["x-request-id"]
+
+
+def test_forked_child_gets_its_own_listener(tmp_path):
+    path = tmp_path / "log.jsonl"
+    with open(path, "w") as stream:
+        configure_logging("INFO", "json", stream=stream)
+        try:
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    logging.getLogger("uvicorn").info("from the child")
+                    stop_logging()
+                    stream.flush()
+                finally:
+                    os._exit(0)
+            os.waitpid(pid, 0)
+        finally:
+            stop_logging()
+
+    assert [json.loads(line)["message"] for line in path.read_text().splitlines()] == ["from the child"]
@@ -0,0 +1,136 @@
+import pytest
+
+from app.models.tortoise import PDFHighlight, TextSummary
+
+# Tokens issued at login carry what get_current_user needs, so
+# authenticating a request takes no query.
+AUTH_QUERIES = 0
+# Creating or deleting a highlight updates doi_reader and doi_stats.
+DOI_STATS_QUERIES = 2
+# Creating a highlight inserts its highlight_part rows; updating one
+# deletes and reinserts them.
+CREATE_PART_QUERIES = 1
+REPLACE_PART_QUERIES = 2
+
+new_highlight = {
+    "doi": "10.1234/example.5678",
+    "highlight": {"1": {"rect": [100, 200, 300, 220], "text": "first part"}},
+    "comment": "This is an important passage",
+}
+
+updated_highlight = {
+    "doi": "10.1234/example.5678",
+    "highlight": {"1": {"rect": [100, 200, 300, 220], "text": "updated highlight"}},
+    "comment": "Updated comment",
+}
+
+
+@pytest.mark.asyncio
+async def test_create_highlight_does_not_fetch_the_user(authenticated_client_with_db, count_queries):
+    client, _ = authenticated_client_with_db
+
+    count_queries.reset()
+    response = await client.post("/highlights/", json=new_highlight)
+
+    assert response.status_code == 201
+    assert len(count_queries) == AUTH_QUERIES + 1 + CREATE_PART_QUERIES + DOI_STATS_QUERIES
+    assert count_queries.queries[AUTH_QUERIES].lstrip().upper().startswith("INSERT")
+
+
+@pytest.mark.asyncio
+async def test_update_highlight_is_a_single_statement(
+    authenticated_client_with_db, test_highlights, count_queries
+):
+    client, _ = authenticated_client_with_db
+    single_highlight = test_highlights["single_highlight"][0]
+
+    count_queries.reset()
+    response = await client.put(f"/highlights/id/{single_highlight['id']}/", json=updated_highlight)
+
+    assert response.status_code == 200
+    assert len(count_queries) == AUTH_QUERIES + 1 + REPLACE_PART_QUERIES
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "highlight_key, payload_doi, status_code",
+    [
+        ("another_user_highlight", "10.1234/example.5678", 403),
+        ("single_highlight", "10.9876/example.5432", 422),
+        (None, "10.1234/example.5678", 404),
+    ],
+)
+async def test_rejected_update_probes_once(
+    authenticated_client_with_db, test_highlights, count_queries, highlight_key, payload_doi, status_code
+):
+    client, _ = authenticated_client_with_db
+    id = test_highlights[highlight_key][0]["id"] if highlight_key else 999
+
+    count_queries.reset()
+    response = await client.put(f"/highlights/id/{id}/", json={**updated_highlight, "doi": payload_doi})
+
+    assert response.status_code == status_code
+    assert len(count_queries) == AUTH_QUERIES + 2
+
+
+@pytest.mark.asyncio
+async def test_delete_highlight_is_a_single_statement(
+    authenticated_client_with_db, test_highlights, count_queries
+):
+    client, _ = authenticated_client_with_db
+    single_highlight = test_highlights["single_highlight"][0]
+
+    count_queries.reset()
+    response = await client.delete(f"/highlights/id/{single_highlight['id']}/")
+
+    assert response.status_code == 200
+    assert len(count_queries) == AUTH_QUERIES + 1 + DOI_STATS_QUERIES
+    assert not await PDFHighlight.exists(id=single_highlight["id"])
+
+
+@pytest.mark.asyncio
+async def test_rejected_delete_probes_once(
+    authenticated_client_with_db, test_highlights, count_queries
+):
+    client, _ = authenticated_client_with_db
+    another_user_highlight = test_highlights["another_user_highlight"][0]
+
+    count_queries.reset()
+    response = await client.delete(f"/highlights/id/{another_user_highlight['id']}/")
+
+    assert response.status_code == 403
+    assert len(count_queries) == AUTH_QUERIES + 2
+    assert await PDFHighlight.exists(id=another_user_highlight["id"])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "path",
+    ["/highlights/", "/highlights/doi/10.1234/example.5678/", "/highlights/id/{id}/"],
+)
+async def test_highlight_reads_join_the_user(
+    authenticated_client_with_db, test_highlights, assert_max_queries, path
+):
+    client, _ = authenticated_client_with_db
+    path = path.format(id=test_highlights["single_highlight"][0]["id"])
+
+    with assert_max_queries(AUTH_QUERIES + 1):
+        response = await client.get(path)
+
+    assert response.status_code == 200
+    assert response.json()
+
+
+@pytest.mark.asyncio
+@pytest.mark.max_queries(2)
+async def test_update_summary_is_a_single_statement(test_app_with_db):
+    client, _, _, _ = test_app_with_db
+    # One INSERT here, then one UPDATE for the request.
+    summary = await TextSummary.create(url="https://foo.bar/", summary="")
+
+    response = await client.put(
+        f"/summaries/{summary.id}/", json={"url": "https://foo.bar/", "summary": "updated!"}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["summary"] == "updated!"
@@ -0,0 +1,152 @@
+import pytest
+
+from app import auth
+from app.api import summaries
+from app.config import Settings
+from app.ratelimit import MemoryBackend, RateLimit, RateLimits
+
+
+class Clock:
+    def __init__(self, now: float = 6000.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.mark.asyncio
+async def test_limit_slides_across_windows():
+    clock = Clock()
+    limit = RateLimit(MemoryBackend(clock), "test", limit=10, window=60)
+
+    for _ in range(10):
+        assert await limit.count("key") is None
+    wait = await limit.count("key")
+    assert wait == pytest.approx(60 + 60 * (1 - 10 / 11))
+
+    # Halfway into the next window half of the last one's 11 still count.
+    clock.now += 90
+    for _ in range(4):
+        assert await limit.count("key") is None
+    assert await limit.count("key") is not None
+
+    # Two windows later nothing is left.
+    clock.now += 120
+    assert await limit.check("key") is None
+    assert await limit.count("other") is None
+
+
+@pytest.mark.asyncio
+async def test_zero_limit_never_refuses():
+    limit = RateLimit(MemoryBackend(), "test", limit=0, window=60)
+    for _ in range(100):
+        assert await limit.count("key") is None
+
+
+def use_limits(client, **limits) -> None:
+    client._transport.app.state.resources.rate_limits = RateLimits(Settings(**limits))
+
+
+async def login(client, username, password):
+    return await client.post("/users/token", data={"username": username, "password": password})
+
+
+@pytest.mark.asyncio
+async def test_failed_logins_lock_the_username_before_hashing(test_app_with_db, monkeypatch):
+    client, user, _, _ = test_app_with_db
+    use_limits(client, login_failures_per_username=3)
+    for _ in range(3):
+        assert (await login(client, user["username"], "wrong")).status_code == 401
+
+    def no_bcrypt(*args):
+        raise AssertionError("password verified while rate limited")
+
+    monkeypatch.setattr(auth, "verify_password", no_bcrypt)
+    response = await login(client, user["username"], user["password"])
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) > 0
+
+
+@pytest.mark.asyncio
+async def test_failed_logins_lock_the_username_only_from_their_address(test_app_with_db):
+    client, user, _, _ = test_app_with_db
+    use_limits(client, login_failures_per_username=3)
+    for _ in range(3):
+        assert (await login(client, user["username"], "wrong")).status_code == 401
+    assert (await login(client, user["username"], user["password"])).status_code == 429
+
+    client._transport.client = ("203.0.113.7", 123)
+    assert (await login(client, user["username"], user["password"])).status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_failed_logins_from_many_addresses_lock_the_account(test_app_with_db):
+    client, user, _, _ = test_app_with_db
+    use_limits(client, login_failures_per_username=3, login_failures_per_account=4)
+    for number in range(4):
+        client._transport.client = (f"203.0.113.{number}", 123)
+        assert (await login(client, user["username"], "wrong")).status_code == 401
+
+    client._transport.client = ("203.0.113.99", 123)
+    assert (await login(client, user["username"], user["password"])).status_code == 429
+
+
+@pytest.mark.asyncio
+async def test_successful_logins_do_not_lock_the_username(test_app_with_db):
+    client, user, _, _ = test_app_with_db
+    use_limits(client, login_failures_per_username=1)
+    for _ in range(3):
+        assert (await login(client, user["username"], user["password"])).status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_logins_are_limited_per_address(test_app_with_db):
+    client, user, another_user, _ = test_app_with_db
+    use_limits(client, login_attempts_per_ip=2)
+    assert (await login(client, user["username"], user["password"])).status_code == 200
+    assert (await login(client, another_user["username"], "wrong")).status_code == 401
+    assert (await login(client, "someone-else", "guess")).status_code == 429
+
+
+@pytest.mark.asyncio
+async def test_summary_submissions_are_limited(test_app_with_db, monkeypatch):
+    client, _, _, _ = test_app_with_db
+
+    async def mock_generate_summary(summary_id, url):
+        return None
+
+    monkeypatch.setattr(summaries, "generate_summary", mock_generate_summary)
+    use_limits(client, summary_requests_per_ip=2)
+    for _ in range(2):
+        assert (await client.post("/summaries/", json={"url": "https://foo.bar/"})).status_code == 201
+    assert (await client.post("/summaries/", json={"url": "https://foo.bar/"})).status_code == 429
+
+
+@pytest.mark.asyncio
+async def test_highlight_writes_are_limited_per_user(authenticated_client_with_db):
+    client, _ = authenticated_client_with_db
+    use_limits(client, highlight_writes_per_user=1)
+    highlight = {"doi": "10.1234/example.5678", "highlight": {"1": {"rect": [1, 2, 3, 4], "text": "a"}}}
+
+    assert (await client.post("/highlights/", json=highlight)).status_code == 201
+    assert (await client.post("/highlights/", json=highlight)).status_code == 429
+
+
+@pytest.mark.asyncio
+async def test_limits_can_be_disabled(test_app_with_db):
+    client, user, _, _ = test_app_with_db
+    use_limits(client, rate_limit_enabled=False, login_failures_per_username=1)
+    for _ in range(3):
+        assert (await login(client, user["username"], "wrong")).status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_token_refreshes_are_limited_per_address(test_app_with_db):
+    client, _, _, _ = test_app_with_db
+    use_limits(client, token_refreshes_per_ip=2)
+    for _ in range(2):
+        response = await client.post("/users/token/refresh", json={"refresh_token": "1.0.guess"})
+        assert response.status_code == 401
+    response = await client.post("/users/token/refresh", json={"refresh_token": "1.0.guess"})
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.config import Settings
+from app.main import create_application
+from app import resources as resources_module
+from app.resources import Resources
+
+
+@pytest.mark.asyncio
+async def test_drain_waits_for_jobs_that_finish_in_time():
+    resources = Resources(Settings(), manage_database=False)
+    finished = []
+
+    async def job():
+        await asyncio.sleep(0.01)
+        finished.append(True)
+
+    resources.spawn(job())
+    await resources.drain(timeout=5)
+
+    assert finished == [True]
+    assert not resources.jobs
+
+
+@pytest.mark.asyncio
+async def test_drain_cancels_jobs_past_the_timeout():
+    resources = Resources(Settings(), manage_database=False)
+    task = resources.spawn(asyncio.sleep(60))
+
+    await resources.drain(timeout=0.01)
+
+    assert task.cancelled()
+    assert not resources.jobs
+
+
+@pytest.mark.asyncio
+async def test_failed_job_is_logged_and_forgotten(monkeypatch):
+    errors = []
+    monkeypatch.setattr(resources_module.log, "error", lambda *args, **kwargs: errors.append(args))
+    resources = Resources(Settings(), manage_database=False)
+
+    async def job():
+        raise RuntimeError("boom")
+
+    task = resources.spawn(job())
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert not resources.jobs
+    assert errors and "failed" in errors[0][0]
+
+
+def test_lifespan_drains_jobs_spawned_while_serving():
+    app = create_application()
+    finished = []
+
+    async def job():
+        await asyncio.sleep(0.01)
+        finished.append(True)
+
+    async def spawn():
+        app.state.resources.spawn(job())
+
+    with TestClient(app) as client:
+        client.portal.call(spawn)
+    assert finished == [True]
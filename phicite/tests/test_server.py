@@ -0,0 +1,16 @@
+import pytest
+
+from app.server import format_memory, memory_usage
+
+
+def test_memory_usage_reports_shared_and_private():
+    usage = memory_usage()
+    if not usage:
+        pytest.skip("no /proc/self/smaps_rollup here")
+    assert usage["Rss"] >= usage["Private_Clean"] + usage["Private_Dirty"]
+    assert format_memory(usage).startswith("rss=")
+
+
+def test_memory_usage_of_missing_process_is_empty():
+    assert memory_usage(0) == {}
+    assert format_memory({}) == "unavailable"
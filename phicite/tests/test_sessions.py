@@ -0,0 +1,188 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app import auth
+from app.api import crud
+from app.models.tortoise import UserSession
+
+
+async def login(client, user):
+    response = await client.post(
+        "/users/token",
+        data={"username": user["username"], "password": user["password"]},
+        headers={"Authorization": ""},
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+async def refresh(client, refresh_token):
+    return await client.post("/users/token/refresh", json={"refresh_token": refresh_token})
+
+
+def bearer(tokens):
+    return {"Authorization": f"Bearer {tokens['access_token']}"}
+
+
+@pytest.mark.asyncio
+async def test_refresh_token_renews_without_the_password(test_app_with_db, monkeypatch, count_queries):
+    client, user, _, _ = test_app_with_db
+    tokens = await login(client, user)
+
+    def no_bcrypt(*args):
+        raise AssertionError("renewal verified a password")
+
+    monkeypatch.setattr(auth, "verify_password", no_bcrypt)
+    count_queries.reset()
+    response = await refresh(client, tokens["refresh_token"])
+
+    assert response.status_code == 200
+    renewed = response.json()
+    assert renewed["refresh_token"] != tokens["refresh_token"]
+    # Read the session, rotate it, read the user.
+    assert len(count_queries) == 3
+
+    count_queries.reset()
+    response = await refresh(client, renewed["refresh_token"])
+    assert response.status_code == 200
+    # The user is cached.
+    assert len(count_queries) == 2
+
+    response = await client.get("/users/me/highlights/", headers=bearer(response.json()))
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_reused_refresh_token_ends_the_session(test_app_with_db):
+    client, user, _, _ = test_app_with_db
+    first = await login(client, user)
+    second = (await refresh(client, first["refresh_token"])).json()
+
+    response = await refresh(client, first["refresh_token"])
+    assert response.status_code == 401
+
+    # Whoever holds the rotated token is logged out too.
+    response = await refresh(client, second["refresh_token"])
+    assert response.status_code == 401
+    response = await client.get("/users/me/highlights/", headers=bearer(second))
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_any_superseded_refresh_token_ends_the_session(test_app_with_db):
+    client, user, _, _ = test_app_with_db
+    first = await login(client, user)
+    second = (await refresh(client, first["refresh_token"])).json()
+    third = (await refresh(client, second["refresh_token"])).json()
+
+    # Two rotations back, not only the last one.
+    response = await refresh(client, first["refresh_token"])
+    assert response.status_code == 401
+    response = await refresh(client, third["refresh_token"])
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_forged_old_generation_does_not_end_the_session(test_app_with_db):
+    client, user, _, _ = test_app_with_db
+    first = await login(client, user)
+    second = (await refresh(client, first["refresh_token"])).json()
+    id = second["refresh_token"].split(".")[0]
+
+    for refresh_token in (f"{id}.0.forged", f"{id}.5.forged"):
+        response = await refresh(client, refresh_token)
+        assert response.status_code == 401
+
+    response = await refresh(client, second["refresh_token"])
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_ended_and_expired_sessions_are_pruned(test_app_with_db):
+    client, user, _, _ = test_app_with_db
+    live = await login(client, user)
+    ended = await login(client, user)
+    expired = await login(client, user)
+    await client.post("/users/token/revoke", json={"refresh_token": ended["refresh_token"]}, headers=bearer(ended))
+    expired_id = int(expired["refresh_token"].split(".")[0])
+    await UserSession.filter(id=expired_id).update(expires_at=datetime.now(timezone.utc) - timedelta(minutes=1))
+
+    assert await crud.prune_sessions(datetime.now(timezone.utc)) == 2
+
+    assert await UserSession.filter(user_id=user["id"]).count() == 1
+    assert (await refresh(client, live["refresh_token"])).status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_invalid_refresh_tokens_are_rejected(test_app_with_db):
+    client, user, _, _ = test_app_with_db
+    tokens = await login(client, user)
+    id, _, _ = tokens["refresh_token"].partition(".")
+
+    for refresh_token in ("", "garbage", f"{id}.wrong-secret", "999999.secret"):
+        response = await refresh(client, refresh_token)
+        assert response.status_code == 401
+
+    # A wrong secret is not taken for reuse.
+    response = await refresh(client, tokens["refresh_token"])
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_expired_session_cannot_be_renewed(test_app_with_db):
+    client, user, _, _ = test_app_with_db
+    tokens = await login(client, user)
+    await UserSession.filter(user_id=user["id"]).update(
+        expires_at=datetime.now(timezone.utc) - timedelta(minutes=1)
+    )
+
+    response = await refresh(client, tokens["refresh_token"])
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_renewal_does_not_outlive_the_session_lifetime(test_app_with_db):
+    client, user, _, _ = test_app_with_db
+    tokens = await login(client, user)
+    started = datetime.now(timezone.utc) - timedelta(days=89, hours=23)
+    await UserSession.filter(user_id=user["id"]).update(created_at=started)
+
+    response = await refresh(client, tokens["refresh_token"])
+    assert response.status_code == 200
+    session = await UserSession.get(user_id=user["id"])
+    assert session.expires_at == started + timedelta(days=90)
+
+    await UserSession.filter(user_id=user["id"]).update(created_at=started - timedelta(hours=2))
+    response = await refresh(client, response.json()["refresh_token"])
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_logout_ends_one_session(test_app_with_db):
+    client, user, _, _ = test_app_with_db
+    this = await login(client, user)
+    other = await login(client, user)
+
+    response = await client.post(
+        "/users/token/revoke", json={"refresh_token": this["refresh_token"]}, headers=bearer(this)
+    )
+    assert response.status_code == 204
+
+    assert (await refresh(client, this["refresh_token"])).status_code == 401
+    assert (await refresh(client, other["refresh_token"])).status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_logout_everywhere_ends_every_session(test_app_with_db):
+    client, user, _, _ = test_app_with_db
+    this = await login(client, user)
+    other = await login(client, user)
+
+    response = await client.post("/users/me/sessions/revoke", headers=bearer(this))
+    assert response.status_code == 204
+
+    assert (await refresh(client, this["refresh_token"])).status_code == 401
+    assert (await refresh(client, other["refresh_token"])).status_code == 401
+    response = await client.get("/users/me/highlights/", headers=bearer(other))
+    assert response.status_code == 401
@@ -1,12 +1,14 @@
 import pytest
 
+from app import summarizer
 from app.api import summaries
+from app.models.tortoise import TextSummary
 
 
 @pytest.mark.asyncio
 async def test_create_summary(test_app_with_db, monkeypatch):
     client, _, _, _ = test_app_with_db
-    def mock_generate_summary(summary_id, url):
+    async def mock_generate_summary(summary_id, url):
         return None
     monkeypatch.setattr(summaries, "generate_summary", mock_generate_summary)
 
@@ -38,7 +40,7 @@ def test_create_summaries_invalid_json(test_app):
 @pytest.mark.asyncio
 async def test_read_summary(test_app_with_db, monkeypatch):
     client, _, _, _ = test_app_with_db
-    def mock_generate_summary(summary_id, url):
+    async def mock_generate_summary(summary_id, url):
         return None
     monkeypatch.setattr(summaries, "generate_summary", mock_generate_summary)
 
@@ -79,7 +81,7 @@ async def test_read_summary_incorrect_id(test_app_with_db):
 @pytest.mark.asyncio
 async def test_read_all_summaries(test_app_with_db, monkeypatch):
     client, _, _, _ = test_app_with_db
-    def mock_generate_summary(summary_id, url):
+    async def mock_generate_summary(summary_id, url):
         return None
     monkeypatch.setattr(summaries, "generate_summary", mock_generate_summary)
 
@@ -95,7 +97,7 @@ async def test_read_all_summaries(test_app_with_db, monkeypatch):
 @pytest.mark.asyncio
 async def test_remove_summary(test_app_with_db, monkeypatch):
     client, _, _, _ = test_app_with_db
-    def mock_generate_summary(summary_id, url):
+    async def mock_generate_summary(summary_id, url):
         return None
     monkeypatch.setattr(summaries, "generate_summary", mock_generate_summary)
 
@@ -132,7 +134,7 @@ async def test_remove_summary_incorrect_id(test_app_with_db):
 @pytest.mark.asyncio
 async def test_update_summary(test_app_with_db, monkeypatch):
     client, _, _, _ = test_app_with_db
-    def mock_generate_summary(summary_id, url):
+    async def mock_generate_summary(summary_id, url):
         return None
 
     monkeypatch.setattr(summaries, "generate_summary", mock_generate_summary)
@@ -228,4 +230,37 @@ def test_update_summary_invalid_url(test_app):
     assert response.status_code == 422
     assert (
         response.json()["detail"][0]["msg"] == "URL scheme should be 'http' or 'https'"
-    )
\ No newline at end of file
+    )
+@pytest.mark.asyncio
+async def test_resume_summaries_generates_the_empty_ones(test_app_with_db, monkeypatch):
+    interrupted = await TextSummary.create(url="https://foo.bar/interrupted", summary="")
+    done = await TextSummary.create(url="https://foo.bar/done", summary="already summarized")
+    summarized = []
+
+    def mock_summarize(url):
+        summarized.append(url)
+        return f"summary of {url}"
+    monkeypatch.setattr(summarizer, "summarize", mock_summarize)
+
+    await summarizer.resume_summaries(3)
+
+    assert summarized == [interrupted.url]
+    assert (await TextSummary.get(id=interrupted.id)).summary == "summary of https://foo.bar/interrupted"
+    assert (await TextSummary.get(id=done.id)).summary == "already summarized"
+
+
+@pytest.mark.asyncio
+async def test_resume_summaries_gives_up_after_the_last_attempt(test_app_with_db, monkeypatch):
+    failing = await TextSummary.create(url="https://foo.bar/failing", summary="")
+    tried = []
+
+    def mock_summarize(url):
+        tried.append(url)
+        raise ValueError("unreachable")
+    monkeypatch.setattr(summarizer, "summarize", mock_summarize)
+
+    for _ in range(3):
+        await summarizer.resume_summaries(2)
+
+    assert tried == [failing.url, failing.url]
+    assert (await TextSummary.get(id=failing.id)).attempts == 2
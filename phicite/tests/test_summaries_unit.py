@@ -13,7 +13,7 @@ def test_create_summary(test_app, monkeypatch):
         return 1
     monkeypatch.setattr(crud, "post_summary", mock_post)
 
-    def mock_generate_summary(summary_id, url):
+    async def mock_generate_summary(summary_id, url):
         return None
     monkeypatch.setattr(summaries, "generate_summary", mock_generate_summary)
 
@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import pytest
+from jwt.exceptions import InvalidTokenError
+
+from app.api import crud
+from app.config import Settings
+from app.models.pydantic import UserInDBSchema
+from app.tokens import TokenService
+
+SECRET = "a-test-secret-that-is-long-enough-for-hs256"
+
+
+def make_user(**fields):
+    return UserInDBSchema(**{
+        "id": 7,
+        "username": "reader",
+        "email": "reader@example.com",
+        "full_name": None,
+        "disabled": False,
+        "is_admin": False,
+        "hashed_password": "x",
+        **fields,
+    })
+
+
+def test_token_carries_the_user():
+    tokens = TokenService.from_settings(Settings(jwt_secret_key=SECRET))
+    claims = tokens.verify(tokens.issue(make_user(is_admin=True)))
+
+    user = tokens.user(claims)
+    assert (user.id, user.username, user.is_admin, user.disabled) == (7, "reader", True, False)
+    assert "email" not in claims
+
+
+def test_token_without_user_claims_needs_a_lookup():
+    tokens = TokenService.from_settings(Settings(jwt_secret_key=SECRET))
+    token = jwt.encode({"sub": "reader"}, SECRET, algorithm="HS256")
+
+    assert tokens.user(tokens.verify(token)) is None
+
+
+def test_expired_token_is_rejected():
+    tokens = TokenService.from_settings(Settings(jwt_secret_key=SECRET, access_token_expire_minutes=-1))
+
+    with pytest.raises(InvalidTokenError):
+        tokens.verify(tokens.issue(make_user()))
+
+
+def test_missing_key_fails_at_startup():
+    with pytest.raises(ValueError):
+        TokenService.from_settings(Settings(jwt_secret_key=None))
+    with pytest.raises(ValueError):
+        TokenService.from_settings(Settings(jwt_algorithm="EdDSA"))
+
+
+def test_asymmetric_keys_sign_and_verify(tmp_path):
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+    private_key = Ed25519PrivateKey.generate()
+    private_file = tmp_path / "private.pem"
+    private_file.write_bytes(private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ))
+    public_file = tmp_path / "public.pem"
+    public_file.write_bytes(private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ))
+
+    issuer = TokenService.from_settings(Settings(jwt_algorithm="EdDSA", jwt_private_key_file=private_file))
+    verifier = TokenService.from_settings(Settings(jwt_algorithm="EdDSA", jwt_public_key_file=public_file))
+    token = issuer.issue(make_user())
+
+    assert verifier.user(verifier.verify(token)).id == 7
+    with pytest.raises(RuntimeError):
+        verifier.issue(make_user())
+
+
+@pytest.mark.asyncio
+async def test_revoked_token_is_rejected(authenticated_client_with_db):
+    client, _ = authenticated_client_with_db
+
+    response = await client.post("/users/token/revoke")
+    assert response.status_code == 204
+
+    response = await client.get("/users/me/")
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_deleting_a_user_revokes_their_tokens(authenticated_admin_client_with_db, setup_users):
+    client, _ = authenticated_admin_client_with_db
+    user, _, _ = setup_users
+    response = await client.post(
+        "/users/token",
+        data={"username": user["username"], "password": user["password"]},
+        headers={"Authorization": ""},
+    )
+    user_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    response = await client.delete(f"/users/admin/username/{user['username']}/")
+    assert response.status_code == 200
+
+    response = await client.get("/users/me/highlights/", headers=user_headers)
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_revocations_from_other_workers_are_picked_up(init_test_db, token_service):
+    token = token_service.issue(make_user())
+    claims = token_service.verify(token)
+
+    # Recorded by another process: this one only learns of it on refresh.
+    now = datetime.now(timezone.utc)
+    await crud.post_token_revocation(claims["jti"], None, now, now + timedelta(minutes=15))
+    token_service.verify(token)
+
+    await token_service.refresh_revocations()
+    with pytest.raises(InvalidTokenError):
+        token_service.verify(token)
@@ -209,7 +209,7 @@ async def test_authenticate_user(test_app_with_db, setup_users):
     response_dict = response.json()
     assert response_dict["access_token"] is not None
     assert response_dict["token_type"] == "bearer"
-    assert response_dict.keys() == {"access_token", "token_type"}
+    assert response_dict.keys() == {"access_token", "token_type", "refresh_token"}
 
     auth_payload = {"username": user1["username"], "password": "wrong_password"}
 
@@ -274,4 +274,70 @@ async def test_authenticated_user_can_get_my_highlights(authenticated_client_wit
     assert isinstance(response.json()[0], dict)
     assert len(response.json()) == 4
     for highlight in response.json():
-        assert highlight in user_highlights
\ No newline at end of file
+        assert highlight in user_highlights
+
+@pytest.mark.asyncio
+async def test_authenticated_user_can_page_through_highlight_library(authenticated_client_with_db, test_highlights):
+    client, user = authenticated_client_with_db
+    user_highlights = [
+        highlight
+        for highlights in test_highlights.values()
+        for highlight in highlights
+        if highlight["username"] == user["username"]
+    ]
+
+    response = await client.get("/users/me/highlights/library/", params={"limit": 2})
+    assert response.status_code == 200
+    first_page = response.json()
+    assert [item["doi"] for item in first_page["items"]] == ["10.1234/example.5678"]
+    assert len(first_page["items"][0]["highlights"]) == 2
+    assert first_page["next_cursor"] is not None
+
+    response = await client.get(
+        "/users/me/highlights/library/", params={"limit": 2, "cursor": first_page["next_cursor"]}
+    )
+    assert response.status_code == 200
+    second_page = response.json()
+    assert [item["doi"] for item in second_page["items"]] == ["10.1234/example.5679", "10.1234/example.5680"]
+    assert second_page["next_cursor"] is None
+
+    paged = [
+        highlight
+        for page in (first_page, second_page)
+        for item in page["items"]
+        for highlight in item["highlights"]
+    ]
+    expected = [
+        {key: value for key, value in highlight.items() if key != "username"}
+        for highlight in user_highlights
+    ]
+    assert sorted(paged, key=lambda h: h["id"]) == sorted(expected, key=lambda h: h["id"])
+
+
+@pytest.mark.asyncio
+async def test_highlight_library_rejects_invalid_cursor(authenticated_client_with_db):
+    client, _ = authenticated_client_with_db
+    response = await client.get("/users/me/highlights/library/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 422
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+@pytest.mark.asyncio
+async def test_authenticated_user_can_get_highlight_summary(
+    authenticated_client_with_db, test_highlights, count_queries
+):
+    client, _ = authenticated_client_with_db
+
+    count_queries.reset()
+    response = await client.get("/users/me/highlights/summary/")
+
+    assert response.status_code == 200
+    summary = {entry["doi"]: entry for entry in response.json()}
+    assert {doi: entry["count"] for doi, entry in summary.items()} == {
+        "10.1234/example.5678": 2,
+        "10.1234/example.5679": 1,
+        "10.1234/example.5680": 1,
+    }
+    assert summary["10.1234/example.5679"]["last_activity"] == test_highlights["multiple_highlights"][1]["created_at"]
+    # the token authenticates without a query; one GROUP BY
+    assert len(count_queries) == 1